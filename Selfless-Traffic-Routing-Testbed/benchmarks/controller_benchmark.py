@@ -0,0 +1,249 @@
+'''
+Measures the cost of the routing policies alone, with no SUMO simulation in the loop.
+
+For every (map, policy, batch size) cell the benchmark loads the map into a
+ConnectionInfo, synthesizes random edge vehicle counts and batches of vehicles with a
+reachable destination, and times route_controller.make_decisions on them:
+decisions per second, latency percentiles of a call and peak memory allocated by a
+call (measured with tracemalloc in separate, untimed calls). The maps are the bundled
+ones plus synthetic grids of increasing size (see synthetic_networks.py).
+
+The results are written as JSON, together with the commit they were measured on, so
+two runs can be compared with --compare to spot regressions.
+
+Example:
+    python3 benchmarks/controller_benchmark.py --grid-sizes 10,20 --batch-sizes 1,10,100 \
+        --output benchmarks/results.json --compare benchmarks/results-before.json
+'''
+import json
+import optparse
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_ROOT)
+
+from core.Util import ConnectionInfo, Vehicle
+from core.reachability import ReachabilityIndex
+from controller.RouteController import RandomPolicy, NathanPolicy
+from controller.DijkstraController import DijkstraPolicy
+from controller.QLearningController import QLearningPolicy, MODEL_BACKENDS, NUMPY
+from benchmarks.synthetic_networks import grid_topology
+from core.result_sink import configure_diagnostics
+
+BUNDLED_MAPS = ["configurations/simple_grid1.net.xml", "configurations/simple_grid2.net.xml",
+                "configurations/complex_grid1.net.xml", "configurations/test.net.xml"]
+POLICIES = ["dijkstra", "nathan", "random", "qlearning"]
+DEFAULT_MODEL_FILE = "test/rl-high-all-fixed-late.h5"
+PERCENTILES = [50, 95, 99]
+# mean number of vehicles per edge of the synthetic edge counts
+MEAN_EDGE_VEHICLES = 2.0
+
+
+def load_maps(net_files, grid_sizes):
+    '''
+    :return <list>: (name, ConnectionInfo) of every bundled map and synthetic grid
+    '''
+    maps = []
+    for net_file in net_files:
+        maps.append((os.path.basename(net_file).replace(".net.xml", ""),
+                     ConnectionInfo(os.path.join(REPOSITORY_ROOT, net_file))))
+    for size in grid_sizes:
+        maps.append(("grid{}".format(size), ConnectionInfo.from_topology(grid_topology(size))))
+    return maps
+
+
+def make_policy(policy, connection_info, model_file, model_backend):
+    '''
+    :return <RouteController>: the policy, or None if it cannot run on this map
+    '''
+    if policy == "dijkstra":
+        return DijkstraPolicy(connection_info)
+    if policy == "nathan":
+        return NathanPolicy(connection_info)
+    if policy == "random":
+        return RandomPolicy(connection_info)
+    if policy == "qlearning":
+        scheduler = QLearningPolicy(connection_info, model_file, model_backend)
+        # the model is trained for one map, its input has one feature per edge of that map
+        input_size = getattr(scheduler.model, "input_size", None)
+        if input_size is not None and input_size != scheduler.state_size:
+            return None
+        return scheduler
+    raise ValueError("Unknown policy '{}', expected one of {}".format(policy, POLICIES))
+
+
+def make_batches(connection_info, reachability_index, batch_size, num_calls, rng):
+    '''
+    :return <list>: num_calls lists of batch_size vehicles, each on a random edge with a reachable destination
+    '''
+    edges = connection_info.edge_list
+    batches = []
+    vehicle_id = 0
+    for _ in range(num_calls):
+        batch = []
+        while len(batch) < batch_size:
+            start_edge, destination = rng.choice(edges), rng.choice(edges)
+            if start_edge == destination or not reachability_index.is_reachable(start_edge, destination):
+                continue
+            vehicle = Vehicle(str(vehicle_id), destination, 0.0, 1000.0)
+            vehicle.current_edge = start_edge
+            batch.append(vehicle)
+            vehicle_id += 1
+        batches.append(batch)
+    return batches
+
+
+def make_edge_counts(connection_info, num_calls, np_rng):
+    '''
+    :return <list>: num_calls {edge_id: number of vehicles} dictionaries
+    '''
+    counts = np_rng.poisson(MEAN_EDGE_VEHICLES, size=(num_calls, len(connection_info.edge_list)))
+    return [dict(zip(connection_info.edge_list, row.tolist())) for row in counts]
+
+
+def run_cell(map_name, connection_info, reachability_index, policy, batch_size, options):
+    '''
+    :return <dict>: the measurements of one (map, policy, batch size) cell
+    '''
+    result = {"map": map_name, "edges": len(connection_info.edge_index_dict), "policy": policy,
+              "batch_size": batch_size, "calls": options.calls}
+    rng = random.Random(options.seed)
+    batches = make_batches(connection_info, reachability_index, batch_size, options.calls + options.memory_calls, rng)
+    edge_counts = make_edge_counts(connection_info, options.calls + options.memory_calls,
+                                   np.random.RandomState(options.seed))
+
+    start = time.perf_counter()
+    scheduler = make_policy(policy, connection_info, options.model_file, options.model_backend)
+    result["setup_s"] = time.perf_counter() - start
+    if scheduler is None:
+        result["skipped"] = "the model does not fit the number of edges of the map"
+        return result
+
+    latencies = []
+    peak_memory = 0
+    random.seed(options.seed)
+    for call in range(options.calls):
+        connection_info.update_edge_vehicle_counts(edge_counts[call])
+        start = time.perf_counter()
+        scheduler.make_decisions(batches[call], connection_info)
+        latencies.append(time.perf_counter() - start)
+    for call in range(options.calls, options.calls + options.memory_calls):
+        connection_info.update_edge_vehicle_counts(edge_counts[call])
+        tracemalloc.start()
+        scheduler.make_decisions(batches[call], connection_info)
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    result["total_s"] = float(latencies.sum())
+    result["decisions_per_s"] = batch_size * options.calls / result["total_s"] if result["total_s"] > 0 else None
+    result["latency_ms"] = {"p{}".format(percentile): float(np.percentile(latencies, percentile)) * 1000.0
+                            for percentile in PERCENTILES}
+    result["latency_ms"]["max"] = float(latencies.max()) * 1000.0
+    result["peak_memory_kb"] = peak_memory / 1024.0
+    return result
+
+
+def git_commit():
+    '''
+    :return <str>: the commit of the working tree, or None outside of a git repository
+    '''
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cell_key(result):
+    return result["map"], result["policy"], result["batch_size"]
+
+
+def compare(results, baseline_file):
+    '''
+    Print the change of decisions per second of every cell also measured in baseline_file.
+    '''
+    with open(baseline_file) as f:
+        baseline = {cell_key(result): result for result in json.load(f)["results"]}
+    print("{:<16}{:<12}{:>7}{:>16}{:>16}{:>9}".format("map", "policy", "batch", "baseline dec/s", "dec/s", "ratio"))
+    for result in results:
+        before = baseline.get(cell_key(result))
+        if before is None or not before.get("decisions_per_s") or not result.get("decisions_per_s"):
+            continue
+        ratio = result["decisions_per_s"] / before["decisions_per_s"]
+        print("{:<16}{:<12}{:>7}{:>16.1f}{:>16.1f}{:>8.2f}x".format(result["map"], result["policy"],
+                                                                   result["batch_size"], before["decisions_per_s"],
+                                                                   result["decisions_per_s"], ratio))
+
+
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--maps", default=",".join(BUNDLED_MAPS),
+                          help="comma separated .net.xml files, relative to the repository root")
+    opt_parser.add_option("--grid-sizes", dest="grid_sizes", default="10,20,40",
+                          help="comma separated numbers of junctions per side of the synthetic grids")
+    opt_parser.add_option("--policies", default=",".join(POLICIES), help="comma separated policies out of " +
+                                                                         ",".join(POLICIES))
+    opt_parser.add_option("--batch-sizes", dest="batch_sizes", default="1,10,100",
+                          help="comma separated numbers of vehicles per make_decisions call")
+    opt_parser.add_option("--calls", type="int", default=50, help="timed make_decisions calls per cell")
+    opt_parser.add_option("--memory-calls", dest="memory_calls", type="int", default=3,
+                          help="extra calls per cell measuring the peak memory")
+    opt_parser.add_option("--seed", type="int", default=1, help="random seed of the vehicles and edge counts")
+    opt_parser.add_option("--model-file", dest="model_file", default=os.path.join(REPOSITORY_ROOT, DEFAULT_MODEL_FILE),
+                          help="trained model of the qlearning policy")
+    opt_parser.add_option("--model-backend", dest="model_backend", choices=MODEL_BACKENDS, default=NUMPY,
+                          help="backend running the qlearning model")
+    opt_parser.add_option("--output", default=os.path.join(REPOSITORY_ROOT, "benchmarks", "results.json"),
+                          help="JSON file the results are written to")
+    opt_parser.add_option("--compare", default=None, help="JSON results of an earlier run to compare with")
+    options, args = opt_parser.parse_args()
+    return options
+
+
+if __name__ == "__main__":
+    options = get_options()
+    # the warnings of the policies about their decisions are not what is measured here
+    configure_diagnostics("error")
+    net_files = [net_file for net_file in options.maps.split(",") if net_file]
+    grid_sizes = [int(size) for size in options.grid_sizes.split(",") if size]
+    policies = options.policies.split(",")
+    batch_sizes = [int(batch_size) for batch_size in options.batch_sizes.split(",")]
+
+    results = []
+    for map_name, connection_info in load_maps(net_files, grid_sizes):
+        reachability_index = ReachabilityIndex(connection_info.outgoing_edges_dict, connection_info.edge_list)
+        for policy in policies:
+            for batch_size in batch_sizes:
+                result = run_cell(map_name, connection_info, reachability_index, policy, batch_size, options)
+                results.append(result)
+                if "skipped" in result:
+                    print("{} on {}: skipped, {}".format(policy, map_name, result["skipped"]))
+                    continue
+                print("{} on {} ({} edges), batch {}: {:.1f} decisions/s, p50 {:.3f} ms, p99 {:.3f} ms, "
+                      "peak {:.1f} KiB".format(policy, map_name, result["edges"], batch_size,
+                                               result["decisions_per_s"], result["latency_ms"]["p50"],
+                                               result["latency_ms"]["p99"], result["peak_memory_kb"]))
+
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "options": vars(options),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+    with open(options.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results of {} cells written to {}".format(len(results), options.output))
+    if options.compare:
+        compare(results, options.compare)
@@ -0,0 +1,79 @@
+'''
+Synthetic road networks for the benchmarks, built directly as network_cache.NetworkTopology
+objects so that no SUMO network file (nor SUMO itself) is needed.
+'''
+import numpy as np
+
+from core.network_cache import NetworkTopology
+from core.Util import DIRECTION_LIST
+
+STRAIGHT = "s"
+TURN_AROUND = "t"
+LEFT = "l"
+RIGHT = "r"
+
+
+def grid_edge_id(from_junction, to_junction):
+    '''
+    :return <str>: id of the edge between two junctions given as (column, row)
+    '''
+    return "{}_{}to{}_{}".format(from_junction[0], from_junction[1], to_junction[0], to_junction[1])
+
+
+def turn_direction(from_junction, via_junction, to_junction):
+    '''
+    :return <str>: SUMO direction of the turn from_junction -> via_junction -> to_junction on a grid
+    '''
+    if to_junction == from_junction:
+        return TURN_AROUND
+    in_x, in_y = via_junction[0] - from_junction[0], via_junction[1] - from_junction[1]
+    out_x, out_y = to_junction[0] - via_junction[0], to_junction[1] - via_junction[1]
+    cross = in_x * out_y - in_y * out_x
+    if cross == 0:
+        return STRAIGHT
+    return LEFT if cross > 0 else RIGHT
+
+
+def grid_topology(size, spacing=100.0, speed=13.89):
+    '''
+    :param @size <int>: number of junctions per side, the grid has 4 * size * (size - 1) edges
+    :param @spacing <float>: distance between neighbouring junctions, also the length of every edge
+    :param @speed <float>: speed limit of every edge (m/s)
+    :return <NetworkTopology>: a size x size grid of two-way streets where every turn, U-turns included,
+                               is allowed, to be loaded with ConnectionInfo.from_topology()
+    '''
+    junctions = [(column, row) for row in range(size) for column in range(size)]
+    edges = []
+    for column, row in junctions:
+        for neighbour in [(column + 1, row), (column - 1, row), (column, row + 1), (column, row - 1)]:
+            if 0 <= neighbour[0] < size and 0 <= neighbour[1] < size:
+                edges.append(((column, row), neighbour))
+    edge_index = {edge: index for index, edge in enumerate(edges)}
+    outgoing = {}
+    for edge in edges:
+        outgoing.setdefault(edge[0], []).append(edge)
+
+    conn_from = []
+    conn_to = []
+    conn_direction = []
+    for edge in edges:
+        from_junction, via_junction = edge
+        for out_edge in outgoing[via_junction]:
+            conn_from.append(edge_index[edge])
+            conn_to.append(edge_index[out_edge])
+            conn_direction.append(DIRECTION_LIST.index(turn_direction(from_junction, via_junction, out_edge[1])))
+
+    num_edges = len(edges)
+    arrays = {
+        "edge_ids": np.array([grid_edge_id(*edge) for edge in edges]),
+        "lengths": np.full(num_edges, float(spacing)),
+        "speeds": np.full(num_edges, float(speed)),
+        "from_coordinates": np.array([edge[0] for edge in edges], dtype=np.float64).reshape(num_edges, 2) * spacing,
+        "to_coordinates": np.array([edge[1] for edge in edges], dtype=np.float64).reshape(num_edges, 2) * spacing,
+        "passenger": np.ones(num_edges, dtype=bool),
+        "permissions": np.ones(num_edges, dtype=np.uint64),
+        "conn_from": np.array(conn_from, dtype=np.int32),
+        "conn_to": np.array(conn_to, dtype=np.int32),
+        "conn_direction": np.array(conn_direction, dtype=np.int8),
+    }
+    return NetworkTopology(arrays, ["passenger"], list(DIRECTION_LIST))
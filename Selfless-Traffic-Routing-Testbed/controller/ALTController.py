@@ -0,0 +1,30 @@
+from controller.RouteController import RouteController
+from core.Util import ConnectionInfo, Vehicle
+from core.landmarks import LandmarkIndex, DEFAULT_NUM_LANDMARKS
+
+
+class ALTPolicy(RouteController):
+
+    def __init__(self, connection_info, num_landmarks=DEFAULT_NUM_LANDMARKS, landmark_index=None):
+        """
+        :param connection_info: object containing network information
+        :param num_landmarks: number of landmarks of the index, loaded from (or saved into) the map cache
+        :param landmark_index: an already built LandmarkIndex to use instead
+        """
+        super().__init__(connection_info)
+        if landmark_index is None:
+            landmark_index = LandmarkIndex.for_network(connection_info, num_landmarks)
+        self.landmark_index = landmark_index
+
+    def make_decisions(self, vehicles, connection_info):
+        """
+        make_decisions uses A* guided by landmark lower bounds to find the shortest path to each individual
+        vehicle's destination; the decisions are the ones of DijkstraPolicy
+        :param vehicles: list of vehicles on the map
+        :param connection_info: information about the map (roads, junctions, etc)
+        """
+        local_targets = {}
+        for vehicle in vehicles:
+            decision_list = self.landmark_index.directions(vehicle.current_edge, vehicle.destination)
+            local_targets[vehicle.vehicle_id] = self.compute_local_target(decision_list, vehicle)
+        return local_targets
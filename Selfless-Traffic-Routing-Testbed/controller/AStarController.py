@@ -0,0 +1,29 @@
+from controller.RouteController import RouteController
+from core.Util import ConnectionInfo, Vehicle
+from core.shortest_path import astar_directions, travel_time_weights, StraightLineHeuristic
+
+
+class AStarPolicy(RouteController):
+
+    def __init__(self, connection_info, travel_time=False):
+        """
+        :param connection_info: object containing network information
+        :param travel_time: route on free flow travel times (length / speed limit) instead of lengths
+        """
+        super().__init__(connection_info)
+        self.edge_weights = travel_time_weights(connection_info) if travel_time else connection_info.edge_length_dict
+        self.heuristic = StraightLineHeuristic(connection_info, travel_time)
+
+    def make_decisions(self, vehicles, connection_info):
+        """
+        make_decisions uses A* with a straight-line heuristic to find the shortest path to each individual
+        vehicle's destination; with length weights the decisions are the ones of DijkstraPolicy
+        :param vehicles: list of vehicles on the map
+        :param connection_info: information about the map (roads, junctions, etc)
+        """
+        local_targets = {}
+        for vehicle in vehicles:
+            decision_list = astar_directions(self.connection_info, vehicle.current_edge, vehicle.destination,
+                                             self.heuristic, self.edge_weights)
+            local_targets[vehicle.vehicle_id] = self.compute_local_target(decision_list, vehicle)
+        return local_targets
@@ -0,0 +1,31 @@
+from controller.RouteController import RouteController
+from core.Util import ConnectionInfo, Vehicle
+from core.contraction_hierarchy import ContractionHierarchy
+
+
+class CHPolicy(RouteController):
+
+    def __init__(self, connection_info, hierarchy=None):
+        """
+        :param connection_info: object containing network information
+        :param hierarchy: an already built ContractionHierarchy; by default it is loaded from (or saved into)
+                          the map cache
+        """
+        super().__init__(connection_info)
+        if hierarchy is None:
+            hierarchy = ContractionHierarchy.for_network(connection_info)
+        self.hierarchy = hierarchy
+
+    def make_decisions(self, vehicles, connection_info):
+        """
+        make_decisions answers the shortest path of each individual vehicle with a bidirectional upward search
+        in the contraction hierarchy of the map; the routes have the length of the ones of DijkstraPolicy but
+        may differ from them between paths of equal length
+        :param vehicles: list of vehicles on the map
+        :param connection_info: information about the map (roads, junctions, etc)
+        """
+        local_targets = {}
+        for vehicle in vehicles:
+            decision_list = self.hierarchy.directions(vehicle.current_edge, vehicle.destination)
+            local_targets[vehicle.vehicle_id] = self.compute_local_target(decision_list, vehicle)
+        return local_targets
@@ -1,15 +1,41 @@
 from controller.RouteController import RouteController
 from core.Util import ConnectionInfo, Vehicle
+from core.shortest_path import shortest_path_directions, ShortestPathTreeCache
+from core.edge_weights import CongestionWeights
 import numpy as np
-import traci
+from core.sumo_backend import traci
 import math
-import copy
 
 
 class DijkstraPolicy(RouteController):
 
-    def __init__(self, connection_info):
+    def __init__(self, connection_info, use_tree_cache=False, tree_cache_size=128, congestion_aware=False,
+                 use_route_plans=False, replan_threshold=0.1, replan_horizon=None):
+        """
+        :param connection_info: object containing network information
+        :param use_tree_cache: share one reverse shortest path tree between all vehicles heading to the same
+                               destination instead of searching forward for each vehicle; with congestion_aware
+                               the trees are repaired where the weights changed instead of being rebuilt
+        :param tree_cache_size: maximum number of destination trees kept when use_tree_cache is set
+        :param congestion_aware: route on the travel times estimated from the live edge state
+                                 (see core/edge_weights.py) instead of the edge lengths
+        :param use_route_plans: keep the route of every vehicle and only search again when the vehicle leaves it,
+                                when the weight of its remaining route changed by more than replan_threshold
+                                or after replan_horizon edges (see RouteController.enable_route_plans)
+        """
         super().__init__(connection_info)
+        self.edge_weights = connection_info.edge_length_dict
+        self.congestion_weights = None
+        if congestion_aware:
+            self.congestion_weights = CongestionWeights(connection_info)
+            self.edge_weights = self.congestion_weights.weights
+        self.tree_cache = None
+        if use_tree_cache:
+            self.tree_cache = ShortestPathTreeCache(connection_info, tree_cache_size, self.edge_weights)
+            if self.congestion_weights is not None:
+                self.congestion_weights.add_listener(self.tree_cache.update_edge_weights)
+        if use_route_plans:
+            self.enable_route_plans(self.edge_weights, replan_threshold, replan_horizon)
 
     def make_decisions(self, vehicles, connection_info):
         """
@@ -20,44 +46,15 @@ class DijkstraPolicy(RouteController):
         local_targets = {}
         for vehicle in vehicles:
             #print("{}: current - {}, destination - {}".format(vehicle.vehicle_id, vehicle.current_edge, vehicle.destination))
-            decision_list = []
-            unvisited = {edge: 1000000000 for edge in self.connection_info.edge_list} # map of unvisited edges
-            visited = {} # map of visited edges
-            current_edge = vehicle.current_edge
-
-            current_distance = self.connection_info.edge_length_dict[current_edge]
-            unvisited[current_edge] = current_distance
-            path_lists = {edge: [] for edge in self.connection_info.edge_list} #stores shortest path to each edge using directions
-            while True:
-                if current_edge not in self.connection_info.outgoing_edges_dict.keys():
-                    continue
-                for direction, outgoing_edge in self.connection_info.outgoing_edges_dict[current_edge].items():
-                    if outgoing_edge not in unvisited:
-                        continue
-                    edge_length = self.connection_info.edge_length_dict[outgoing_edge]
-                    new_distance = current_distance + edge_length
-                    if new_distance < unvisited[outgoing_edge]:
-                        unvisited[outgoing_edge] = new_distance
-                        current_path = copy.deepcopy(path_lists[current_edge])
-                        current_path.append(direction)
-                        path_lists[outgoing_edge] = copy.deepcopy(current_path)
-                        #print("{} + {} : {} + {}".format(path_lists[current_edge], direction, path_edge_lists[current_edge], outgoing_edge))
-
-                visited[current_edge] = current_distance
-                del unvisited[current_edge]
-                if not unvisited:
-                    break
-                if current_edge==vehicle.destination:
-                    break
-                possible_edges = [edge for edge in unvisited.items() if edge[1]]
-                current_edge, current_distance = sorted(possible_edges, key=lambda x: x[1])[0]
-                #print('{}:{}------------'.format(current_edge, current_distance))
-            #current_edge = vehicle.current_edge
-
-
-            for direction in path_lists[vehicle.destination]:
-                decision_list.append(direction)
-
+            decision_list = self.route_plan_directions(vehicle, self.plan_route)
             local_targets[vehicle.vehicle_id] = self.compute_local_target(decision_list, vehicle)
         return local_targets
-    
+
+    def plan_route(self, vehicle):
+        """
+        :return: decision list of the shortest path from vehicle.current_edge to vehicle.destination
+        """
+        if self.tree_cache is not None:
+            return self.tree_cache.directions(vehicle.current_edge, vehicle.destination)
+        return shortest_path_directions(self.connection_info, vehicle.current_edge, vehicle.destination,
+                                        self.edge_weights)
@@ -1,63 +1,84 @@
 from controller.RouteController import RouteController
 from core.Util import ConnectionInfo, Vehicle
-from keras.models import load_model
+from core import numpy_inference
+from core.result_sink import logger
 import numpy as np
-import traci
+
+KERAS = "keras"
+NUMPY = "numpy"
+MODEL_BACKENDS = [KERAS, NUMPY]
 
 
 class QLearningPolicy(RouteController):
-    def __init__(self, connection_info, model_file):
+    """
+    :param model_file: the trained model, a Keras .h5 file
+    :param backend: "keras" runs the model with Keras (imported on demand), "numpy" runs the
+                    same forward pass with core/numpy_inference.py and needs no TensorFlow
+    """
+    def __init__(self, connection_info, model_file, backend=KERAS):
         super().__init__(connection_info)
-        self.model = load_model(model_file)
+        if backend == KERAS:
+            from keras.models import load_model
+            self.model = load_model(model_file)
+        elif backend == NUMPY:
+            self.model = numpy_inference.load_model(model_file)
+        else:
+            raise ValueError("Unknown model backend '{}', expected one of {}".format(backend, MODEL_BACKENDS))
+        self.state_size = 1 + len(self.direction_choices) + len(connection_info.edge_list)
+        self.state_buffer = None
+        self.direction_masks = {}
 
     def make_decisions(self, vehicles, connection_info: ConnectionInfo):
+        """
+        The lookahead of every vehicle is advanced in lockstep: each round runs a single
+        batched forward pass over the distinct edges the pending vehicles are on, then
+        every pending vehicle takes one decision.
+        """
         local_targets = {}
 
+        # one pending query per vehicle: [vehicle, start_edge, total_length, decision_list]
+        pending = []
+        finished = []
         for vehicle in vehicles:
-
-            wrong_decision = False
-            total_length = 0.0
-            start_edge = vehicle.current_edge
-            decision_list = []
-
             if vehicle.destination == vehicle.current_edge:
                 continue
-
-            #i = 0
-
-            while total_length < connection_info.edge_length_dict[vehicle.current_edge]:
-                state = self.getState(start_edge)
-                action = self.act(state)
-                action = self.direction_choices[action]
+            query = [vehicle, vehicle.current_edge, 0.0, []]
+            if query[2] < connection_info.edge_length_dict[vehicle.current_edge]:
+                pending.append(query)
+            else:
+                finished.append(query)
+
+        while pending:
+            # vehicles on the same edge share the same state, hence the same decision
+            edges = list(dict.fromkeys(query[1] for query in pending))
+            actions = self.act_batch(self.getStates(edges))
+            action_of_edge = dict(zip(edges, actions))
+
+            still_pending = []
+            for query in pending:
+                vehicle, start_edge, total_length, decision_list = query
+                action = self.direction_choices[action_of_edge[start_edge]]
                 if action not in connection_info.outgoing_edges_dict[start_edge]:
-                    print("Impossible turns made for vehicle #" + str(vehicle.vehicle_id) + " : " + action + " @ " + str(start_edge))
-                    wrong_decision = True
-                    break
+                    logger.warning("Impossible turns made for vehicle #%s : %s @ %s", vehicle.vehicle_id, action, start_edge)
+                    continue
 
-                print("Choice for " + str(start_edge) + " is: " + action)
+                logger.debug("Choice for %s is: %s", start_edge, action)
 
                 target_edge = connection_info.outgoing_edges_dict[start_edge][action]
-                start_edge = target_edge
                 decision_list.append(action)
-                total_length += self.connection_info.edge_length_dict[target_edge]
-                #
-                #
-                # if i > 0:
-                #     if decision_list[i - 1] == decision_list[i] and decision_list[i] == 't':
-                #         # stuck in a turnaround loop, let TRACI remove vehicle
-                #         break
-
-                #i += 1
-
-            if wrong_decision:
-                continue
-
+                query[1] = target_edge
+                query[2] = total_length + self.connection_info.edge_length_dict[target_edge]
+                if query[2] < connection_info.edge_length_dict[vehicle.current_edge]:
+                    still_pending.append(query)
+                else:
+                    finished.append(query)
+            pending = still_pending
+
+        for vehicle, _, _, decision_list in finished:
             local_targets[vehicle.vehicle_id] = self.compute_local_target(decision_list, vehicle)
 
         return local_targets
 
-
-
     # this function reacheds the Neural Network trained before and let it make a decision for the situation now
     def act(self, state):
         act_values = self.model.predict(state)
@@ -69,23 +90,39 @@ class QLearningPolicy(RouteController):
         #print('**************************')
         return np.argmax(mod_values[0])
 
+    # batched version of act(): one forward pass for a [n, state_size] matrix of states
+    def act_batch(self, states):
+        act_values = self.model.predict(states)
+        state_vals = states[:, 1:7].reshape(act_values.shape)
+        mod_values = act_values - 10000 * (1 - state_vals)
+        return np.argmax(mod_values, axis=1)
+
     # this function gives the current state of the vehicle based on the state size
+    # the state is [edge index, 6 direction flags, density of every edge of edge_list]; the densities
+    # are the vector StrSumo refreshes once per step, so no TraCI call is made here.
+    # The returned array is a preallocated buffer overwritten by the next call.
     def getState(self, edge_now):
-        en = edge_now
-        state = []
-        state.append(self.connection_info.edge_index_dict[en])
-        for c in self.direction_choices:
-            if c in self.connection_info.outgoing_edges_dict[en].keys():
-                state.append(1)
-                # 1 stands for the edge is available for being chose
-            else:
-                state.append(0)
-                # 0 means this action cannot be chosen.
+        return self.getStates([edge_now])[:1]
+
+    # the states of several edges stacked into a single [len(edges), state_size] matrix, written
+    # into a preallocated buffer overwritten by the next call
+    def getStates(self, edges):
+        num_states = len(edges)
+        if self.state_buffer is None or self.state_buffer.shape[0] < num_states:
+            self.state_buffer = np.zeros((max(num_states, 1), self.state_size), dtype=np.float64)
+        states = self.state_buffer[:num_states]
         # put the congestion ratio of all edges into the state.
-        for edge_now in self.connection_info.edge_list:
-            car_num = traci.edge.getLastStepVehicleNumber(edge_now)
-            density = car_num / self.connection_info.edge_length_dict[edge_now]
-            state.append(density)
-
-        state = np.reshape(state, [1, len(state)])
-        return state
+        states[:, 1 + len(self.direction_choices):] = self.connection_info.edge_densities()
+        for row, edge in enumerate(edges):
+            states[row, 0] = self.connection_info.edge_index_dict[edge]
+            states[row, 1:1 + len(self.direction_choices)] = self.getDirectionMask(edge)
+        return states
+
+    # 1 stands for the edge is available for being chose, 0 means this action cannot be chosen.
+    def getDirectionMask(self, edge):
+        mask = self.direction_masks.get(edge)
+        if mask is None:
+            outgoing = self.connection_info.outgoing_edges_dict[edge]
+            mask = np.array([1 if c in outgoing else 0 for c in self.direction_choices], dtype=np.float64)
+            self.direction_masks[edge] = mask
+        return mask
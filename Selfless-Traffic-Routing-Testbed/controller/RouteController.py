@@ -5,12 +5,14 @@ import os
 import sys
 import copy
 from core.Util import *
+from core.shortest_path import shortest_path_directions, ShortestPathTreeCache
+from core.result_sink import logger
 if 'SUMO_HOME' in os.environ:
     tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
     sys.path.append(tools)
 else:
     sys.exit("No environment variable SUMO_HOME!")
-import traci
+from core.sumo_backend import traci
 import sumolib
 
 STRAIGHT = "s"
@@ -45,6 +47,69 @@ class RouteController(ABC):
     def __init__(self, connection_info: ConnectionInfo):
         self.connection_info = connection_info
         self.direction_choices = [STRAIGHT, TURN_AROUND,  SLIGHT_RIGHT, RIGHT, SLIGHT_LEFT, LEFT]
+        # {vehicle_id: RoutePlan}, None while the plan cache is disabled (see enable_route_plans())
+        self.route_plans = None
+        self.plan_weights = connection_info.edge_length_dict
+        self.replan_threshold = None
+        self.replan_horizon = None
+
+    def enable_route_plans(self, edge_weights=None, replan_threshold=0.1, replan_horizon=None):
+        """
+        Keep the route planned for every vehicle and reuse it while the vehicle follows it, see
+        route_plan_directions(). A vehicle is planned again when it leaves its planned route, when its
+        destination changes, when the weight of the rest of its route drifted too much or after
+        replan_horizon edges.
+
+        :param edge_weights: {edge_id: weight} the routes are planned on, read at every decision so it can be
+                             updated in place (e.g. CongestionWeights.weights); defaults to edge_length_dict
+        :param replan_threshold: relative change of the weight of the rest of the route that triggers a replan,
+                                 None to ignore weight changes
+        :param replan_horizon: number of edges driven along a plan before it is planned again, None for no limit
+        """
+        self.route_plans = {}
+        self.plan_weights = self.connection_info.edge_length_dict if edge_weights is None else edge_weights
+        self.replan_threshold = replan_threshold
+        self.replan_horizon = replan_horizon
+
+    def route_plan_directions(self, vehicle, plan_route):
+        """
+        :param vehicle: Vehicle to route
+        :param plan_route: function vehicle -> decision list from vehicle.current_edge, called when the vehicle
+                           has no valid plan (or every time if the plan cache is disabled)
+        :return: decision list from vehicle.current_edge to vehicle.destination
+        """
+        if self.route_plans is None:
+            return plan_route(vehicle)
+
+        plan = self.route_plans.get(vehicle.vehicle_id)
+        if plan is not None and plan.advance(vehicle.current_edge, vehicle.destination) and \
+                not self.__needs_replan__(plan):
+            return plan.remaining_directions()
+
+        decision_list = plan_route(vehicle)
+        if decision_list:
+            self.route_plans[vehicle.vehicle_id] = RoutePlan(self.connection_info, vehicle.current_edge,
+                                                             vehicle.destination, decision_list, self.plan_weights)
+        else:
+            self.route_plans.pop(vehicle.vehicle_id, None)
+        return decision_list
+
+    def forget_route_plan(self, vehicle_id):
+        """
+        Drop the plan of a vehicle that left the simulation.
+        """
+        if self.route_plans is not None:
+            self.route_plans.pop(vehicle_id, None)
+
+    def __needs_replan__(self, plan):
+        if self.replan_horizon is not None and plan.edges_driven >= self.replan_horizon:
+            return True
+        if self.replan_threshold is not None:
+            planned_weight = plan.planned_remaining_weight()
+            current_weight = plan.remaining_weight(self.plan_weights)
+            if abs(current_weight - planned_weight) > self.replan_threshold * planned_weight:
+                return True
+        return False
 
     ''' when testing vehicle current speed it always is 0 for some reason, so we assum that the path_length can never exceed 20
     because that is where the while loop is at
@@ -87,7 +152,7 @@ class RouteController(ABC):
                 i += 1
 
         except UserWarning as warning:
-            print(warning)
+            logger.warning('%s', warning)
 
         return current_target_edge
 
@@ -97,6 +162,64 @@ class RouteController(ABC):
         pass
 
 
+class RoutePlan:
+    """
+    The route planned for one vehicle, consumed as the vehicle drives along it.
+
+    :param connection_info: object containing network information
+    :param start_edge: edge id the route was planned from
+    :param destination: edge id the route leads to
+    :param decision_list: list of directions from start_edge to destination
+    :param edge_weights: {edge_id: weight} the route was planned on
+    """
+    def __init__(self, connection_info, start_edge, destination, decision_list, edge_weights):
+        self.destination = destination
+        self.directions = list(decision_list)
+        self.edges = [start_edge]
+        for direction in self.directions:
+            self.edges.append(connection_info.outgoing_edges_dict[self.edges[-1]][direction])
+        # weight of the route from every edge of it to the end, at planning time
+        self.planned_weights = [0.0] * (len(self.edges) + 1)
+        for index in range(len(self.edges) - 1, -1, -1):
+            self.planned_weights[index] = self.planned_weights[index + 1] + edge_weights[self.edges[index]]
+        self.position = 0
+        self.edges_driven = 0
+
+    def advance(self, current_edge, destination):
+        """
+        Move the plan to the edge the vehicle is on.
+
+        :return: False if the vehicle left the planned route (or heads to another destination)
+        """
+        if destination != self.destination:
+            return False
+        # a vehicle may drive several short edges of its route within one simulation step
+        for index in range(self.position, len(self.edges)):
+            if self.edges[index] == current_edge:
+                self.edges_driven += index - self.position
+                self.position = index
+                return True
+        return False
+
+    def remaining_directions(self):
+        """
+        :return: list of directions from the current edge to the destination
+        """
+        return self.directions[self.position:]
+
+    def planned_remaining_weight(self):
+        """
+        :return: weight of the rest of the route when it was planned
+        """
+        return self.planned_weights[self.position]
+
+    def remaining_weight(self, edge_weights):
+        """
+        :return: weight of the rest of the route with edge_weights
+        """
+        return sum(edge_weights[edge] for edge in self.edges[self.position:])
+
+
 class RandomPolicy(RouteController):
     """
     Example class for a custom scheduling algorithm.
@@ -128,7 +251,7 @@ class RandomPolicy(RouteController):
         local_targets = {}
         for vehicle in vehicles:
             start_edge = vehicle.current_edge
-            print("{}: current - {}, destination - {}, deadline - {}".format(vehicle.vehicle_id, vehicle.current_edge, vehicle.destination, vehicle.deadline))
+            logger.debug("%s: current - %s, destination - %s, deadline - %s", vehicle.vehicle_id, vehicle.current_edge, vehicle.destination, vehicle.deadline)
             '''
             Your algo starts here
             '''
@@ -158,7 +281,7 @@ class RandomPolicy(RouteController):
             Your algo ends here
             '''
             x = self.compute_local_target(decision_list, vehicle)
-            print("compute_local_target returns:{} - with decision list:{}".format(x, decision_list))
+            logger.debug("compute_local_target returns:%s - with decision list:%s", x, decision_list)
             local_targets[vehicle.vehicle_id] = x
 
         # for vehicle in vehicles:
@@ -175,8 +298,17 @@ class RandomPolicy(RouteController):
 
 
 class NathanPolicy(RouteController):
-    def __init__(self, connection_info):
+    def __init__(self, connection_info, use_tree_cache=False, tree_cache_size=128):
+        """
+        :param connection_info: object containing network information
+        :param use_tree_cache: share one reverse shortest path tree between all vehicles heading to the same
+                               destination instead of searching forward for each vehicle
+        :param tree_cache_size: maximum number of destination trees kept when use_tree_cache is set
+        """
         super().__init__(connection_info)
+        self.tree_cache = None
+        if use_tree_cache:
+            self.tree_cache = ShortestPathTreeCache(connection_info, tree_cache_size)
     
     def make_decisions(self, vehicles, connection_info):
         """
@@ -216,80 +348,13 @@ class NathanPolicy(RouteController):
         # --- start dijkstra ---
         # apply dijkstra to each vehicle in edge_vehicle DS
         for edge, vehicles in edge_vehicle.items():
-            #below is copied from dijkstra 
             for vehicle in vehicles:
-                #print("---------------------------")
                 #print("{}: current - {}, destination - {}".format(vehicle.vehicle_id, vehicle.current_edge, vehicle.destination))
-                decision_list = []
-                unvisited = {edge: 1000000000 for edge in self.connection_info.edge_list} # map of unvisited edges {edge_id : distance}
-                visited = {} # map of visited edges
-                current_edge = vehicle.current_edge
-                #print("vehicle current_edge length:{}".format(self.connection_info.edge_length_dict[current_edge]))
-
-                #print("\n------- getting into while loop ----------\n")
                 #vehicle is at the beginning of the edge so current edge length counts too
-                current_distance = self.connection_info.edge_length_dict[current_edge]
-                unvisited[current_edge] = current_distance
-                #stores shortest path to each edge using directions [edge_id]
-                path_lists = {edge: [] for edge in self.connection_info.edge_list} 
-                
-                while True:
-                    if current_edge not in self.connection_info.outgoing_edges_dict.keys():
-                        continue
-                    for direction, outgoing_edge in self.connection_info.outgoing_edges_dict[current_edge].items():
-                        #print("----- in for loop -----")
-                        if outgoing_edge not in unvisited:
-                            continue
-                        edge_length = self.connection_info.edge_length_dict[outgoing_edge]
-                        new_distance = current_distance + edge_length
-                        #univisited length are set to 100000 so this is almost always true 
-                        if new_distance < unvisited[outgoing_edge]:
-                            '''
-                            print("\nchecking direction:{} - edge:{}".format(direction, outgoing_edge))
-                            print("new distance < outgoing_edge length")
-                            print("new_distance = current_distance + edge_length = {}".format(new_distance))
-                            print("unvisited[outgoing_edge]: {}".format(unvisited[outgoing_edge]))
-                            '''
-                            #distance to get to this 'outgoing_edge' is now 'new_distance'
-                            unvisited[outgoing_edge] = new_distance
-
-                            #path_list[current_edge] is initially set to empty array
-                            #so we assgin current_path to that empty array so we can modify it
-                            current_path = copy.deepcopy(path_lists[current_edge])
-                            
-                            #append this new shortest path to current_edge; example: path_list[E9] = [s , l , s , r] 
-                            #[s, l , s , r] is current_path
-                            current_path.append(direction)
-                            # reassign path_list[E9] to current path  [s,l,s,r]
-                            path_lists[outgoing_edge] = copy.deepcopy(current_path)
-                            #print("current path_list[{}]:{}".format(outgoing_edge, path_lists[outgoing_edge]))
-                            # NOT nathan print("{} + {} : {} + {}".format(path_lists[current_edge], direction, path_edge_lists[current_edge], outgoing_edge))
-                    #print("---- out for loop ----")
-                    visited[current_edge] = current_distance
-                    del unvisited[current_edge]
-                    if not unvisited:
-                        break
-                    if current_edge==vehicle.destination:
-                        break
-                    #update possible_edge every time we modify - del unvisited above
-                    possible_edges = [edge for edge in unvisited.items() if edge[1]]
-
-                    #sort by x[1] meaning distance, and [0] meaning we take the smallest distance
-                    #and set our current_edge to that value
-                    current_edge, current_distance = sorted(possible_edges, key=lambda x: x[1])[0]
-                    '''
-                    print("\npossible edge:{}".format(possible_edges))
-                    print("\ncurrent_edge:{}".format(current_edge))
-                    print("current_edge length:{}".format(self.connection_info.edge_length_dict[current_edge]))
-                    print("current_distance:{}".format(current_distance))
-                    print("\n ---------- repeating while loop ----------------\n")
-                    #print('{}:{}------------'.format(current_edge, current_distance))
-                    '''
-                #current_edge = vehicle.current_edge - not NATHAN
-                #print("\nout of while true loop -----")
-                #print("\npath_list:{}".format(path_lists))
-                for direction in path_lists[vehicle.destination]:
-                    decision_list.append(direction)
+                if self.tree_cache is not None:
+                    decision_list = self.tree_cache.directions(vehicle.current_edge, vehicle.destination)
+                else:
+                    decision_list = shortest_path_directions(self.connection_info, vehicle.current_edge, vehicle.destination)
                 #print("\ndecision_list:{}".format(decision_list))
                 vehicle_decisionList[vehicle] = decision_list
 
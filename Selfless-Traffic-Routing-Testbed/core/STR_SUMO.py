@@ -1,6 +1,7 @@
 import os
 import sys
 import optparse
+from concurrent.futures import ThreadPoolExecutor
 from xml.dom.minidom import parse, parseString
 from core.Util import *
 from core.target_vehicles_generation_protocols import *
@@ -11,9 +12,11 @@ if 'SUMO_HOME' in os.environ:
 else:
     sys.exit("No environment variable SUMO_HOME!")
 
-import traci
+from core.sumo_backend import traci, tc
 import sumolib
 from controller.RouteController import *
+from core import step_profiler
+from core.result_sink import TripRecords, logger
 
 """
 SUMO Selfless Traffic Routing (STR) Testbed
@@ -30,70 +33,86 @@ SLIGHT_LEFT = "L"
 SLIGHT_RIGHT = "R"
 
 class StrSumo:
-    def __init__(self, route_controller, connection_info, controlled_vehicles):
+    def __init__(self, route_controller, connection_info, controlled_vehicles, profiler=None, recorder=None,
+                 trip_records=None, pipeline_lag=0):
         """
         :param route_controller: object that implements the scheduling algorithm for controlled vehicles
         :param connection_info: object that includes the map information
         :param controlled_vehicles: a dictionary that includes the vehicles under control
+        :param profiler: a step_profiler.StepProfiler timing the phases of every step, or None
+        :param recorder: a trace_log.TraceRecorder logging the inputs of the route controller, or None
+        :param trip_records: a result_sink.TripRecords collecting a record per arrived controlled vehicle, or None
+                             for one preallocated for controlled_vehicles
+        :param pipeline_lag: 0 to take the decisions of every step before advancing the simulation; n > 0 to
+                             compute them on a worker thread while SUMO advances, and apply them at most n steps
+                             later (see __run_pipelined__)
         """
         self.direction_choices = [STRAIGHT, TURN_AROUND, SLIGHT_RIGHT, RIGHT, SLIGHT_LEFT, LEFT]
         self.connection_info = connection_info
         self.route_controller = route_controller
         self.controlled_vehicles =  controlled_vehicles # dictionary of Vehicles by id
+        self.profiler = profiler
+        self.recorder = recorder
+        self.trip_records = trip_records if trip_records is not None else TripRecords(len(controlled_vehicles))
+        self.pipeline_lag = pipeline_lag
         #print(self.controlled_vehicles)
 
-    def run(self):
+    def run(self, return_records=False):
         """
         Runs the SUMO simulation
         At each time-step, cars that have moved edges make a decision based on user-supplied scheduler algorithm
         Decisions are enforced in SUMO by setting the destination of the vehicle to the result of the
-        :returns: total time, number of cars that reached their destination, number of deadlines missed
+        :param return_records: also return the trip records of the arrived controlled vehicles
+        :returns: total time, number of cars that reached their destination, number of deadlines missed,
+                  followed by self.trip_records if return_records is set
         """
+        if self.pipeline_lag > 0:
+            return self.__run_pipelined__(return_records)
+
         total_time = 0
         end_number = 0
         deadlines_missed = []
 
         step = 0
         vehicles_to_direct = [] #  the batch of controlled vehicles passed to make_decisions()
-        vehicle_IDs_in_simulation = []
+        # controlled vehicles currently in the simulation, in order of departure (a dict used as an ordered set)
+        controlled_IDs_in_simulation = {}
+        profiler = self.profiler
+        recorder = self.recorder
+        trip_records = self.trip_records
 
+        if profiler is not None:
+            profiler.start()
+        if recorder is not None:
+            recorder.start()
         try:
+            # edge counts are delivered in bulk with every simulation step
+            self.subscribe_edges()
             while traci.simulation.getMinExpectedNumber() > 0:
-                vehicle_ids = set(traci.vehicle.getIDList())
+                if profiler is not None:
+                    profiler.begin_step(step)
 
                 # store edge vehicle counts in connection_info.edge_vehicle_count
                 self.get_edge_vehicle_counts()
-                #initialize vehicles to be directed
-                vehicles_to_direct = []
-                # iterate through vehicles currently in simulation
-                for vehicle_id in vehicle_ids:
-
-                    #should not be added because there is no corresponding -1, this makes edge_vehicle_count becomes the total number of vehicles that used to be on this edge.
-                    #self.connection_info.edge_vehicle_count[traci.vehicle.getRoadID(vehicle_id)] += 1
-                    
-                    
-
-                    # handle newly arrived controlled vehicles
-                    if vehicle_id not in vehicle_IDs_in_simulation and vehicle_id in self.controlled_vehicles:
-                        vehicle_IDs_in_simulation.append(vehicle_id)
-                        traci.vehicle.setColor(vehicle_id, (255, 0, 0)) # set color so we can visually track controlled vehicles
-                        self.controlled_vehicles[vehicle_id].start_time = float(step)#Use the detected release time as start time
-
-                    if vehicle_id in self.controlled_vehicles.keys():
-                        current_edge = traci.vehicle.getRoadID(vehicle_id)
-
-                        if current_edge not in self.connection_info.edge_index_dict.keys():
-                            continue
-                        elif current_edge == self.controlled_vehicles[vehicle_id].destination:
-                            continue
-
-                        #print("{} now on: {}, records on {}; {} ".format(vehicle_id, current_edge, self.controlled_vehicles[vehicle_id].current_edge, current_edge!=self.controlled_vehicles[vehicle_id].current_edge))
-                        if current_edge != self.controlled_vehicles[vehicle_id].current_edge:
-                            self.controlled_vehicles[vehicle_id].current_edge = current_edge
-                            self.controlled_vehicles[vehicle_id].current_speed = traci.vehicle.getSpeed(vehicle_id)
-                            vehicles_to_direct.append(self.controlled_vehicles[vehicle_id])
-                #print(len(vehicles_to_direct))
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.EDGE_COUNTS)
+
+                # vehicles that entered or left the simulation during the last step
+                departed = traci.simulation.getDepartedIDList()
+                arrived = traci.simulation.getArrivedIDList()
+                self.__handle_departures__(departed, controlled_IDs_in_simulation, step)
+                for vehicle_id in arrived:
+                    controlled_IDs_in_simulation.pop(vehicle_id, None)
+
+                # road and speed of every subscribed (controlled) vehicle, fetched in one response
+                vehicle_subscription_results = traci.vehicle.getAllSubscriptionResults()
+                vehicles_to_direct = self.__collect_vehicles_to_direct__(controlled_IDs_in_simulation,
+                                                                         vehicle_subscription_results)
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.VEHICLE_UPDATES)
                 vehicle_decisions_by_id = self.route_controller.make_decisions(vehicles_to_direct, self.connection_info)
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.DECISIONS)
                 for vehicle_id, local_target_edge in vehicle_decisions_by_id.items():
                     # if decision not in self.connection_info.outgoing_edges_dict[self.controlled_vehicles[vehicle_id].current_edge]:
                     #     raise ValueError(f'{decision} does not lead to a valid edge from edge '
@@ -101,47 +120,291 @@ class StrSumo:
                     #
                     # current_edge_of_vehicle = self.controlled_vehicles[vehicle_id].current_edge
                     # target_edge = self.connection_info.outgoing_edges_dict[current_edge_of_vehicle][decision]
-                    if vehicle_id in traci.vehicle.getIDList():
+                    if vehicle_id in controlled_IDs_in_simulation:
                         #print("Changing the target of {} to {} with length {}".format(vehicle_id, local_target_edge, self.connection_info.edge_length_dict[local_target_edge]))
                         traci.vehicle.changeTarget(vehicle_id, local_target_edge)
                         self.controlled_vehicles[vehicle_id].local_destination = local_target_edge
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.CHANGE_TARGET)
+
+                for vehicle_id in arrived:
+                    if vehicle_id in self.controlled_vehicles:
+                        time_span, miss = self.__record_arrival__(vehicle_id, step)
+                        total_time += time_span
+                        if miss:
+                            deadlines_missed.append(vehicle_id)
+                        end_number += 1
+                        self.route_controller.forget_route_plan(vehicle_id)
+                if recorder is not None:
+                    recorder.record_step(step, vehicles_to_direct,
+                                         [vehicle_id for vehicle_id in arrived if vehicle_id in self.controlled_vehicles])
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.ARRIVALS)
+
+                traci.simulationStep()
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.SIMULATION_STEP)
+                    profiler.end_step(len(vehicles_to_direct))
+                step += 1
+
+                if step > MAX_SIMULATION_STEPS:
+                    logger.warning('Ending due to timeout.')
+                    break
+
+        except ValueError as err:
+            logger.error('Exception caught.')
+            logger.error('%s', err)
+        finally:
+            trip_records.flush()
+            if profiler is not None:
+                profiler.stop()
+            if recorder is not None:
+                recorder.close()
+
+        num_deadlines_missed = len(deadlines_missed)
+
+        if return_records:
+            return total_time, end_number, num_deadlines_missed, trip_records
+        return total_time, end_number, num_deadlines_missed
+
+    def __run_pipelined__(self, return_records):
+        """
+        run() with make_decisions on a worker thread, computing while SUMO advances the simulation.
+
+        The batch of the vehicles that changed edges at step t is handed to the worker right before
+        traci.simulationStep(). The worker reads connection_info and the vehicles of the batch, so the
+        main thread leaves them alone while the batch is in flight: only departures and arrivals are
+        handled then. The decisions are applied at the first step the main thread synchronizes with the
+        worker, which is step t + 1 if the worker is done by then and at the latest step t + pipeline_lag.
+        It synchronizes earlier when a vehicle drives on the edge of its local target or has none yet, as
+        SUMO removes the vehicle at the end of its route unless it gets a new local target in time. A decision is dropped if its vehicle left the simulation or moved to another edge in the
+        meantime; the vehicle then keeps its previous local target, and a vehicle on a new edge is in
+        the next batch anyway. Route plans of arrived vehicles are forgotten once no batch is in flight.
+
+        Only one batch is in flight at a time, and TraCI is only called from the main thread. The
+        overlap needs a simulationStep() that releases the GIL, as the traci socket backend does;
+        a process worker is not used as the policy state would have to be copied at every step.
+        """
+        total_time = 0
+        end_number = 0
+        deadlines_missed = []
+
+        step = 0
+        controlled_IDs_in_simulation = {}
+        profiler = self.profiler
+        recorder = self.recorder
+        trip_records = self.trip_records
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        job = None  # Future of the batch in flight
+        job_step = 0  # step the batch in flight was taken at
+        job_edges = {}  # {vehicle_id: edge the vehicle was on when the batch in flight was taken}
+        arrived_during_job = []  # arrived vehicles whose route plan is forgotten once the batch is done
 
-                arrived_at_destination = traci.simulation.getArrivedIDList()
+        if profiler is not None:
+            profiler.start()
+        if recorder is not None:
+            recorder.start()
+        try:
+            self.subscribe_edges()
+            while traci.simulation.getMinExpectedNumber() > 0:
+                if profiler is not None:
+                    profiler.begin_step(step)
+                vehicles_to_direct = []
+                departed = traci.simulation.getDepartedIDList()
+                arrived = traci.simulation.getArrivedIDList()
+                self.__handle_departures__(departed, controlled_IDs_in_simulation, step)
+                for vehicle_id in arrived:
+                    controlled_IDs_in_simulation.pop(vehicle_id, None)
+                # road and speed of every subscribed (controlled) vehicle, fetched in one response
+                vehicle_subscription_results = traci.vehicle.getAllSubscriptionResults()
+
+                # wait for the batch in flight once it is pipeline_lag steps old, or earlier if a vehicle
+                # is about to run out of route
+                synchronize = job is None or job.done() or step - job_step >= self.pipeline_lag or \
+                    self.__near_route_end__(controlled_IDs_in_simulation, vehicle_subscription_results)
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.VEHICLE_UPDATES)
+                if synchronize:
+                    vehicle_decisions_by_id = {}
+                    if job is not None:
+                        vehicle_decisions_by_id = job.result()
+                        job = None
+                    if profiler is not None:
+                        profiler.end_phase(step_profiler.DECISIONS)
 
-                for vehicle_id in arrived_at_destination:
+                    self.get_edge_vehicle_counts()
+                    if profiler is not None:
+                        profiler.end_phase(step_profiler.EDGE_COUNTS)
+                    vehicles_to_direct = self.__collect_vehicles_to_direct__(controlled_IDs_in_simulation,
+                                                                             vehicle_subscription_results)
+                    if profiler is not None:
+                        profiler.end_phase(step_profiler.VEHICLE_UPDATES)
+
+                    for vehicle_id, local_target_edge in vehicle_decisions_by_id.items():
+                        if vehicle_id in controlled_IDs_in_simulation and \
+                                self.controlled_vehicles[vehicle_id].current_edge == job_edges.get(vehicle_id):
+                            try:
+                                traci.vehicle.changeTarget(vehicle_id, local_target_edge)
+                            except traci.TraCIException as err:
+                                # already in a junction leading away from the target, keep the previous one
+                                logger.debug("Late decision for vehicle %s dropped: %s", vehicle_id, err)
+                                continue
+                            self.controlled_vehicles[vehicle_id].local_destination = local_target_edge
+                    if profiler is not None:
+                        profiler.end_phase(step_profiler.CHANGE_TARGET)
+
+                for vehicle_id in arrived:
                     if vehicle_id in self.controlled_vehicles:
-                        #print the raw result out to the terminal
-                        arrived_at_destination = False
-                        if self.controlled_vehicles[vehicle_id].local_destination == self.controlled_vehicles[vehicle_id].destination:
-                            arrived_at_destination = True
-                        time_span = step - self.controlled_vehicles[vehicle_id].start_time
+                        time_span, miss = self.__record_arrival__(vehicle_id, step)
                         total_time += time_span
-                        miss = False
-                        if step > self.controlled_vehicles[vehicle_id].deadline:
+                        if miss:
                             deadlines_missed.append(vehicle_id)
-                            miss = True
                         end_number += 1
-                        print("Vehicle {} reaches the destination: {}, timespan: {}, deadline missed: {}"\
-                            .format(vehicle_id, arrived_at_destination, time_span, miss))
-                        #if not arrived_at_destination:
-                            #print("{} - {}".format(self.controlled_vehicles[vehicle_id].local_destination, self.controlled_vehicles[vehicle_id].destination))
+                        arrived_during_job.append(vehicle_id)
+                if synchronize:
+                    for vehicle_id in arrived_during_job:
+                        self.route_controller.forget_route_plan(vehicle_id)
+                    arrived_during_job = []
+                if recorder is not None:
+                    recorder.record_step(step, vehicles_to_direct,
+                                         [vehicle_id for vehicle_id in arrived if vehicle_id in self.controlled_vehicles])
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.ARRIVALS)
 
+                if vehicles_to_direct:
+                    job_edges = {vehicle.vehicle_id: vehicle.current_edge for vehicle in vehicles_to_direct}
+                    job = executor.submit(self.route_controller.make_decisions, vehicles_to_direct,
+                                          self.connection_info)
+                    job_step = step
                 traci.simulationStep()
+                if profiler is not None:
+                    profiler.end_phase(step_profiler.SIMULATION_STEP)
+                    profiler.end_step(len(vehicles_to_direct))
                 step += 1
 
                 if step > MAX_SIMULATION_STEPS:
-                    print('Ending due to timeout.')
+                    logger.warning('Ending due to timeout.')
                     break
 
         except ValueError as err:
-            print('Exception caught.')
-            print(err)
+            logger.error('Exception caught.')
+            logger.error('%s', err)
+        finally:
+            # the decisions of a batch still in flight come too late to be applied
+            executor.shutdown(wait=True)
+            trip_records.flush()
+            if profiler is not None:
+                profiler.stop()
+            if recorder is not None:
+                recorder.close()
 
         num_deadlines_missed = len(deadlines_missed)
 
+        if return_records:
+            return total_time, end_number, num_deadlines_missed, trip_records
         return total_time, end_number, num_deadlines_missed
 
-    def get_edge_vehicle_counts(self):
+    def __handle_departures__(self, departed, controlled_IDs_in_simulation, step):
+        """
+        Start tracking the controlled vehicles that entered the simulation during the last step.
+        """
+        for vehicle_id in departed:
+            if vehicle_id in self.controlled_vehicles and vehicle_id not in controlled_IDs_in_simulation:
+                controlled_IDs_in_simulation[vehicle_id] = None
+                traci.vehicle.setColor(vehicle_id, (255, 0, 0)) # set color so we can visually track controlled vehicles
+                self.controlled_vehicles[vehicle_id].start_time = float(step)#Use the detected release time as start time
+                self.subscribe_vehicle(vehicle_id)
+
+    def __collect_vehicles_to_direct__(self, controlled_IDs_in_simulation, vehicle_subscription_results):
+        """
+        Update the current edge and speed of the controlled vehicles that moved to another edge.
+
+        :param vehicle_subscription_results: traci.vehicle.getAllSubscriptionResults() of the step
+        :return: list of those vehicles, the batch to pass to make_decisions
+        """
+        edge_index_dict = self.connection_info.edge_index_dict
+        vehicles_to_direct = []
+        # iterate through controlled vehicles currently in simulation
+        for vehicle_id in controlled_IDs_in_simulation:
+            vehicle = self.controlled_vehicles[vehicle_id]
+            vehicle_values = vehicle_subscription_results.get(vehicle_id)
+            if vehicle_values is None:
+                # subscribed this step, the values came back with the subscription itself
+                vehicle_values = traci.vehicle.getSubscriptionResults(vehicle_id)
+            current_edge = vehicle_values.get(tc.VAR_ROAD_ID)
+
+            if current_edge not in edge_index_dict:
+                continue
+            elif current_edge == vehicle.destination:
+                continue
+
+            if current_edge != vehicle.current_edge:
+                vehicle.current_edge = current_edge
+                vehicle.current_speed = vehicle_values[tc.VAR_SPEED]
+                vehicles_to_direct.append(vehicle)
+        return vehicles_to_direct
+
+    def __near_route_end__(self, controlled_IDs_in_simulation, vehicle_subscription_results):
+        """
+        :return: whether a controlled vehicle drives on the edge of its local target, or has no local target
+                 yet; SUMO removes it at the end of its route unless it gets a new local target in time
+        """
+        for vehicle_id in controlled_IDs_in_simulation:
+            vehicle_values = vehicle_subscription_results.get(vehicle_id)
+            if vehicle_values is None:
+                continue
+            vehicle = self.controlled_vehicles[vehicle_id]
+            current_edge = vehicle_values.get(tc.VAR_ROAD_ID)
+            if current_edge == vehicle.destination:
+                continue
+            if not vehicle.local_destination or current_edge == vehicle.local_destination:
+                return True
+        return False
+
+    def __record_arrival__(self, vehicle_id, step):
+        """
+        Add the trip record of a controlled vehicle that left the simulation.
+
+        :return: (timespan of the trip, whether its deadline was missed)
+        """
+        vehicle = self.controlled_vehicles[vehicle_id]
+        # record the raw result, printed at the INFO level of the diagnostics
+        arrived_at_destination = False
+        if vehicle.local_destination == vehicle.destination:
+            arrived_at_destination = True
+        time_span = step - vehicle.start_time
+        miss = False
+        if step > vehicle.deadline:
+            miss = True
+        self.trip_records.append(vehicle_id, vehicle.start_time, step, vehicle.deadline, arrived_at_destination)
+        logger.info("Vehicle %s reaches the destination: %s, timespan: %s, deadline missed: %s",
+                    vehicle_id, arrived_at_destination, time_span, miss)
+        return time_span, miss
+
+    def subscribe_edges(self):
+        """
+        Subscribe to the vehicle count and mean speed of every edge, so that SUMO pushes them with
+        the response of each simulation step instead of one round trip per edge.
+        """
         for edge in self.connection_info.edge_list:
-            self.connection_info.edge_vehicle_count[edge] = traci.edge.getLastStepVehicleNumber(edge)
+            traci.edge.subscribe(edge, [tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_MEAN_SPEED])
+
+    def subscribe_vehicle(self, vehicle_id):
+        """
+        Subscribe to the road and speed of a controlled vehicle.
+        SUMO drops the subscription by itself when the vehicle leaves the simulation.
+        """
+        traci.vehicle.subscribe(vehicle_id, [tc.VAR_ROAD_ID, tc.VAR_SPEED])
+
+    def get_edge_vehicle_counts(self):
+        """
+        Store the vehicle count and mean speed of every edge in connection_info (edge_vehicle_count,
+        the edge_vehicle_counts array and edge_mean_speed_dict), reading the results of the edge
+        subscriptions made by subscribe_edges().
+        """
+        edge_results = traci.edge.getAllSubscriptionResults()
+        self.connection_info.update_edge_vehicle_counts(
+            {edge: edge_values[tc.LAST_STEP_VEHICLE_NUMBER] for edge, edge_values in edge_results.items()},
+            {edge: edge_values[tc.LAST_STEP_MEAN_SPEED] for edge, edge_values in edge_results.items()})
 
@@ -7,6 +7,13 @@ else:
     sys.exit("No environment variable SUMO_HOME!")
 from sumolib import net
 import sumolib
+import numpy as np
+from core import network_cache
+
+# integer codes of the SUMO directions used by the array based network representation
+# the order follows RouteController.direction_choices
+DIRECTION_LIST = ["s", "t", "R", "r", "L", "l"]
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTION_LIST)}
 
 class Vehicle:
     def __init__(self, vehicle_id, destination, start_time, deadline):
@@ -29,57 +36,214 @@ class Vehicle:
 class ConnectionInfo:
     """
     Parses and stores network information from net_file  as collections.
+    The parsed topology is kept in an on-disk cache (see network_cache.py), so only the
+    first run on a map pays for parsing the XML.
     The idea is to use this information in the scheduling algorithm.
     Available collections:
         - out_going_edges_dict {edge_id: {direction: out_edge}}
         - edge_length_dict {edge_id: edge_length}
         - edge_index_dict {edge_index_dict} keep track of edge ids by an index
         - edge_vehicle_count {edge_id: number of vehicles at edge}
+        - edge_mean_speed_dict {edge_id: mean speed of the vehicles at edge, as reported by SUMO}
         - edge_list [edge_id]
+        - edge_speed_dict {edge_id: speed limit}
+        - edge_endpoints_dict {edge_id: ((from_x, from_y), (to_x, to_y))} coordinates of the
+          junctions at both ends of the edge
+        - edge_vehicle_counts float64 [len(edge_list)] the same counts aligned with edge_list
+        - inverse_edge_lengths float64 [len(edge_list)] 1 / length of every edge of edge_list
+        - network_graph: NetworkGraph, the same turn graph in integer indexed CSR arrays
     :param net_file: file name of a SUMO network file, e.g. 'test.net.xml'
+    :param use_cache: set to False to always parse net_file with sumolib
     """
-    def __init__(self, net_file):
+    def __init__(self, net_file, use_cache=True):
         self.net_filename = net_file
-        net = sumolib.net.readNet(net_file)
+        self.load_topology(network_cache.load_network_topology(net_file, use_cache))
+
+    @classmethod
+    def from_topology(cls, topology, net_file=""):
+        """
+        Build a ConnectionInfo from an already loaded (or synthetic) NetworkTopology.
+        """
+        connection_info = cls.__new__(cls)
+        connection_info.net_filename = net_file
+        connection_info.load_topology(topology)
+        return connection_info
+
+    def load_topology(self, topology):
+        """
+        Fill the collections from a network_cache.NetworkTopology.
+        """
+        self.topology = topology
         self.outgoing_edges_dict = {}
         self.edge_length_dict = {}
         self.edge_index_dict = {}
         self.edge_vehicle_count = {}
+        self.edge_mean_speed_dict = {}
         self.edge_list = []
+        self.edge_speed_dict = {}
+        self.edge_endpoints_dict = {}
 
-        edge_index = 0
-
-        edges = net.getEdges()
+        edge_ids = topology.edge_ids.tolist()
+        lengths = topology.lengths.tolist()
+        speeds = topology.speeds.tolist()
+        from_coordinates = topology.from_coordinates.tolist()
+        to_coordinates = topology.to_coordinates.tolist()
+        passenger = topology.passenger.tolist()
 
         # collect edge information into dictionaries
-        for current_edge in edges:
-            current_edge_id = current_edge.getID()
-
+        for edge_index, current_edge_id in enumerate(edge_ids):
             # add edge to edge list if it allows passenger vehicles
             # "passenger" is a SUMO defined vehicle class
-            if current_edge.allows("passenger"):
+            if passenger[edge_index]:
                 self.edge_list.append(current_edge_id)
+            self.edge_index_dict[current_edge_id] = edge_index
+            self.outgoing_edges_dict[current_edge_id] = {}
+            self.edge_length_dict[current_edge_id] = lengths[edge_index]
+            self.edge_speed_dict[current_edge_id] = speeds[edge_index]
+            self.edge_endpoints_dict[current_edge_id] = (tuple(from_coordinates[edge_index]),
+                                                         tuple(to_coordinates[edge_index]))
+
+        # collect outgoing edges by direction
+        for from_index, to_index, direction_code in zip(topology.conn_from.tolist(), topology.conn_to.tolist(),
+                                                        topology.conn_direction.tolist()):
+            direction = topology.directions[direction_code]
+            self.outgoing_edges_dict[edge_ids[from_index]][direction] = edge_ids[to_index]
+
+        # per-step congestion state, aligned with edge_list
+        self.edge_list_position = {edge_id: position for position, edge_id in enumerate(self.edge_list)}
+        self.edge_vehicle_counts = np.zeros(len(self.edge_list), dtype=np.float64)
+        self.inverse_edge_lengths = 1.0 / np.array([self.edge_length_dict[edge_id] for edge_id in self.edge_list],
+                                                   dtype=np.float64)
+        self.edge_counts_step = 0
+        self.__densities__ = None
+        self.__densities_step__ = None
+        self.edge_state_listeners = []
+
+        self.network_graph = NetworkGraph(self)
+
+    def add_edge_state_listener(self, listener):
+        """
+        :param listener: function called with the set of edge ids whose vehicle count or mean speed changed,
+                         after every update_edge_vehicle_counts() that changed at least one edge
+        """
+        self.edge_state_listeners.append(listener)
+
+    def remove_edge_state_listener(self, listener):
+        """
+        :param listener: a function registered with add_edge_state_listener()
+        """
+        if listener in self.edge_state_listeners:
+            self.edge_state_listeners.remove(listener)
+
+    def update_edge_vehicle_counts(self, counts, mean_speeds=None):
+        """
+        Store the vehicle counts (and mean speeds) of a new simulation step.
+
+        :param counts: {edge_id: number of vehicles at edge}
+        :param mean_speeds: {edge_id: mean speed of the vehicles at edge}, optional
+        """
+        position = self.edge_list_position
+        changed = set()
+        for edge_id, count in counts.items():
+            if self.edge_vehicle_count.get(edge_id) != count:
+                self.edge_vehicle_count[edge_id] = count
+                if edge_id in position:
+                    self.edge_vehicle_counts[position[edge_id]] = count
+                changed.add(edge_id)
+        if mean_speeds is not None:
+            for edge_id, speed in mean_speeds.items():
+                if self.edge_mean_speed_dict.get(edge_id) != speed:
+                    self.edge_mean_speed_dict[edge_id] = speed
+                    changed.add(edge_id)
+        self.edge_counts_step += 1
+        if changed:
+            for listener in self.edge_state_listeners:
+                listener(changed)
+
+    def edge_densities(self):
+        """
+        :return: float64 [len(edge_list)] vehicles per meter of every edge of edge_list,
+                 computed once per call of update_edge_vehicle_counts and shared by all callers
+        """
+        if self.__densities_step__ != self.edge_counts_step:
+            self.__densities__ = self.edge_vehicle_counts * self.inverse_edge_lengths
+            self.__densities_step__ = self.edge_counts_step
+        return self.__densities__
+
+
+class NetworkGraph:
+    """
+    Compressed sparse row (CSR) copy of ConnectionInfo.outgoing_edges_dict.
+
+    Edges are identified by their index in ConnectionInfo.edge_index_dict. The turns
+    leaving edge i are stored at positions offsets[i]:offsets[i + 1] of targets and
+    direction_codes, in the same order as outgoing_edges_dict[edge_id].
+    Available arrays:
+        - offsets int32 [num_edges + 1]
+        - targets int32 [num_turns] index of the edge a turn leads to
+        - direction_codes int8 [num_turns] index into DIRECTION_LIST
+        - lengths float64 [num_edges] length of every edge
+    :param connection_info: ConnectionInfo object to convert
+    """
+    def __init__(self, connection_info):
+        self.edge_index_dict = connection_info.edge_index_dict
+        self.edge_ids = [None] * len(self.edge_index_dict)
+        for edge_id, index in self.edge_index_dict.items():
+            self.edge_ids[index] = edge_id
+        self.num_edges = len(self.edge_ids)
+
+        self.offsets = np.zeros(self.num_edges + 1, dtype=np.int32)
+        targets = []
+        direction_codes = []
+        for index, edge_id in enumerate(self.edge_ids):
+            for direction, out_edge in connection_info.outgoing_edges_dict.get(edge_id, {}).items():
+                targets.append(self.edge_index_dict[out_edge])
+                direction_codes.append(DIRECTION_CODES.get(direction, -1))
+            self.offsets[index + 1] = len(targets)
+        self.targets = np.array(targets, dtype=np.int32)
+        self.direction_codes = np.array(direction_codes, dtype=np.int8)
+        self.lengths = np.array([connection_info.edge_length_dict[edge_id] for edge_id in self.edge_ids],
+                                dtype=np.float64)
+
+    def index_of(self, edge_id):
+        """
+        :param edge_id: SUMO edge id
+        :return: integer index of the edge
+        """
+        return self.edge_index_dict[edge_id]
+
+    def edge_id_of(self, index):
+        """
+        :param index: integer index of an edge
+        :return: SUMO edge id
+        """
+        return self.edge_ids[index]
+
+    def indices_of(self, edge_ids):
+        """
+        :param edge_ids: iterable of SUMO edge ids
+        :return: int32 array of edge indices
+        """
+        return np.fromiter((self.edge_index_dict[edge_id] for edge_id in edge_ids), dtype=np.int32)
+
+    def edge_ids_of(self, indices):
+        """
+        :param indices: iterable of edge indices
+        :return: list of SUMO edge ids
+        """
+        return [self.edge_ids[index] for index in indices]
+
+    def outgoing(self, index):
+        """
+        :param index: integer index of an edge
+        :return: (targets, direction_codes) arrays of the turns leaving the edge
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.targets[start:end], self.direction_codes[start:end]
 
-            if current_edge_id in self.edge_index_dict.keys():
-                print(current_edge_id + "already exists!")
-            else:
-                self.edge_index_dict[current_edge_id] = edge_index
-                edge_index += 1
-            if current_edge_id in self.outgoing_edges_dict.keys():
-                print(current_edge_id + "already exists!")
-            else:
-                self.outgoing_edges_dict[current_edge_id] = {}
-            if current_edge_id in self.edge_length_dict.keys():
-                print(current_edge_id + "already exists!")
-            else:
-                self.edge_length_dict[current_edge_id] = current_edge.getLength()
-
-            # collect outgoing edges by direction
-            outgoing_edges = current_edge.getOutgoing()
-            for current_outgoing_edge in outgoing_edges:
-                if not current_outgoing_edge.allows("passenger"):
-                    continue
-                connections = current_edge.getConnections(current_outgoing_edge)
-                for connection in connections:
-                    direction = connection.getDirection()
-                    self.outgoing_edges_dict[current_edge_id][direction] = current_outgoing_edge.getID()
+    def direction_of(self, code):
+        """
+        :param code: direction code stored in direction_codes
+        :return: SUMO direction string
+        """
+        return DIRECTION_LIST[code]
@@ -0,0 +1,366 @@
+"""
+    This file contains a contraction hierarchy (CH) of the edge graph.
+
+    The vertices of the graph are the edges of the map and an arc u -> v is a turn,
+    costing the weight of v, as in shortest_path.py. Preprocessing contracts the
+    vertices one by one in order of importance: a contracted vertex v is removed and,
+    for every pair of arcs u -> v -> w whose path is the only shortest one (no witness
+    path around v), a shortcut u -> w remembering its middle vertex v is added. A query
+    is then a bidirectional Dijkstra that only climbs towards more important vertices,
+    which settles a few hundred vertices even on city-scale maps. The shortcuts of the
+    path found are unpacked through their middle vertices back into turns, so the
+    decision list of the route is available as with the other engines.
+
+    The hierarchy is a set of plain arrays that is stored in the cache entry of the map
+    (see network_cache.py), so the preprocessing runs once per network file.
+"""
+
+import heapq
+import os
+
+import numpy as np
+
+from core import network_cache
+
+CH_FORMAT_VERSION = 1
+ARRAY_NAMES = ["rank", "up_offsets", "up_targets", "up_costs", "up_middles",
+               "down_offsets", "down_sources", "down_costs", "down_middles",
+               "turn_from", "turn_to", "turn_direction"]
+
+# bounds of the local witness searches, trading preprocessing time for a few more shortcuts
+WITNESS_SETTLE_LIMIT = 100
+NO_MIDDLE = -1
+
+
+class ContractionHierarchy:
+    """
+    Vertices are edge indices of connection_info.edge_index_dict.
+    Available arrays:
+        - rank int32 [num_edges] contraction order, higher is more important
+        - up_offsets, up_targets, up_costs, up_middles: CSR of the arcs u -> v with
+          rank[v] > rank[u], indexed by u; the middle is the contracted vertex of a
+          shortcut, or -1 for a turn
+        - down_offsets, down_sources, down_costs, down_middles: CSR of the arcs u -> v
+          with rank[u] > rank[v], indexed by v (the backward search runs them reversed)
+        - turn_from, turn_to int32, turn_direction int8: the turns of the map, direction
+          as an index into direction_table
+    :param connection_info: object containing network information
+    :param arrays: {name: array} for every name of ARRAY_NAMES
+    :param direction_table: string table of turn_direction
+    """
+    def __init__(self, connection_info, arrays, direction_table):
+        self.connection_info = connection_info
+        self.arrays = {name: np.asarray(arrays[name]) for name in ARRAY_NAMES}
+        self.direction_table = list(direction_table)
+        self.edge_index_dict = connection_info.edge_index_dict
+        self.rank = self.arrays["rank"]
+
+        # adjacency lists and arc tables in Python objects, which the queries read one by one
+        self.__upward__ = _adjacency(self.arrays["up_offsets"], self.arrays["up_targets"], self.arrays["up_costs"])
+        self.__downward__ = _adjacency(self.arrays["down_offsets"], self.arrays["down_sources"],
+                                       self.arrays["down_costs"])
+        # {(u, v): middle} of every arc, to unpack the shortcuts
+        self.__middle__ = {}
+        up_offsets = self.arrays["up_offsets"].tolist()
+        up_targets = self.arrays["up_targets"].tolist()
+        up_middles = self.arrays["up_middles"].tolist()
+        down_offsets = self.arrays["down_offsets"].tolist()
+        down_sources = self.arrays["down_sources"].tolist()
+        down_middles = self.arrays["down_middles"].tolist()
+        for vertex in range(len(self.rank)):
+            for position in range(up_offsets[vertex], up_offsets[vertex + 1]):
+                self.__middle__[(vertex, up_targets[position])] = up_middles[position]
+            for position in range(down_offsets[vertex], down_offsets[vertex + 1]):
+                self.__middle__[(down_sources[position], vertex)] = down_middles[position]
+        self.__turn_direction__ = {}
+        for from_index, to_index, direction in zip(self.arrays["turn_from"].tolist(), self.arrays["turn_to"].tolist(),
+                                                   self.arrays["turn_direction"].tolist()):
+            # the first turn between two edges is the one outgoing_edges_dict-based searches take
+            self.__turn_direction__.setdefault((from_index, to_index), self.direction_table[direction])
+
+    @classmethod
+    def build(cls, connection_info, edge_weights=None):
+        """
+        Contract every vertex of the edge graph.
+
+        :param connection_info: object containing network information
+        :param edge_weights: {edge_id: weight}; defaults to connection_info.edge_length_dict
+        :return: ContractionHierarchy
+        """
+        if edge_weights is None:
+            edge_weights = connection_info.edge_length_dict
+        edge_index_dict = connection_info.edge_index_dict
+        num_vertices = len(edge_index_dict)
+        weight = [0.0] * num_vertices
+        for edge, index in edge_index_dict.items():
+            weight[index] = edge_weights[edge]
+
+        direction_table = []
+        direction_code = {}
+        turn_from, turn_to, turn_direction = [], [], []
+        # remaining graph: out_arcs[u] = {v: cost}, in_arcs[v] = {u: cost}
+        out_arcs = [dict() for _ in range(num_vertices)]
+        in_arcs = [dict() for _ in range(num_vertices)]
+        # every arc of the hierarchy: {(u, v): (cost, middle)}
+        arcs = {}
+        for edge, outgoing in connection_info.outgoing_edges_dict.items():
+            u = edge_index_dict[edge]
+            for direction, out_edge in outgoing.items():
+                v = edge_index_dict[out_edge]
+                if direction not in direction_code:
+                    direction_code[direction] = len(direction_table)
+                    direction_table.append(direction)
+                turn_from.append(u)
+                turn_to.append(v)
+                turn_direction.append(direction_code[direction])
+                if u != v and (u, v) not in arcs:
+                    arcs[(u, v)] = (weight[v], NO_MIDDLE)
+                    out_arcs[u][v] = weight[v]
+                    in_arcs[v][u] = weight[v]
+
+        contracted = [False] * num_vertices
+        contracted_neighbors = [0] * num_vertices
+        # depth of a vertex in the hierarchy: 1 + the highest level of its contracted neighbors
+        level = [0] * num_vertices
+        rank = [0] * num_vertices
+
+        def shortcuts_of(v):
+            # the shortcuts needed to contract v, as (u, w, cost)
+            shortcuts = []
+            if not in_arcs[v] or not out_arcs[v]:
+                return shortcuts
+            max_out_cost = max(out_arcs[v].values())
+            for u, cost_uv in in_arcs[v].items():
+                targets = {w: cost_uv + cost_vw for w, cost_vw in out_arcs[v].items() if w != u}
+                if not targets:
+                    continue
+                witness = _witness_search(out_arcs, u, v, set(targets), cost_uv + max_out_cost)
+                for w, cost in targets.items():
+                    if witness.get(w, float("inf")) > cost:
+                        shortcuts.append((u, w, cost))
+            return shortcuts
+
+        def priority(v):
+            # edge difference, plus the number of contracted neighbors and the level, which spread the contraction
+            return len(shortcuts_of(v)) - len(in_arcs[v]) - len(out_arcs[v]) + contracted_neighbors[v] + level[v]
+
+        priorities = [priority(v) for v in range(num_vertices)]
+        queue = [(priorities[v], v) for v in range(num_vertices)]
+        heapq.heapify(queue)
+        next_rank = 0
+        while queue:
+            queued_priority, v = heapq.heappop(queue)
+            # skip the entries left behind by a priority update
+            if contracted[v] or queued_priority != priorities[v]:
+                continue
+
+            for u, w, cost in shortcuts_of(v):
+                if cost < out_arcs[u].get(w, float("inf")):
+                    out_arcs[u][w] = cost
+                    in_arcs[w][u] = cost
+                    arcs[(u, w)] = (cost, v)
+            contracted[v] = True
+            rank[v] = next_rank
+            next_rank += 1
+            neighbors = set(in_arcs[v]) | set(out_arcs[v])
+            for u in in_arcs[v]:
+                del out_arcs[u][v]
+            for w in out_arcs[v]:
+                del in_arcs[w][v]
+            in_arcs[v] = {}
+            out_arcs[v] = {}
+            # the neighbors are the only vertices whose priority changed
+            for neighbor in neighbors:
+                contracted_neighbors[neighbor] += 1
+                level[neighbor] = max(level[neighbor], level[v] + 1)
+                if not contracted[neighbor]:
+                    priorities[neighbor] = priority(neighbor)
+                    heapq.heappush(queue, (priorities[neighbor], neighbor))
+
+        up = [[] for _ in range(num_vertices)]
+        down = [[] for _ in range(num_vertices)]
+        for (u, v), (cost, middle) in arcs.items():
+            if rank[v] > rank[u]:
+                up[u].append((v, cost, middle))
+            else:
+                down[v].append((u, cost, middle))
+
+        arrays = {"rank": np.array(rank, dtype=np.int32),
+                  "turn_from": np.array(turn_from, dtype=np.int32),
+                  "turn_to": np.array(turn_to, dtype=np.int32),
+                  "turn_direction": np.array(turn_direction, dtype=np.int8)}
+        for prefix, other, lists in (("up", "targets", up), ("down", "sources", down)):
+            arrays[prefix + "_offsets"] = np.cumsum([0] + [len(arcs_of) for arcs_of in lists]).astype(np.int32)
+            arrays[prefix + "_" + other] = np.array([arc[0] for arcs_of in lists for arc in arcs_of], dtype=np.int32)
+            arrays[prefix + "_costs"] = np.array([arc[1] for arcs_of in lists for arc in arcs_of], dtype=np.float64)
+            arrays[prefix + "_middles"] = np.array([arc[2] for arcs_of in lists for arc in arcs_of], dtype=np.int32)
+        return cls(connection_info, arrays, direction_table)
+
+    @classmethod
+    def for_network(cls, connection_info, use_cache=True):
+        """
+        Load the hierarchy of connection_info.net_filename (on edge lengths) from the map
+        cache, building and saving it on a miss.
+
+        :return: ContractionHierarchy
+        """
+        net_file = connection_info.net_filename
+        if not use_cache or not net_file or not os.path.exists(net_file):
+            return cls.build(connection_info)
+        directory = os.path.join(network_cache.cache_directory(net_file), "contraction-hierarchy")
+        hierarchy = cls.load(connection_info, directory)
+        if hierarchy is not None:
+            return hierarchy
+        hierarchy = cls.build(connection_info)
+        try:
+            hierarchy.save(directory)
+        except OSError as err:
+            print("Could not write contraction hierarchy cache for {}: {}".format(net_file, err))
+        return hierarchy
+
+    def save(self, directory):
+        """
+        Write the hierarchy into directory atomically.
+        """
+        network_cache.save_arrays(directory, self.arrays, {"version": CH_FORMAT_VERSION,
+                                                       "direction_table": self.direction_table})
+
+    @classmethod
+    def load(cls, connection_info, directory):
+        """
+        :return: ContractionHierarchy, or None if directory does not hold a complete hierarchy of the current format
+        """
+        loaded = network_cache.load_arrays(directory, ARRAY_NAMES, CH_FORMAT_VERSION)
+        if loaded is None:
+            return None
+        arrays, meta = loaded
+        if arrays["rank"].shape != (len(connection_info.edge_index_dict),):
+            return None
+        return cls(connection_info, arrays, meta["direction_table"])
+
+    def __search__(self, start_index, destination_index):
+        """
+        Bidirectional upward Dijkstra.
+
+        :return: (distance, meeting vertex, forward parents, backward parents); distance is
+                 inf if destination is unreachable
+        """
+        infinity = float("inf")
+        distances = ({start_index: 0.0}, {destination_index: 0.0})
+        parents = ({start_index: None}, {destination_index: None})
+        heaps = ([(0.0, start_index)], [(0.0, destination_index)])
+        graphs = (self.__upward__, self.__downward__)
+        # arcs coming down into a vertex, against the direction of each search
+        stall_graphs = (self.__downward__, self.__upward__)
+        best = infinity if start_index != destination_index else 0.0
+        meeting = start_index if start_index == destination_index else None
+
+        while heaps[0] or heaps[1]:
+            # advance the side whose next vertex is closer
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            distance, vertex = heapq.heappop(heaps[side])
+            if distance > distances[side][vertex]:
+                continue
+            if distance >= best:
+                # nothing shorter can be found from this side any more
+                heaps[side].clear()
+                continue
+            other_distance = distances[1 - side].get(vertex)
+            if other_distance is not None and distance + other_distance < best:
+                best = distance + other_distance
+                meeting = vertex
+            side_distances = distances[side]
+            # stall on demand: a higher vertex already offers a shorter way here, so nothing
+            # found from vertex could be part of a shortest path
+            if any(side_distances.get(higher, infinity) + cost < distance
+                   for higher, cost in stall_graphs[side][vertex]):
+                continue
+            side_parents = parents[side]
+            for neighbor, cost in graphs[side][vertex]:
+                new_distance = distance + cost
+                if new_distance < side_distances.get(neighbor, infinity):
+                    side_distances[neighbor] = new_distance
+                    side_parents[neighbor] = vertex
+                    heapq.heappush(heaps[side], (new_distance, neighbor))
+        return best, meeting, parents[0], parents[1]
+
+    def __unpack__(self, u, v):
+        """
+        :return: list of the directions of the turns behind the arc u -> v
+        """
+        directions = []
+        stack = [(u, v)]
+        while stack:
+            u, v = stack.pop()
+            middle = self.__middle__[(u, v)]
+            if middle == NO_MIDDLE:
+                directions.append(self.__turn_direction__[(u, v)])
+            else:
+                # the first half must come out first
+                stack.append((middle, v))
+                stack.append((u, middle))
+        return directions
+
+    def distance(self, start_edge, destination):
+        """
+        :return: weight of the edges driven after start_edge to reach destination (inf if unreachable)
+        """
+        return self.__search__(self.edge_index_dict[start_edge], self.edge_index_dict[destination])[0]
+
+    def directions(self, start_edge, destination):
+        """
+        :param start_edge: edge id the vehicle is currently on
+        :param destination: edge id the vehicle is heading to
+        :return: list of directions of a shortest path from start_edge to destination ([] if unreachable)
+        """
+        best, meeting, forward_parents, backward_parents = self.__search__(self.edge_index_dict[start_edge],
+                                                                           self.edge_index_dict[destination])
+        if meeting is None:
+            return []
+        path = [meeting]
+        while forward_parents[path[0]] is not None:
+            path.insert(0, forward_parents[path[0]])
+        while backward_parents[path[-1]] is not None:
+            path.append(backward_parents[path[-1]])
+        directions = []
+        for u, v in zip(path, path[1:]):
+            directions.extend(self.__unpack__(u, v))
+        return directions
+
+
+def _adjacency(offsets, others, costs):
+    """
+    :return: list of [(neighbor, cost)] per vertex of a CSR
+    """
+    offsets = offsets.tolist()
+    pairs = list(zip(others.tolist(), costs.tolist()))
+    return [pairs[offsets[vertex]:offsets[vertex + 1]] for vertex in range(len(offsets) - 1)]
+
+
+def _witness_search(out_arcs, source, excluded, targets, max_cost):
+    """
+    Dijkstra from source in the remaining graph avoiding excluded, stopped at max_cost,
+    once every target is settled, or after WITNESS_SETTLE_LIMIT vertices.
+
+    :return: {vertex: distance} of the vertices reached
+    """
+    distances = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    remaining = set(targets)
+    while heap and remaining and settled < WITNESS_SETTLE_LIMIT:
+        distance, vertex = heapq.heappop(heap)
+        if distance > distances[vertex]:
+            continue
+        if distance > max_cost:
+            break
+        settled += 1
+        remaining.discard(vertex)
+        for neighbor, cost in out_arcs[vertex].items():
+            if neighbor == excluded:
+                continue
+            new_distance = distance + cost
+            if new_distance < distances.get(neighbor, float("inf")):
+                distances[neighbor] = new_distance
+                heapq.heappush(heap, (new_distance, neighbor))
+    return distances
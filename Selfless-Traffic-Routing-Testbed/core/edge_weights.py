@@ -0,0 +1,84 @@
+"""
+    This file contains the congestion aware edge weight model shared by the routing policies.
+
+    The weight of an edge is an estimate of the time needed to drive it, built from
+    its length and the live state of the simulation:
+        weight = length / speed * (1 + alpha * occupancy ** beta)
+    speed is the mean speed of the vehicles on the edge reported by SUMO, clamped to
+    [min_speed, speed limit] (the speed limit when the edge is empty), and occupancy
+    is the fraction of the edge filled by its vehicles, count * vehicle_spacing / length,
+    capped at 1. The occupancy term is the BPR volume/delay curve; it raises the cost
+    of edges that are filling up before their vehicles actually slow down.
+
+    The weights are kept up to date incrementally: ConnectionInfo reports the edges
+    whose count or mean speed changed at each step, only those are re-estimated, and
+    the edges whose weight moved are passed on to the listeners of the model (e.g.
+    ShortestPathTreeCache.update_edge_weights).
+"""
+
+from core.shortest_path import travel_time_weights
+
+# meters of lane taken by one vehicle in a queue, SUMO default length (5 m) plus minGap (2.5 m)
+DEFAULT_VEHICLE_SPACING = 7.5
+
+
+class CongestionWeights:
+    """
+    :param connection_info: object containing network information, the model registers itself as one of its
+                            edge state listeners
+    :param alpha: weight of the occupancy term, 0 to use the mean speeds only
+    :param beta: exponent of the occupancy term
+    :param min_speed: lowest speed used in the estimate (m/s), keeps stopped edges at a finite cost
+    :param vehicle_spacing: meters of lane taken by one vehicle (edges are counted as single lane)
+    Available collections:
+        - weights {edge_id: estimated travel time}, updated in place, can be passed as edge_weights to the
+          shortest path functions
+        - free_flow_weights {edge_id: length / speed limit}
+    """
+    def __init__(self, connection_info, alpha=1.0, beta=2.0, min_speed=0.5,
+                 vehicle_spacing=DEFAULT_VEHICLE_SPACING):
+        self.connection_info = connection_info
+        self.alpha = alpha
+        self.beta = beta
+        self.min_speed = min_speed
+        self.vehicle_spacing = vehicle_spacing
+        self.free_flow_weights = travel_time_weights(connection_info)
+        self.weights = dict(self.free_flow_weights)
+        self.listeners = []
+        # pick up a state stored before the model was created
+        self.__update__(set(connection_info.edge_vehicle_count) | set(connection_info.edge_mean_speed_dict))
+        connection_info.add_edge_state_listener(self.__update__)
+
+    def add_listener(self, listener):
+        """
+        :param listener: function called with {edge_id: new weight} of the edges whose weight changed
+        """
+        self.listeners.append(listener)
+
+    def estimate(self, edge):
+        """
+        :param edge: edge id
+        :return: estimated travel time of the edge from the last stored simulation state
+        """
+        length = self.connection_info.edge_length_dict[edge]
+        speed_limit = self.connection_info.edge_speed_dict[edge]
+        count = self.connection_info.edge_vehicle_count.get(edge, 0)
+        speed = speed_limit
+        if count > 0:
+            speed = min(max(self.connection_info.edge_mean_speed_dict.get(edge, speed_limit), self.min_speed),
+                        speed_limit)
+        occupancy = min(1.0, count * self.vehicle_spacing / length) if length > 0 else 0.0
+        return length / speed * (1.0 + self.alpha * occupancy ** self.beta)
+
+    def __update__(self, edges):
+        changed = {}
+        for edge in edges:
+            if edge not in self.weights:
+                continue
+            weight = self.estimate(edge)
+            if weight != self.weights[edge]:
+                self.weights[edge] = weight
+                changed[edge] = weight
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
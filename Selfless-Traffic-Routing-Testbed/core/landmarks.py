@@ -0,0 +1,207 @@
+"""
+    This file contains the ALT (A*, Landmarks, Triangle inequality) index of a map.
+
+    A few landmark edges are picked once per network and the edge-length distances
+    from every landmark to every edge (forward) and from every edge to every landmark
+    (backward) are precomputed. For any landmark L the triangle inequality gives two
+    lower bounds of the distance left from edge e to the destination t:
+        d(e, t) >= d(L, t) - d(L, e)        d(e, t) >= d(e, L) - d(t, L)
+    Their maximum over the landmarks is a consistent A* heuristic that is usually much
+    tighter than a geometric one. The distance d(u, v) follows the cost model of
+    shortest_path.py: the weight of every edge after u, up to and including v.
+
+    The arrays are persisted in the cache entry of the map (see network_cache.py), so
+    the preprocessing runs once per network file.
+"""
+
+import os
+
+import numpy as np
+
+from core import network_cache
+from core.shortest_path import dijkstra, reverse_dijkstra, build_incoming_edges_dict, astar, reconstruct_directions
+
+LANDMARKS_FORMAT_VERSION = 1
+DEFAULT_NUM_LANDMARKS = 8
+
+
+class LandmarkIndex:
+    """
+    :param connection_info: object containing network information
+    :param landmarks: list of landmark edge ids
+    :param forward: float64 [num_landmarks, num_edges] d(landmark, edge), inf if unreachable
+    :param backward: float64 [num_landmarks, num_edges] d(edge, landmark), inf if unreachable
+    Edges are indexed by connection_info.edge_index_dict.
+    """
+    def __init__(self, connection_info, landmarks, forward, backward):
+        self.connection_info = connection_info
+        self.landmarks = list(landmarks)
+        self.forward = forward
+        self.backward = backward
+        finite = np.concatenate([forward[np.isfinite(forward)], backward[np.isfinite(backward)], [0.0]])
+        # the bounds are differences of long floating point sums, keep them on the safe side
+        self.tolerance = 1e-9 * len(connection_info.edge_index_dict) * float(np.max(finite))
+        # per edge lists of the landmark distances, cheaper to read one by one than the arrays
+        self.__forward_of_edge__ = forward.T.tolist()
+        self.__backward_of_edge__ = backward.T.tolist()
+
+    @classmethod
+    def build(cls, connection_info, num_landmarks=DEFAULT_NUM_LANDMARKS):
+        """
+        Pick the landmarks by farthest selection and compute their distance arrays.
+
+        Every new landmark is the passenger edge whose distance to the closest landmark
+        already chosen is the largest, which spreads them along the border of the map.
+        """
+        edge_index_dict = connection_info.edge_index_dict
+        num_edges = len(edge_index_dict)
+        weights = connection_info.edge_length_dict
+        incoming_edges_dict = build_incoming_edges_dict(connection_info.outgoing_edges_dict)
+        candidates = [edge_index_dict[edge] for edge in connection_info.edge_list]
+
+        landmarks = []
+        forward_rows = []
+        backward_rows = []
+        if candidates:
+            # the first landmark is the edge farthest from an arbitrary edge
+            closest = _forward_distances(connection_info, weights, connection_info.edge_list[0], num_edges)
+        while candidates and len(landmarks) < min(num_landmarks, len(candidates)):
+            candidate_distances = closest[candidates]
+            candidate_distances[~np.isfinite(candidate_distances)] = -1.0
+            landmark_index = candidates[int(np.argmax(candidate_distances))]
+            landmark = connection_info.network_graph.edge_id_of(landmark_index)
+            if landmark in landmarks:
+                break
+            landmarks.append(landmark)
+            forward_rows.append(_forward_distances(connection_info, weights, landmark, num_edges))
+            backward_rows.append(_backward_distances(connection_info, incoming_edges_dict, weights, landmark,
+                                                     num_edges))
+            if len(landmarks) == 1:
+                closest = forward_rows[-1].copy()
+            else:
+                closest = np.fmin(closest, forward_rows[-1])
+
+        forward = np.array(forward_rows, dtype=np.float64).reshape(len(landmarks), num_edges)
+        backward = np.array(backward_rows, dtype=np.float64).reshape(len(landmarks), num_edges)
+        return cls(connection_info, landmarks, forward, backward)
+
+    @classmethod
+    def for_network(cls, connection_info, num_landmarks=DEFAULT_NUM_LANDMARKS, use_cache=True):
+        """
+        Load the index of connection_info.net_filename from the map cache, building and
+        saving it on a miss.
+
+        :return: LandmarkIndex
+        """
+        net_file = connection_info.net_filename
+        if not use_cache or not net_file or not os.path.exists(net_file):
+            return cls.build(connection_info, num_landmarks)
+        directory = os.path.join(network_cache.cache_directory(net_file), "landmarks-{}".format(num_landmarks))
+        index = cls.load(connection_info, directory)
+        if index is not None:
+            return index
+        index = cls.build(connection_info, num_landmarks)
+        try:
+            index.save(directory)
+        except OSError as err:
+            print("Could not write landmark cache for {}: {}".format(net_file, err))
+        return index
+
+    def save(self, directory):
+        """
+        Write the index into directory atomically.
+        """
+        network_cache.save_arrays(directory, {"forward": self.forward, "backward": self.backward},
+                                  {"version": LANDMARKS_FORMAT_VERSION, "landmarks": self.landmarks})
+
+    @classmethod
+    def load(cls, connection_info, directory):
+        """
+        :return: LandmarkIndex, or None if directory does not hold a complete index of the current format
+        """
+        loaded = network_cache.load_arrays(directory, ["forward", "backward"], LANDMARKS_FORMAT_VERSION)
+        if loaded is None:
+            return None
+        arrays, meta = loaded
+        forward, backward = arrays["forward"], arrays["backward"]
+        if forward.shape[1:] != (len(connection_info.edge_index_dict),):
+            return None
+        return cls(connection_info, meta["landmarks"], forward, backward)
+
+    def lower_bound(self, edge, destination):
+        """
+        :param edge: edge id
+        :param destination: edge id
+        :return: lower bound of the distance from edge to destination (inf if unreachable)
+        """
+        return self.heuristic(destination)(edge)
+
+    def heuristic(self, destination):
+        """
+        :param destination: edge id
+        :return: function edge_id -> lower bound of the distance left to reach destination,
+                 to be passed to shortest_path.astar()
+        """
+        edge_index_dict = self.connection_info.edge_index_dict
+        forward_of_edge = self.__forward_of_edge__
+        backward_of_edge = self.__backward_of_edge__
+        destination_index = edge_index_dict[destination]
+        forward_to_destination = forward_of_edge[destination_index]
+        backward_from_destination = backward_of_edge[destination_index]
+        pairs = list(zip(forward_to_destination, backward_from_destination))
+        tolerance = self.tolerance
+
+        def heuristic(edge):
+            edge_index = edge_index_dict[edge]
+            best = 0.0
+            # inf - inf is nan, and nan never wins a comparison
+            for (landmark_to_destination, destination_to_landmark), landmark_to_edge, edge_to_landmark in \
+                    zip(pairs, forward_of_edge[edge_index], backward_of_edge[edge_index]):
+                bound = landmark_to_destination - landmark_to_edge
+                if bound > best:
+                    best = bound
+                bound = edge_to_landmark - destination_to_landmark
+                if bound > best:
+                    best = bound
+            return best - tolerance if best > tolerance else 0.0
+        return heuristic
+
+    def directions(self, start_edge, destination, edge_weights=None):
+        """
+        Compute the decision list of the shortest path between two edges with A* guided by the landmarks.
+
+        :param start_edge: edge id the vehicle is currently on
+        :param destination: edge id the vehicle is heading to
+        :param edge_weights: {edge_id: weight}, each at least the edge length for the bounds to hold;
+                             defaults to connection_info.edge_length_dict
+        :return: list of directions from start_edge to destination ([] if unreachable)
+        """
+        if edge_weights is None:
+            edge_weights = self.connection_info.edge_length_dict
+        distances, predecessors = astar(self.connection_info.outgoing_edges_dict, edge_weights, start_edge,
+                                        destination, self.heuristic(destination),
+                                        self.connection_info.edge_index_dict)
+        return reconstruct_directions(predecessors, start_edge, destination)
+
+
+def _forward_distances(connection_info, weights, landmark, num_edges):
+    """
+    :return: float64 [num_edges] d(landmark, edge)
+    """
+    row = np.full(num_edges, np.inf)
+    distances, _ = dijkstra(connection_info.outgoing_edges_dict, weights, landmark,
+                            edge_order=connection_info.edge_index_dict)
+    for edge, distance in distances.items():
+        row[connection_info.edge_index_dict[edge]] = distance - weights[landmark]
+    return row
+
+
+def _backward_distances(connection_info, incoming_edges_dict, weights, landmark, num_edges):
+    """
+    :return: float64 [num_edges] d(edge, landmark)
+    """
+    row = np.full(num_edges, np.inf)
+    distances, _ = reverse_dijkstra(incoming_edges_dict, weights, landmark, connection_info.edge_index_dict)
+    for edge, distance in distances.items():
+        row[connection_info.edge_index_dict[edge]] = distance
+    return row
@@ -0,0 +1,261 @@
+"""
+    This file contains a persistent on-disk cache of parsed SUMO networks.
+
+    Parsing a .net.xml with sumolib dominates the start-up of every experiment on
+    large maps. The topology needed by ConnectionInfo and the vehicle generator is
+    therefore stored once as plain NumPy arrays (one .npy file each, so they can be
+    memory-mapped) plus a small JSON file holding the string tables. An entry is keyed
+    by the absolute path, the modification time and the SHA-1 of the network file, so
+    editing the map simply produces a new entry.
+
+    The cache directory defaults to a ".netcache" directory next to the network file
+    and can be moved with the STR_SUMO_CACHE_DIR environment variable.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("No environment variable SUMO_HOME!")
+import sumolib
+
+# bump whenever the layout of a cache entry changes
+CACHE_FORMAT_VERSION = 2
+CACHE_DIR_ENV = "STR_SUMO_CACHE_DIR"
+DEFAULT_CACHE_DIR_NAME = ".netcache"
+
+META_FILE = "meta.json"
+ARRAY_NAMES = ["edge_ids", "lengths", "speeds", "from_coordinates", "to_coordinates", "passenger", "permissions",
+               "conn_from", "conn_to", "conn_direction"]
+
+
+class NetworkTopology:
+    """
+    Topology of a SUMO network stored as arrays indexed by edge position in net.getEdges().
+    Available collections:
+        - edge_ids [num_edges] edge id strings
+        - lengths float64 [num_edges]
+        - speeds float64 [num_edges] speed limit of every edge
+        - from_coordinates, to_coordinates float64 [num_edges, 2] (x, y) of the from/to
+          junction of every edge, in network coordinates (meters)
+        - passenger bool [num_edges] True if the edge allows "passenger" vehicles
+        - permissions uint64 [num_edges] bit i set if vehicle_classes[i] is allowed
+        - conn_from, conn_to int32 [num_connections] edge indices of every turn between
+          passenger edges, in the order sumolib reports them
+        - conn_direction int8 [num_connections] index into directions
+        - vehicle_classes [str] and directions [str] string tables
+    """
+    def __init__(self, arrays, vehicle_classes, directions):
+        self.edge_ids = arrays["edge_ids"]
+        self.lengths = arrays["lengths"]
+        self.speeds = arrays["speeds"]
+        self.from_coordinates = arrays["from_coordinates"]
+        self.to_coordinates = arrays["to_coordinates"]
+        self.passenger = arrays["passenger"]
+        self.permissions = arrays["permissions"]
+        self.conn_from = arrays["conn_from"]
+        self.conn_to = arrays["conn_to"]
+        self.conn_direction = arrays["conn_direction"]
+        self.vehicle_classes = vehicle_classes
+        self.directions = directions
+
+    def allowed_classes(self, index):
+        """
+        :param index: edge index
+        :return: list of the vehicle classes allowed on the edge
+        """
+        mask = int(self.permissions[index])
+        return [vehicle_class for bit, vehicle_class in enumerate(self.vehicle_classes) if mask >> bit & 1]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+
+def parse_network_topology(net_file):
+    """
+    Parse net_file with sumolib and convert it into a NetworkTopology.
+
+    :param net_file: file name of a SUMO network file, e.g. 'test.net.xml'
+    """
+    net = sumolib.net.readNet(net_file)
+    edges = net.getEdges()
+    edge_position = {edge.getID(): index for index, edge in enumerate(edges)}
+
+    vehicle_classes = sorted({vehicle_class for edge in edges for vehicle_class in edge.getPermissions()})
+    class_bit = {vehicle_class: bit for bit, vehicle_class in enumerate(vehicle_classes)}
+    directions = []
+    direction_code = {}
+
+    permissions = np.zeros(len(edges), dtype=np.uint64)
+    conn_from, conn_to, conn_direction = [], [], []
+    for index, edge in enumerate(edges):
+        mask = 0
+        for vehicle_class in edge.getPermissions():
+            mask |= 1 << class_bit[vehicle_class]
+        permissions[index] = mask
+
+        # same traversal as ConnectionInfo used to do on the sumolib objects
+        for out_edge in edge.getOutgoing():
+            if not out_edge.allows("passenger"):
+                continue
+            for connection in edge.getConnections(out_edge):
+                direction = connection.getDirection()
+                if direction not in direction_code:
+                    direction_code[direction] = len(directions)
+                    directions.append(direction)
+                conn_from.append(index)
+                conn_to.append(edge_position[out_edge.getID()])
+                conn_direction.append(direction_code[direction])
+
+    arrays = {
+        "edge_ids": np.array([edge.getID() for edge in edges], dtype=str),
+        "lengths": np.array([edge.getLength() for edge in edges], dtype=np.float64),
+        "speeds": np.array([edge.getSpeed() for edge in edges], dtype=np.float64),
+        "from_coordinates": np.array([edge.getFromNode().getCoord()[:2] for edge in edges],
+                                     dtype=np.float64).reshape(len(edges), 2),
+        "to_coordinates": np.array([edge.getToNode().getCoord()[:2] for edge in edges],
+                                   dtype=np.float64).reshape(len(edges), 2),
+        "passenger": np.array([edge.allows("passenger") for edge in edges], dtype=bool),
+        "permissions": permissions,
+        "conn_from": np.array(conn_from, dtype=np.int32),
+        "conn_to": np.array(conn_to, dtype=np.int32),
+        "conn_direction": np.array(conn_direction, dtype=np.int8),
+    }
+    return NetworkTopology(arrays, vehicle_classes, directions)
+
+
+def cache_key(net_file):
+    """
+    :param net_file: path of a SUMO network file
+    :return: hex digest identifying the file by absolute path, mtime and content hash
+    """
+    path = os.path.abspath(net_file)
+    content_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            content_hash.update(chunk)
+    key = hashlib.sha1()
+    key.update(path.encode())
+    key.update(str(os.stat(path).st_mtime_ns).encode())
+    key.update(content_hash.digest())
+    key.update(str(CACHE_FORMAT_VERSION).encode())
+    return key.hexdigest()[:20]
+
+
+def cache_directory(net_file):
+    """
+    :param net_file: path of a SUMO network file
+    :return: directory holding the cache entry of net_file; other per-map artifacts
+             (e.g. routing indices) may be stored next to the topology in it
+    """
+    path = os.path.abspath(net_file)
+    root = os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.dirname(path), DEFAULT_CACHE_DIR_NAME)
+    path_digest = hashlib.sha1(path.encode()).hexdigest()[:8]
+    return os.path.join(root, "{}.{}.{}".format(os.path.basename(path), path_digest, cache_key(net_file)))
+
+
+def save_arrays(directory, arrays, meta):
+    """
+    Write {name: array} as one .npy file each, plus meta as a JSON file, into directory
+    atomically: readers see either no directory or a complete one.
+
+    :return: False if another process wrote the same directory first
+    """
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    temp_directory = tempfile.mkdtemp(dir=parent)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_directory, name + ".npy"), np.asarray(array))
+    with open(os.path.join(temp_directory, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(temp_directory, directory)
+    except OSError:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        return False
+    return True
+
+
+def load_arrays(directory, names, version, mmap_mode=None):
+    """
+    Read a directory written by save_arrays().
+
+    :param names: the arrays to load
+    :param version: expected value of meta["version"]
+    :param mmap_mode: passed to np.load, e.g. 'r' to memory-map the arrays
+    :return: ({name: array}, meta), or None if directory is not a complete entry of that version
+    """
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("version") != version:
+            return None
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode) for name in names}
+    except (OSError, ValueError):
+        return None
+    return arrays, meta
+
+
+def save_network_topology(topology, directory):
+    """
+    Write topology into directory atomically; stale entries of the same map are removed.
+    """
+    meta = {"version": CACHE_FORMAT_VERSION,
+            "vehicle_classes": topology.vehicle_classes,
+            "directions": topology.directions}
+    if not save_arrays(directory, topology.arrays(), meta):
+        # another process wrote the same entry first
+        return
+
+    parent = os.path.dirname(directory)
+    prefix = os.path.basename(directory).rsplit(".", 1)[0] + "."
+    for entry in os.listdir(parent):
+        if entry.startswith(prefix) and entry != os.path.basename(directory):
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+def load_cached_topology(directory):
+    """
+    Memory-map a cache entry.
+
+    :return: NetworkTopology, or None if directory is not a complete entry of the current format
+    """
+    loaded = load_arrays(directory, ARRAY_NAMES, CACHE_FORMAT_VERSION, mmap_mode='r')
+    if loaded is None:
+        return None
+    arrays, meta = loaded
+    return NetworkTopology(arrays, meta["vehicle_classes"], meta["directions"])
+
+
+def load_network_topology(net_file, use_cache=True):
+    """
+    Load the topology of net_file from the cache, parsing and caching it on a miss.
+
+    :param net_file: file name of a SUMO network file, e.g. 'test.net.xml'
+    :param use_cache: set to False to always parse the XML and leave the cache untouched
+    :return: NetworkTopology
+    """
+    if not use_cache:
+        return parse_network_topology(net_file)
+
+    directory = cache_directory(net_file)
+    topology = load_cached_topology(directory)
+    if topology is not None:
+        return topology
+
+    topology = parse_network_topology(net_file)
+    try:
+        save_network_topology(topology, directory)
+    except OSError as err:
+        # a read-only map directory only costs us the speed-up
+        print("Could not write network cache for {}: {}".format(net_file, err))
+    return topology
@@ -15,6 +15,7 @@ else:
 
 from sumolib import checkBinary
 import sumolib
+from core import Util
 
 
 
@@ -83,3 +84,21 @@ def getEdgesInfo(net):
                 out_dict[current_edge_id][dir_now] = current_out_edge.getID()
 
     return [length_dict, out_dict, index_dict, edge_list]
+
+
+def getCachedEdgesInfo(net_file_name):
+    """
+        param @net_file_name <str>: name of/path to the XML file from which the
+                                    map network information is to be retrieved.
+
+        Function to retrieve the same dictionaries as getEdgesInfo from the on-disk
+        network cache (see network_cache.py) without parsing the XML again. The return
+        value is a list of four elements, which are respectively
+            [0] a Python dictionary of the lengths of the edges.
+            [1] a Python dictionary of the outgoings of the edges.
+            [2] a Python dictionary of the index assignment of the edges.
+            [3] a list of the IDs of the edges that allow passenger vehicles.
+    """
+    connection_info = Util.ConnectionInfo(net_file_name)
+    return [connection_info.edge_length_dict, connection_info.outgoing_edges_dict,
+            connection_info.edge_index_dict, connection_info.edge_list]
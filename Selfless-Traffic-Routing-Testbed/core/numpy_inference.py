@@ -0,0 +1,171 @@
+"""
+    This file contains a NumPy implementation of the forward pass of trained Keras models.
+
+    The routing models shipped with the testbed (e.g. test/rl-high-all-fixed-late.h5)
+    are small sequential networks of dense layers. Loading them with Keras pulls in the
+    whole TensorFlow runtime and every predict() call pays a fixed dispatch overhead.
+    load_model() reads the architecture and the weights straight from the HDF5 file
+    with h5py, and DenseNetwork.predict() runs the layers as float32 matrix products
+    plus activations, on a whole batch of states at once.
+
+    Supported layers: InputLayer, Dense, Activation, LeakyReLU, ReLU, Dropout and Flatten.
+"""
+
+import json
+
+import h5py
+import numpy as np
+
+
+def _linear(x):
+    return x
+
+
+def _relu(x):
+    return np.maximum(x, 0.0)
+
+
+def _sigmoid(x):
+    # split by sign so that np.exp never overflows
+    result = np.empty_like(x)
+    positive = x >= 0
+    result[positive] = 1.0 / (1.0 + np.exp(-x[positive]))
+    exp_x = np.exp(x[~positive])
+    result[~positive] = exp_x / (1.0 + exp_x)
+    return result
+
+
+def _tanh(x):
+    return np.tanh(x)
+
+
+def _softmax(x):
+    exp_x = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return exp_x / np.sum(exp_x, axis=-1, keepdims=True)
+
+
+def _elu(x):
+    return np.where(x > 0, x, np.expm1(np.minimum(x, 0.0)))
+
+
+def _softplus(x):
+    return np.logaddexp(x, 0.0)
+
+
+ACTIVATIONS = {
+    "linear": _linear,
+    "relu": _relu,
+    "sigmoid": _sigmoid,
+    "tanh": _tanh,
+    "softmax": _softmax,
+    "elu": _elu,
+    "softplus": _softplus,
+}
+
+
+def _leaky_relu(alpha):
+    return lambda x: np.where(x > 0, x, np.float32(alpha) * x)
+
+
+def _dense(kernel, bias, activation):
+    kernel = np.asarray(kernel, dtype=np.float32)
+    bias = None if bias is None else np.asarray(bias, dtype=np.float32)
+
+    def layer(x):
+        x = x @ kernel
+        if bias is not None:
+            x += bias
+        return activation(x)
+    return layer
+
+
+def _activation(name):
+    if name not in ACTIVATIONS:
+        raise ValueError("Unsupported activation '{}', expected one of {}".format(name, sorted(ACTIVATIONS)))
+    return ACTIVATIONS[name]
+
+
+class DenseNetwork:
+    """
+    A sequential stack of layers evaluated with NumPy, see load_model().
+
+    :param layers: list of functions mapping a float32 [batch, n] array to the next one
+    :param input_size: number of features of a state, or None if unknown
+    """
+    def __init__(self, layers, input_size=None):
+        self.layers = layers
+        self.input_size = input_size
+
+    def predict(self, states):
+        """
+        :param states: array [batch, input_size] (or a single state [input_size])
+        :return: float32 array [batch, output_size], like keras Model.predict
+        """
+        x = np.asarray(states, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        for layer in self.layers:
+            x = layer(x)
+        return x
+
+
+def _weights_of(model_weights, layer_name):
+    """
+    :return: {weight name without the layer prefix, e.g. "kernel:0": array}
+    """
+    group = model_weights[layer_name]
+    weights = {}
+    for weight_name in group.attrs.get("weight_names", []):
+        if isinstance(weight_name, bytes):
+            weight_name = weight_name.decode("utf8")
+        weights[weight_name.split("/")[-1]] = group[weight_name][()]
+    return weights
+
+
+def load_model(model_file):
+    """
+    Load a sequential Keras model saved with model.save() into a DenseNetwork.
+
+    :param model_file: path of the .h5 file
+    :return: DenseNetwork
+    :raises ValueError: if the model uses a layer or an activation that is not supported
+    """
+    with h5py.File(model_file, "r") as f:
+        model_config = f.attrs["model_config"]
+        if isinstance(model_config, bytes):
+            model_config = model_config.decode("utf8")
+        model_config = json.loads(model_config)
+        if model_config["class_name"] != "Sequential":
+            raise ValueError("Only Sequential models are supported, got " + model_config["class_name"])
+        layer_configs = model_config["config"]
+        # Keras >= 2.2.3 stores {"name": ..., "layers": [...]}, older versions the list itself
+        if isinstance(layer_configs, dict):
+            layer_configs = layer_configs["layers"]
+
+        model_weights = f["model_weights"] if "model_weights" in f else f
+        layers = []
+        input_size = None
+        for layer_config in layer_configs:
+            class_name = layer_config["class_name"]
+            config = layer_config["config"]
+            if input_size is None and config.get("batch_input_shape"):
+                input_size = config["batch_input_shape"][-1]
+
+            if class_name == "Dense":
+                weights = _weights_of(model_weights, config["name"])
+                layers.append(_dense(weights["kernel:0"], weights.get("bias:0"), _activation(config["activation"])))
+            elif class_name == "Activation":
+                layers.append(_activation(config["activation"]))
+            elif class_name == "LeakyReLU":
+                layers.append(_leaky_relu(config.get("alpha", 0.3)))
+            elif class_name == "ReLU" and not config.get("max_value") and not config.get("threshold") \
+                    and not config.get("negative_slope"):
+                layers.append(_relu)
+            elif class_name == "Flatten":
+                layers.append(lambda x: x.reshape(x.shape[0], -1))
+            elif class_name in ("InputLayer", "Dropout"):
+                # Dropout is the identity at inference time
+                continue
+            else:
+                raise ValueError("Unsupported layer '{}' in {}".format(class_name, model_file))
+    return DenseNetwork(layers, input_size)
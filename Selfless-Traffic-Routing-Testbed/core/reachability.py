@@ -0,0 +1,165 @@
+"""
+    This file contains a precomputed reachability index of the edge graph.
+
+    The strongly connected components (SCC) of the turn graph over passenger edges are
+    computed once with Tarjan's algorithm. Every edge of a component can reach every
+    other edge of it, so reachability between two edges reduces to reachability between
+    their components in the condensation DAG, whose transitive closure is stored as one
+    bitset (a Python int) per component. A query is then a dictionary lookup and a bit
+    test instead of a shortest-path search.
+"""
+
+
+class ReachabilityIndex:
+    """
+    :param outgoing_edges_dict: {edge_id: {direction: out_edge}}
+    :param edge_ids: the edges to index, e.g. ConnectionInfo.edge_list (passenger edges);
+                     turns leading to edges outside this list are ignored
+    """
+    def __init__(self, outgoing_edges_dict, edge_ids):
+        self.edge_ids = list(edge_ids)
+        indexed = set(self.edge_ids)
+        self.successors = {edge: [out_edge for out_edge in outgoing_edges_dict.get(edge, {}).values()
+                                  if out_edge in indexed]
+                           for edge in self.edge_ids}
+
+        self.component_of = {}
+        self.components = []
+        self.__destination_counts__ = {}
+        self.__source_counts__ = {}
+        self.__find_components__()
+
+        # condensation DAG, and its transitive closure in both directions
+        num_components = len(self.components)
+        self.reaches = [0] * num_components
+        self.reached_by = [0] * num_components
+        # Tarjan completes a component after every component reachable from it
+        for component, edges in enumerate(self.components):
+            closure = 1 << component
+            for edge in edges:
+                for out_edge in self.successors[edge]:
+                    closure |= self.reaches[self.component_of[out_edge]]
+            self.reaches[component] = closure
+        for component in range(num_components):
+            closure = self.reaches[component]
+            while closure:
+                lowest = closure & -closure
+                self.reached_by[lowest.bit_length() - 1] |= 1 << component
+                closure ^= lowest
+
+    def __find_components__(self):
+        """
+        Iterative version of Tarjan's algorithm, fills component_of and components.
+        """
+        index_of = {}
+        low_link = {}
+        stack = []
+        on_stack = set()
+        next_index = 0
+
+        for root in self.edge_ids:
+            if root in index_of:
+                continue
+            index_of[root] = low_link[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.successors[root]))]
+            while work:
+                edge, successors = work[-1]
+                advanced = False
+                for out_edge in successors:
+                    if out_edge not in index_of:
+                        index_of[out_edge] = low_link[out_edge] = next_index
+                        next_index += 1
+                        stack.append(out_edge)
+                        on_stack.add(out_edge)
+                        work.append((out_edge, iter(self.successors[out_edge])))
+                        advanced = True
+                        break
+                    if out_edge in on_stack:
+                        low_link[edge] = min(low_link[edge], index_of[out_edge])
+                if advanced:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[edge])
+                if low_link[edge] == index_of[edge]:
+                    component = len(self.components)
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        self.component_of[member] = component
+                        members.append(member)
+                        if member == edge:
+                            break
+                    self.components.append(members)
+
+    def is_reachable(self, start_edge, destination):
+        """
+        :param start_edge: edge id
+        :param destination: edge id
+        :return: True if a path of indexed edges leads from start_edge to destination
+        """
+        start_component = self.component_of.get(start_edge)
+        destination_component = self.component_of.get(destination)
+        if start_component is None or destination_component is None:
+            return False
+        return (self.reaches[start_component] >> destination_component) & 1 == 1
+
+    def __members__(self, components):
+        edges = []
+        while components:
+            lowest = components & -components
+            edges.extend(self.components[lowest.bit_length() - 1])
+            components ^= lowest
+        return edges
+
+    def reachable_destinations(self, start_edge):
+        """
+        :return: list of the edges reachable from start_edge (start_edge included)
+        """
+        if start_edge not in self.component_of:
+            return []
+        return self.__members__(self.reaches[self.component_of[start_edge]])
+
+    def reachable_sources(self, destination):
+        """
+        :return: list of the edges from which destination can be reached (destination included)
+        """
+        if destination not in self.component_of:
+            return []
+        return self.__members__(self.reached_by[self.component_of[destination]])
+
+    def num_reachable_destinations(self, start_edge):
+        """
+        :return: the number of edges reachable from start_edge
+        """
+        if start_edge not in self.component_of:
+            return 0
+        component = self.component_of[start_edge]
+        if component not in self.__destination_counts__:
+            self.__destination_counts__[component] = self.__count_members__(self.reaches[component])
+        return self.__destination_counts__[component]
+
+    def num_reachable_sources(self, destination):
+        """
+        :return: the number of edges from which destination can be reached
+        """
+        if destination not in self.component_of:
+            return 0
+        component = self.component_of[destination]
+        if component not in self.__source_counts__:
+            self.__source_counts__[component] = self.__count_members__(self.reached_by[component])
+        return self.__source_counts__[component]
+
+    def __count_members__(self, components):
+        count = 0
+        while components:
+            lowest = components & -components
+            count += len(self.components[lowest.bit_length() - 1])
+            components ^= lowest
+        return count
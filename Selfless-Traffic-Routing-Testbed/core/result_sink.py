@@ -0,0 +1,203 @@
+"""
+    This file contains the result and diagnostics sink of the simulation loop.
+
+    TripRecords collects one record per controlled vehicle that left the simulation
+    into preallocated NumPy columns (see TRIP_COLUMNS), instead of printing a line per
+    vehicle. The records are returned by StrSumo.run(return_records=True) and written
+    as CSV, or as a columnar .npz archive, at the end of the run; given a filename and
+    a chunk size they are also flushed to CSV in chunks during the run.
+
+    The diagnostics of the loop and of the routing policies (arrival lines, decisions,
+    warnings) go through the `logger` of this module, whose level selects what is
+    shown: DEBUG for every decision, INFO for every arrival, WARNING (the default)
+    for problems only. A RateLimitFilter caps how many messages of each kind are let
+    through per second, so a burst of identical warnings costs little terminal I/O.
+"""
+
+import csv
+import logging
+import sys
+import time
+
+import numpy as np
+
+# every diagnostic of the simulation loop and of the routing policies goes through this logger
+logger = logging.getLogger("str_sumo")
+
+# [(column name, dtype)] of the trip records
+TRIP_COLUMNS = [
+    ("vehicle_id", object),
+    ("start_time", np.float64),
+    ("arrival_time", np.float64),
+    ("timespan", np.float64),
+    ("deadline", np.float64),
+    ("reached_destination", bool),
+    ("deadline_missed", bool),
+]
+
+DEFAULT_MAX_PER_INTERVAL = 20
+DEFAULT_INTERVAL = 1.0
+
+
+class TripRecords:
+    """
+    :param capacity: number of records preallocated, e.g. the number of controlled vehicles; the
+                     columns double in size when full
+    :param filename: CSV file the records are flushed to, or None to keep them in memory only
+    :param chunk_size: when filename is given, flush every chunk_size records, dropping them from the
+                       columns; None flushes only when flush() is called
+    Available collections:
+        - columns: {column name: NumPy array of capacity entries}, the first len(self) are filled
+    """
+    def __init__(self, capacity=1024, filename=None, chunk_size=None):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.columns = {name: np.empty(max(capacity, 1), dtype=dtype) for name, dtype in TRIP_COLUMNS}
+        self.size = 0
+        self.flushed = 0
+        self.__header_written__ = False
+
+    def __len__(self):
+        return self.size
+
+    def append(self, vehicle_id, start_time, arrival_time, deadline, reached_destination):
+        """
+        Record a controlled vehicle that left the simulation.
+
+        :param vehicle_id: id of the vehicle
+        :param start_time: step at which the vehicle departed
+        :param arrival_time: step at which the vehicle left the simulation
+        :param deadline: deadline of the vehicle
+        :param reached_destination: whether its last local target was its destination
+        """
+        if self.size == len(self.columns["vehicle_id"]):
+            self.__grow__()
+        index = self.size
+        columns = self.columns
+        columns["vehicle_id"][index] = vehicle_id
+        columns["start_time"][index] = start_time
+        columns["arrival_time"][index] = arrival_time
+        columns["timespan"][index] = arrival_time - start_time
+        columns["deadline"][index] = deadline
+        columns["reached_destination"][index] = reached_destination
+        columns["deadline_missed"][index] = arrival_time > deadline
+        self.size += 1
+        if self.filename is not None and self.chunk_size is not None and self.size >= self.chunk_size:
+            self.flush()
+
+    def column(self, name):
+        """
+        :param name: one of the names of TRIP_COLUMNS
+        :return: view of the filled part of the column
+        """
+        return self.columns[name][:self.size]
+
+    def as_dict(self):
+        """
+        :return: {column name: filled part of the column}, in the order of TRIP_COLUMNS
+        """
+        return {name: self.column(name) for name, _ in TRIP_COLUMNS}
+
+    def rows(self):
+        """
+        :return: list of [value of each column] of the records held in memory
+        """
+        return [list(row) for row in zip(*(self.column(name).tolist() for name, _ in TRIP_COLUMNS))]
+
+    def flush(self):
+        """
+        Append the records held in memory to filename, if any, and drop them from the columns.
+        """
+        if self.filename is None or self.size == 0:
+            return
+        with open(self.filename, 'a' if self.__header_written__ else 'w', newline='') as f:
+            writer = csv.writer(f)
+            if not self.__header_written__:
+                writer.writerow([name for name, _ in TRIP_COLUMNS])
+                self.__header_written__ = True
+            writer.writerows(self.rows())
+        self.flushed += self.size
+        self.size = 0
+
+    def save(self, filename):
+        """
+        Write the records held in memory, as a columnar NumPy archive (one array per column) if
+        filename ends with .npz, as CSV otherwise.
+        """
+        if filename.endswith(".npz"):
+            arrays = self.as_dict()
+            arrays["vehicle_id"] = np.array(arrays["vehicle_id"].tolist(), dtype=str)
+            np.savez(filename, **arrays)
+            return
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([name for name, _ in TRIP_COLUMNS])
+            writer.writerows(self.rows())
+
+    def __grow__(self):
+        for name, array in self.columns.items():
+            grown = np.empty(2 * len(array), dtype=array.dtype)
+            grown[:len(array)] = array
+            self.columns[name] = grown
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let at most max_per_interval messages of each kind (same level and format string) through
+    per interval seconds. The first message let through after some were dropped tells how many.
+
+    :param max_per_interval: messages of a kind shown per interval, None for no limit
+    :param interval: length of the interval in seconds
+    """
+    def __init__(self, max_per_interval=DEFAULT_MAX_PER_INTERVAL, interval=DEFAULT_INTERVAL):
+        super().__init__()
+        self.max_per_interval = max_per_interval
+        self.interval = interval
+        # {(level, format string): [start of the interval, messages shown, messages dropped]}
+        self.counters = {}
+
+    def filter(self, record):
+        if self.max_per_interval is None:
+            return True
+        key = (record.levelno, record.msg)
+        now = time.monotonic()
+        counter = self.counters.get(key)
+        if counter is None or now - counter[0] >= self.interval:
+            dropped = counter[2] if counter is not None else 0
+            self.counters[key] = [now, 1, 0]
+            if dropped:
+                record.msg = "{} [{} similar messages suppressed]".format(record.msg, dropped)
+            return True
+        if counter[1] < self.max_per_interval:
+            counter[1] += 1
+            return True
+        counter[2] += 1
+        return False
+
+
+rate_limit_filter = RateLimitFilter()
+logger.addFilter(rate_limit_filter)
+
+
+def configure_diagnostics(level=logging.WARNING, max_per_interval=DEFAULT_MAX_PER_INTERVAL,
+                          interval=DEFAULT_INTERVAL, stream=None):
+    """
+    Select the diagnostics shown and print them, message only, to stream.
+
+    :param level: logging level (or its name, e.g. "info") of the least important message shown
+    :param max_per_interval: messages of a kind shown per interval, None for no limit
+    :param interval: length of the rate limiting interval in seconds
+    :param stream: where the messages are printed, sys.stdout by default
+    """
+    if isinstance(level, str):
+        level = getattr(logging, level.upper())
+    logger.setLevel(level)
+    rate_limit_filter.max_per_interval = max_per_interval
+    rate_limit_filter.interval = interval
+    rate_limit_filter.counters = {}
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
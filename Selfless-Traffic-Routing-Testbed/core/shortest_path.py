@@ -0,0 +1,547 @@
+"""
+    This file contains the shortest-path engine shared by the routing policies.
+
+    The network is searched as an edge graph: a vertex is an edge id and an arc is
+    a turn {direction: out_edge} taken from ConnectionInfo.outgoing_edges_dict.
+    The cost of a path is the sum of the weights of every edge on it, including
+    the edge the vehicle currently occupies, which is how DijkstraPolicy has always
+    measured distances.
+"""
+
+import heapq
+import math
+from collections import OrderedDict
+
+# distance given to edges that have not been reached by a search
+INFINITY = 1000000000
+
+
+def dijkstra(outgoing_edges_dict, edge_weights, start_edge, destination=None, edge_order=None):
+    """
+    Heap based Dijkstra search over the edge graph.
+
+    Vertices are popped in order of (distance, edge_order[edge]) so that ties are
+    broken the same way the original linear scan over edge_list did. The search
+    stops as soon as destination is settled; pass destination=None to build the
+    full shortest path tree from start_edge.
+
+    :param outgoing_edges_dict: {edge_id: {direction: out_edge}}
+    :param edge_weights: {edge_id: weight}, e.g. ConnectionInfo.edge_length_dict
+    :param start_edge: edge id the search starts from
+    :param destination: edge id at which the search may stop early, or None
+    :param edge_order: {edge_id: int} used to break ties, e.g. ConnectionInfo.edge_index_dict
+    :return: (distances, predecessors) where distances {edge_id: distance} holds the
+             settled edges and predecessors {edge_id: (previous_edge, direction)}
+    """
+    if edge_order is None:
+        edge_order = {}
+    distances = {}
+    tentative = {start_edge: edge_weights[start_edge]}
+    predecessors = {}
+    heap = [(edge_weights[start_edge], edge_order.get(start_edge, 0), start_edge)]
+
+    while heap:
+        current_distance, _, current_edge = heapq.heappop(heap)
+        # skip stale heap entries
+        if current_edge in distances:
+            continue
+        distances[current_edge] = current_distance
+        if current_edge == destination:
+            break
+
+        for direction, outgoing_edge in outgoing_edges_dict.get(current_edge, {}).items():
+            if outgoing_edge in distances:
+                continue
+            new_distance = current_distance + edge_weights[outgoing_edge]
+            if new_distance < tentative.get(outgoing_edge, INFINITY):
+                tentative[outgoing_edge] = new_distance
+                predecessors[outgoing_edge] = (current_edge, direction)
+                heapq.heappush(heap, (new_distance, edge_order.get(outgoing_edge, 0), outgoing_edge))
+
+    return distances, predecessors
+
+
+def reconstruct_directions(predecessors, start_edge, destination):
+    """
+    Walk the predecessor pointers back from destination to start_edge.
+
+    :return: list of directions leading from start_edge to destination, or an empty
+             list if destination was not reached
+    """
+    directions = []
+    current_edge = destination
+    while current_edge != start_edge:
+        if current_edge not in predecessors:
+            return []
+        current_edge, direction = predecessors[current_edge]
+        directions.append(direction)
+    directions.reverse()
+    return directions
+
+
+def reconstruct_edges(predecessors, start_edge, destination):
+    """
+    Walk the predecessor pointers back from destination to start_edge.
+
+    :return: list of edge ids from start_edge to destination (both included), or an
+             empty list if destination was not reached
+    """
+    edges = [destination]
+    current_edge = destination
+    while current_edge != start_edge:
+        if current_edge not in predecessors:
+            return []
+        current_edge = predecessors[current_edge][0]
+        edges.append(current_edge)
+    edges.reverse()
+    return edges
+
+
+def shortest_path_directions(connection_info, start_edge, destination, edge_weights=None):
+    """
+    Compute the decision list of the shortest path between two edges.
+
+    :param connection_info: object containing network information
+    :param start_edge: edge id the vehicle is currently on
+    :param destination: edge id the vehicle is heading to
+    :param edge_weights: {edge_id: weight}; defaults to connection_info.edge_length_dict
+    :return: list of directions from start_edge to destination ([] if unreachable)
+    """
+    if edge_weights is None:
+        edge_weights = connection_info.edge_length_dict
+    distances, predecessors = dijkstra(connection_info.outgoing_edges_dict, edge_weights,
+                                       start_edge, destination, connection_info.edge_index_dict)
+    return reconstruct_directions(predecessors, start_edge, destination)
+
+
+def astar(outgoing_edges_dict, edge_weights, start_edge, destination, heuristic, edge_order=None):
+    """
+    A* search over the edge graph.
+
+    heuristic(edge) must be a consistent lower bound of the weight still to drive after
+    edge to reach destination (see StraightLineHeuristic). The search does not stop at
+    the first pop of destination: it keeps expanding every edge whose estimate does not
+    exceed the distance of destination, and on equal distances keeps the predecessor
+    that dijkstra() would have settled first, i.e. the smallest (distance, edge_order).
+    The resulting path is therefore the one dijkstra() returns, not just one of equal cost.
+
+    :param outgoing_edges_dict: {edge_id: {direction: out_edge}}
+    :param edge_weights: {edge_id: weight}
+    :param start_edge: edge id the search starts from
+    :param destination: edge id to reach
+    :param heuristic: function edge_id -> lower bound of the remaining weight
+    :param edge_order: {edge_id: int} used to break ties, e.g. ConnectionInfo.edge_index_dict
+    :return: (distances, predecessors) as dijkstra(); distances holds the expanded edges
+    """
+    if edge_order is None:
+        edge_order = {}
+    distances = {}
+    tentative = {start_edge: edge_weights[start_edge]}
+    predecessors = {}
+    heap = [(edge_weights[start_edge] + heuristic(start_edge), edge_weights[start_edge],
+             edge_order.get(start_edge, 0), start_edge)]
+    destination_distance = INFINITY
+
+    while heap:
+        estimate, current_distance, _, current_edge = heapq.heappop(heap)
+        if estimate > destination_distance:
+            break
+        # skip stale heap entries
+        if current_distance > tentative[current_edge] or current_edge in distances:
+            continue
+        distances[current_edge] = current_distance
+        if current_edge == destination:
+            destination_distance = current_distance
+            continue
+
+        current_key = (current_distance, edge_order.get(current_edge, 0))
+        for direction, outgoing_edge in outgoing_edges_dict.get(current_edge, {}).items():
+            new_distance = current_distance + edge_weights[outgoing_edge]
+            old_distance = tentative.get(outgoing_edge, INFINITY)
+            # an edge may be expanded before an equally short predecessor, which can still win the tie
+            if outgoing_edge in distances and new_distance != old_distance:
+                continue
+            if new_distance < old_distance:
+                tentative[outgoing_edge] = new_distance
+                predecessors[outgoing_edge] = (current_edge, direction)
+                heapq.heappush(heap, (new_distance + heuristic(outgoing_edge), new_distance,
+                                      edge_order.get(outgoing_edge, 0), outgoing_edge))
+            elif new_distance == old_distance and outgoing_edge in predecessors:
+                previous_edge = predecessors[outgoing_edge][0]
+                if current_key < (distances[previous_edge], edge_order.get(previous_edge, 0)):
+                    predecessors[outgoing_edge] = (current_edge, direction)
+
+    return distances, predecessors
+
+
+def travel_time_weights(connection_info):
+    """
+    :param connection_info: object containing network information
+    :return: {edge_id: free flow travel time}, i.e. length / speed limit
+    """
+    return {edge: length / connection_info.edge_speed_dict[edge]
+            for edge, length in connection_info.edge_length_dict.items()}
+
+
+class StraightLineHeuristic:
+    """
+    Admissible A* heuristic from the straight-line distance between junctions.
+
+    A vehicle on edge e still has to drive from the end junction of e to the end
+    junction of the destination. SUMO edge lengths may be slightly shorter than the
+    distance between their junctions, so the distance is scaled by
+    alpha = min(length / straight-line distance) over the edges; with travel time
+    weights it is further divided by the highest speed limit of the map. Both keep the
+    bound consistent, since no edge can beat the straight line at that rate.
+
+    :param connection_info: object containing network information
+    :param travel_time: set to True when the edge weights are travel_time_weights()
+    """
+    # keeps the estimates below the true distances despite floating point rounding
+    SAFETY_FACTOR = 1.0 - 1e-9
+
+    def __init__(self, connection_info, travel_time=False):
+        self.end_coordinates = {edge: endpoints[1] for edge, endpoints in connection_info.edge_endpoints_dict.items()}
+        ratios = []
+        for edge in connection_info.edge_list:
+            (from_x, from_y), (to_x, to_y) = connection_info.edge_endpoints_dict[edge]
+            distance = math.hypot(to_x - from_x, to_y - from_y)
+            if distance > 0:
+                ratios.append(connection_info.edge_length_dict[edge] / distance)
+        self.scale = min(ratios) * self.SAFETY_FACTOR if ratios else 0.0
+        if travel_time and connection_info.edge_list:
+            self.scale /= max(connection_info.edge_speed_dict[edge] for edge in connection_info.edge_list)
+
+    def towards(self, destination):
+        """
+        :param destination: edge id
+        :return: function edge_id -> lower bound of the weight left to reach destination
+        """
+        destination_x, destination_y = self.end_coordinates[destination]
+        end_coordinates = self.end_coordinates
+        scale = self.scale
+
+        def heuristic(edge):
+            x, y = end_coordinates[edge]
+            return scale * math.hypot(x - destination_x, y - destination_y)
+        return heuristic
+
+
+def astar_directions(connection_info, start_edge, destination, heuristic, edge_weights=None):
+    """
+    Compute the decision list of the shortest path between two edges with A*.
+
+    :param connection_info: object containing network information
+    :param start_edge: edge id the vehicle is currently on
+    :param destination: edge id the vehicle is heading to
+    :param heuristic: StraightLineHeuristic built for edge_weights
+    :param edge_weights: {edge_id: weight}; defaults to connection_info.edge_length_dict
+    :return: list of directions from start_edge to destination ([] if unreachable)
+    """
+    if edge_weights is None:
+        edge_weights = connection_info.edge_length_dict
+    distances, predecessors = astar(connection_info.outgoing_edges_dict, edge_weights, start_edge, destination,
+                                    heuristic.towards(destination), connection_info.edge_index_dict)
+    return reconstruct_directions(predecessors, start_edge, destination)
+
+
+def build_incoming_edges_dict(outgoing_edges_dict):
+    """
+    Reverse the turn graph.
+
+    :param outgoing_edges_dict: {edge_id: {direction: out_edge}}
+    :return: {edge_id: [(in_edge, direction)]} where in_edge --direction--> edge_id
+    """
+    incoming_edges_dict = {edge: [] for edge in outgoing_edges_dict}
+    for edge, outgoing in outgoing_edges_dict.items():
+        for direction, out_edge in outgoing.items():
+            incoming_edges_dict.setdefault(out_edge, []).append((edge, direction))
+    return incoming_edges_dict
+
+
+def reverse_dijkstra(incoming_edges_dict, edge_weights, destination, edge_order=None):
+    """
+    Build the shortest path tree of every edge towards one destination.
+
+    The distance of an edge is the weight of the edges that still have to be driven
+    after it, destination included, so the forward cost of a vehicle on edge e is
+    edge_weights[e] + distances[e].
+
+    :param incoming_edges_dict: {edge_id: [(in_edge, direction)]}, see build_incoming_edges_dict
+    :param edge_weights: {edge_id: weight}
+    :param destination: edge id the tree is rooted at
+    :param edge_order: {edge_id: int} used to break ties
+    :return: (distances, next_hops) where next_hops {edge_id: (direction, next_edge)}
+    """
+    if edge_order is None:
+        edge_order = {}
+    distances = {}
+    tentative = {destination: 0.0}
+    next_hops = {}
+    heap = [(0.0, edge_order.get(destination, 0), destination)]
+
+    while heap:
+        current_distance, _, current_edge = heapq.heappop(heap)
+        if current_edge in distances:
+            continue
+        distances[current_edge] = current_distance
+
+        # entering current_edge costs its own weight
+        new_distance = current_distance + edge_weights[current_edge]
+        for in_edge, direction in incoming_edges_dict.get(current_edge, ()):
+            if in_edge in distances:
+                continue
+            if new_distance < tentative.get(in_edge, INFINITY):
+                tentative[in_edge] = new_distance
+                next_hops[in_edge] = (direction, current_edge)
+                heapq.heappush(heap, (new_distance, edge_order.get(in_edge, 0), in_edge))
+
+    return distances, next_hops
+
+
+class ShortestPathTree:
+    """
+    Shortest path tree of all edges towards a single destination edge.
+    One tree answers the decision list of every vehicle heading to that destination.
+
+    When some edge weights change the tree can be repaired in place (see repair())
+    instead of being rebuilt: only the edges whose path to the destination is affected
+    are searched again.
+    """
+    def __init__(self, destination, distances, next_hops):
+        self.destination = destination
+        self.distances = distances
+        self.next_hops = next_hops
+        # {edge_id: weight the tree was computed with} of the edges changed since then
+        self.pending_weights = {}
+        # {edge_id: set of edges whose next hop is edge_id}, built by the first repair
+        self.__children__ = None
+
+    def directions_from(self, start_edge):
+        """
+        :param start_edge: edge id the vehicle is currently on
+        :return: list of directions from start_edge to the destination ([] if unreachable)
+        """
+        directions = []
+        current_edge = start_edge
+        while current_edge != self.destination:
+            if current_edge not in self.next_hops:
+                return []
+            direction, current_edge = self.next_hops[current_edge]
+            directions.append(direction)
+        return directions
+
+    def repair(self, outgoing_edges_dict, incoming_edges_dict, edge_weights, edge_order=None):
+        """
+        Bring the tree up to date with edge_weights after the changes recorded in pending_weights.
+
+        Dynamic shortest paths in the style of Ramalingam and Reps:
+            1. the edges whose tree path enters an edge that got more expensive (the
+               subtrees hanging below it) lose their distance,
+            2. each of them gets the best distance offered by its unaffected turns,
+            3. the edges entering an edge that got cheaper are relaxed,
+            4. a Dijkstra search seeded with the edges of steps 2 and 3 propagates the
+               new distances, and stops where they no longer improve,
+            5. the next hops are re-chosen only where a candidate changed.
+        The distances and next hops (ties included) are the ones reverse_dijkstra would build
+        from scratch with edge_weights.
+
+        :param outgoing_edges_dict: {edge_id: {direction: out_edge}}
+        :param incoming_edges_dict: {edge_id: [(in_edge, direction)]}, see build_incoming_edges_dict
+        :param edge_weights: {edge_id: weight}, the current weights
+        :param edge_order: {edge_id: int} used to break ties, the one the tree was built with
+        :return: number of edges whose distance was searched again
+        """
+        if edge_order is None:
+            edge_order = {}
+        changed_weights = {edge: old_weight for edge, old_weight in self.pending_weights.items()
+                           if edge_weights[edge] != old_weight}
+        self.pending_weights = {}
+        if not changed_weights:
+            return 0
+        if self.__children__ is None:
+            self.__children__ = {}
+            for edge, (direction, next_edge) in self.next_hops.items():
+                self.__children__.setdefault(next_edge, set()).add(edge)
+        distances = self.distances
+        children = self.__children__
+        destination = self.destination
+
+        # 1. edges whose path to the destination goes through an edge that got more expensive
+        affected = set()
+        stack = []
+        for edge, old_weight in changed_weights.items():
+            if edge_weights[edge] > old_weight:
+                stack.extend(children.get(edge, ()))
+        while stack:
+            edge = stack.pop()
+            if edge not in affected:
+                affected.add(edge)
+                stack.extend(children.get(edge, ()))
+        for edge in affected:
+            distances.pop(edge, None)
+
+        tentative = {}
+        heap = []
+        # 2. best distance of the affected edges through the unaffected ones
+        for edge in affected:
+            best = INFINITY
+            for direction, out_edge in outgoing_edges_dict.get(edge, {}).items():
+                if out_edge in distances:
+                    new_distance = distances[out_edge] + edge_weights[out_edge]
+                    if new_distance < best:
+                        best = new_distance
+            if best < INFINITY:
+                tentative[edge] = best
+                heapq.heappush(heap, (best, edge_order.get(edge, 0), edge))
+
+        # 3. edges entering an edge that got cheaper
+        for edge, old_weight in changed_weights.items():
+            if edge_weights[edge] < old_weight and edge in distances:
+                new_distance = distances[edge] + edge_weights[edge]
+                for in_edge, direction in incoming_edges_dict.get(edge, ()):
+                    if in_edge != destination and \
+                            new_distance < tentative.get(in_edge, distances.get(in_edge, INFINITY)):
+                        tentative[in_edge] = new_distance
+                        heapq.heappush(heap, (new_distance, edge_order.get(in_edge, 0), in_edge))
+
+        # 4. propagate the new distances
+        searched = set()
+        while heap:
+            current_distance, _, current_edge = heapq.heappop(heap)
+            # skip stale heap entries
+            if tentative.get(current_edge) != current_distance:
+                continue
+            del tentative[current_edge]
+            distances[current_edge] = current_distance
+            searched.add(current_edge)
+
+            new_distance = current_distance + edge_weights[current_edge]
+            for in_edge, direction in incoming_edges_dict.get(current_edge, ()):
+                if in_edge != destination and \
+                        new_distance < tentative.get(in_edge, distances.get(in_edge, INFINITY)):
+                    tentative[in_edge] = new_distance
+                    heapq.heappush(heap, (new_distance, edge_order.get(in_edge, 0), in_edge))
+
+        # 5. next hops of the edges that have a changed candidate
+        to_update = affected | searched
+        for edge in searched.union(changed_weights):
+            to_update.update(in_edge for in_edge, direction in incoming_edges_dict.get(edge, ()))
+        to_update.discard(destination)
+        for edge in to_update:
+            self.__update_next_hop__(edge, outgoing_edges_dict, edge_weights, edge_order)
+        return len(affected | searched)
+
+    def __update_next_hop__(self, edge, outgoing_edges_dict, edge_weights, edge_order):
+        # reverse_dijkstra keeps the first turn settled among the cheapest ones, i.e. the
+        # smallest (distance through the turn, distance of the turn, order, edge id)
+        distances = self.distances
+        best_key = None
+        best_hop = None
+        for direction, out_edge in outgoing_edges_dict.get(edge, {}).items():
+            if out_edge in distances:
+                key = (distances[out_edge] + edge_weights[out_edge], distances[out_edge],
+                       edge_order.get(out_edge, 0), out_edge)
+                if best_key is None or key < best_key:
+                    best_key = key
+                    best_hop = (direction, out_edge)
+
+        old_hop = self.next_hops.get(edge)
+        if old_hop == best_hop:
+            return
+        if old_hop is not None:
+            self.__children__[old_hop[1]].discard(edge)
+        if best_hop is None:
+            del self.next_hops[edge]
+        else:
+            self.next_hops[edge] = best_hop
+            self.__children__.setdefault(best_hop[1], set()).add(edge)
+
+
+class ShortestPathTreeCache:
+    """
+    LRU cache of reverse shortest path trees keyed by destination edge.
+
+    Vehicles sharing a destination share one reverse search, so the routing cost of a
+    step grows with the number of distinct destinations instead of the number of
+    vehicles. When edge weights change the cached trees are repaired on their next use
+    (see ShortestPathTree.repair), or dropped if too many edges changed since.
+
+    :param connection_info: object containing network information
+    :param capacity: maximum number of destinations kept in the cache
+    :param edge_weights: {edge_id: weight}; defaults to connection_info.edge_length_dict
+    :param repair_trees: set to False to drop every cached tree as soon as an edge weight changes
+    """
+    # a tree with more changed edges than this fraction of the map is rebuilt instead of repaired
+    MAX_REPAIR_FRACTION = 0.25
+
+    def __init__(self, connection_info, capacity=128, edge_weights=None, repair_trees=True):
+        self.connection_info = connection_info
+        self.capacity = capacity
+        self.repair_trees = repair_trees
+        if edge_weights is None:
+            edge_weights = connection_info.edge_length_dict
+        self.edge_weights = dict(edge_weights)
+        self.incoming_edges_dict = build_incoming_edges_dict(connection_info.outgoing_edges_dict)
+        self.max_pending_weights = int(self.MAX_REPAIR_FRACTION * len(self.edge_weights))
+        self.trees = OrderedDict()
+
+    def get_tree(self, destination):
+        """
+        :param destination: edge id
+        :return: the ShortestPathTree rooted at destination, built on a cache miss
+        """
+        tree = self.trees.get(destination)
+        if tree is not None:
+            self.trees.move_to_end(destination)
+            if tree.pending_weights:
+                tree.repair(self.connection_info.outgoing_edges_dict, self.incoming_edges_dict, self.edge_weights,
+                            self.connection_info.edge_index_dict)
+            return tree
+
+        distances, next_hops = reverse_dijkstra(self.incoming_edges_dict, self.edge_weights,
+                                                destination, self.connection_info.edge_index_dict)
+        tree = ShortestPathTree(destination, distances, next_hops)
+        self.trees[destination] = tree
+        if len(self.trees) > self.capacity:
+            self.trees.popitem(last=False)
+        return tree
+
+    def directions(self, start_edge, destination):
+        """
+        :return: list of directions from start_edge to destination ([] if unreachable)
+        """
+        return self.get_tree(destination).directions_from(start_edge)
+
+    def update_edge_weights(self, edge_weights):
+        """
+        Apply new edge weights; the cached trees are repaired on their next use.
+
+        :param edge_weights: {edge_id: weight}, may contain only the edges that changed
+        :return: True if any weight changed
+        """
+        old_weights = {}
+        for edge, weight in edge_weights.items():
+            old_weight = self.edge_weights.get(edge)
+            if old_weight != weight:
+                self.edge_weights[edge] = weight
+                old_weights[edge] = old_weight
+        if not old_weights:
+            return False
+        if not self.repair_trees:
+            self.invalidate()
+            return True
+        for destination in list(self.trees):
+            tree = self.trees[destination]
+            for edge, old_weight in old_weights.items():
+                if old_weight is not None:
+                    tree.pending_weights.setdefault(edge, old_weight)
+            if len(tree.pending_weights) > self.max_pending_weights:
+                del self.trees[destination]
+        return True
+
+    def invalidate(self):
+        """
+        Drop every cached tree.
+        """
+        self.trees.clear()
@@ -0,0 +1,164 @@
+"""
+    This file contains the per-step profiler of StrSumo.run.
+
+    Every simulation step is split into phases, timed with a monotonic clock
+    (time.perf_counter):
+        - edge_counts:      reading the edge subscriptions (get_edge_vehicle_counts)
+        - vehicle_updates:  departed/arrived vehicles and the position of the controlled ones
+        - decisions:        route_controller.make_decisions
+        - change_target:    sending the local targets to SUMO
+        - arrivals:         accounting of the vehicles that reached their destination
+        - simulation_step:  traci.simulationStep
+    Optionally the TraCI calls made in each phase are counted as well, through the
+    call counter of sumo_backend. The size of the decision batch is recorded per step.
+
+    The profiler is off unless a StepProfiler is passed to StrSumo, in which case the
+    loop only pays one clock read per phase.
+"""
+
+import csv
+import time
+
+import numpy as np
+
+from core import sumo_backend
+
+EDGE_COUNTS = 0
+VEHICLE_UPDATES = 1
+DECISIONS = 2
+CHANGE_TARGET = 3
+ARRIVALS = 4
+SIMULATION_STEP = 5
+PHASES = ["edge_counts", "vehicle_updates", "decisions", "change_target", "arrivals", "simulation_step"]
+
+PERCENTILES = [50, 95, 99]
+
+
+class StepProfiler:
+    """
+    :param count_traci_calls: also count the TraCI calls made in each phase
+    Available collections (after a run):
+        - rows: one list per step [step, batch_size, seconds of each phase..., TraCI calls of each phase...]
+    """
+    def __init__(self, count_traci_calls=True):
+        self.count_traci_calls = count_traci_calls
+        self.call_counter = sumo_backend.CallCounter() if count_traci_calls else None
+        self.rows = []
+        self.__row__ = None
+        self.__last_time__ = 0.0
+        self.__last_calls__ = 0
+
+    def start(self):
+        """
+        Called by StrSumo.run before the first step.
+        """
+        self.rows = []
+        if self.call_counter is not None:
+            sumo_backend.count_calls(self.call_counter)
+
+    def stop(self):
+        """
+        Called by StrSumo.run once the simulation is over.
+        """
+        if self.call_counter is not None:
+            sumo_backend.count_calls(None)
+
+    def begin_step(self, step):
+        self.__row__ = [step, 0] + [0.0] * len(PHASES) + [0] * len(PHASES)
+        if self.call_counter is not None:
+            self.__last_calls__ = self.call_counter.calls
+        self.__last_time__ = time.perf_counter()
+
+    def end_phase(self, phase):
+        """
+        Charge the time (and TraCI calls) since the previous phase ended to phase.
+
+        :param phase: one of the phase constants, e.g. DECISIONS
+        """
+        now = time.perf_counter()
+        row = self.__row__
+        row[2 + phase] += now - self.__last_time__
+        self.__last_time__ = now
+        if self.call_counter is not None:
+            calls = self.call_counter.calls
+            row[2 + len(PHASES) + phase] += calls - self.__last_calls__
+            self.__last_calls__ = calls
+
+    def end_step(self, batch_size):
+        """
+        :param batch_size: number of vehicles passed to make_decisions during the step
+        """
+        self.__row__[1] = batch_size
+        self.rows.append(self.__row__)
+        self.__row__ = None
+
+    def as_array(self):
+        """
+        :return: float64 [steps, 2 + 2 * len(PHASES)], the columns of rows
+        """
+        return np.array(self.rows, dtype=np.float64).reshape(len(self.rows), 2 + 2 * len(PHASES))
+
+    def columns(self):
+        """
+        :return: names of the columns of rows
+        """
+        return ["step", "batch_size"] + [phase + "_s" for phase in PHASES] + [phase + "_calls" for phase in PHASES]
+
+    def summary(self):
+        """
+        :return: {"steps": int, "total_s": float, "batch_size": {...}, "phases": {phase: {...}}}, where each
+                 phase holds its total seconds, the p50/p95/p99 of its per-step time in milliseconds and its
+                 number of TraCI calls (None when not counted)
+        """
+        array = self.as_array()
+        times = array[:, 2:2 + len(PHASES)]
+        calls = array[:, 2 + len(PHASES):]
+        phases = {}
+        for index, phase in enumerate(PHASES):
+            phase_summary = {"total_s": float(times[:, index].sum())}
+            for percentile in PERCENTILES:
+                phase_summary["p{}_ms".format(percentile)] = \
+                    float(np.percentile(times[:, index], percentile)) * 1000.0 if len(array) else 0.0
+            phase_summary["traci_calls"] = int(calls[:, index].sum()) if self.count_traci_calls else None
+            phases[phase] = phase_summary
+        batch_sizes = array[:, 1]
+        return {
+            "steps": len(array),
+            "total_s": float(times.sum()),
+            "batch_size": {"total": int(batch_sizes.sum()),
+                           "mean": float(batch_sizes.mean()) if len(array) else 0.0,
+                           "max": int(batch_sizes.max()) if len(array) else 0},
+            "phases": phases,
+        }
+
+    def format_summary(self):
+        """
+        :return: the summary as a printable table
+        """
+        summary = self.summary()
+        lines = ["{} steps, {:.3f} s, {} decisions (mean batch {:.2f}, max {})".format(
+            summary["steps"], summary["total_s"], summary["batch_size"]["total"], summary["batch_size"]["mean"],
+            summary["batch_size"]["max"]),
+            "{:<16}{:>10}{:>8}{:>10}{:>10}{:>10}{:>12}".format("phase", "total s", "share", "p50 ms", "p95 ms",
+                                                                "p99 ms", "TraCI calls")]
+        for phase in PHASES:
+            phase_summary = summary["phases"][phase]
+            share = phase_summary["total_s"] / summary["total_s"] if summary["total_s"] else 0.0
+            calls = phase_summary["traci_calls"]
+            lines.append("{:<16}{:>10.3f}{:>7.1f}%{:>10.3f}{:>10.3f}{:>10.3f}{:>12}".format(
+                phase, phase_summary["total_s"], share * 100.0, phase_summary["p50_ms"], phase_summary["p95_ms"],
+                phase_summary["p99_ms"], "-" if calls is None else calls))
+        return "\n".join(lines)
+
+    def save(self, filename):
+        """
+        Write the per-step breakdown, as a NumPy array if filename ends with .npy (see columns()),
+        as CSV otherwise.
+        """
+        if filename.endswith(".npy"):
+            np.save(filename, self.as_array())
+            return
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns())
+            writer.writerows(self.rows)
@@ -0,0 +1,141 @@
+"""
+    This file is the single import point of the SUMO control API.
+
+    Every module does
+        from core.sumo_backend import traci
+    and talks to SUMO through that object. Two backends share the same API:
+        - "traci": SUMO runs as a separate process driven over a socket (default);
+        - "libsumo": SUMO runs inside the Python process, with no IPC. It cannot
+          show the GUI and only supports a single simulation per process.
+    The backend is chosen with the STR_SUMO_BACKEND environment variable or by
+    calling use_backend() before the simulation is started.
+"""
+
+import importlib
+import os
+import sys
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("No environment variable SUMO_HOME!")
+
+# the constants module is plain Python and identical for both backends
+import traci.constants as tc
+
+BACKEND_ENV = "STR_SUMO_BACKEND"
+TRACI = "traci"
+LIBSUMO = "libsumo"
+BACKENDS = [TRACI, LIBSUMO]
+
+_backend_name = None
+_backend_module = None
+
+
+def use_backend(name):
+    """
+    Select the module used to drive SUMO.
+
+    :param name: "traci" or "libsumo"
+    """
+    global _backend_name, _backend_module
+    if name not in BACKENDS:
+        raise ValueError("Unknown SUMO backend '{}', expected one of {}".format(name, BACKENDS))
+    _backend_module = importlib.import_module(name)
+    _backend_name = name
+
+
+def backend_name():
+    """
+    :return: name of the backend currently in use
+    """
+    return _backend_name
+
+
+def uses_libsumo():
+    return _backend_name == LIBSUMO
+
+
+class CallCounter:
+    """
+    Number of calls made to the SUMO API through `traci` while installed with count_calls().
+    """
+    def __init__(self):
+        self.calls = 0
+
+
+_call_counter = None
+
+
+def count_calls(counter):
+    """
+    Count every call made through `traci` (e.g. traci.vehicle.getIDList()) in counter.calls.
+
+    :param counter: CallCounter, or None to stop counting
+    """
+    global _call_counter
+    _call_counter = counter
+
+
+def _counted(attribute, counter):
+    # a domain: traci.vehicle is a Domain object, libsumo.vehicle a class of static methods
+    if isinstance(attribute, type) or (not callable(attribute) and hasattr(attribute, "__dict__")):
+        return _CountingDomain(attribute, counter)
+    if not callable(attribute):
+        return attribute
+
+    def counted_call(*args, **kwargs):
+        counter.calls += 1
+        return attribute(*args, **kwargs)
+    return counted_call
+
+
+class _CountingDomain:
+    """
+    Wraps a domain of the backend (vehicle, edge, simulation...) to count the calls of its functions.
+    """
+    def __init__(self, domain, counter):
+        self.__domain__ = domain
+        self.__counter__ = counter
+
+    def __getattr__(self, name):
+        attribute = getattr(self.__domain__, name)
+        if callable(attribute) and not isinstance(attribute, type):
+            return _counted(attribute, self.__counter__)
+        return attribute
+
+
+class _BackendProxy:
+    """
+    Forwards attribute access to the selected backend module, so that modules holding a
+    reference to `traci` follow a later use_backend() call.
+    """
+    def __getattr__(self, name):
+        if _call_counter is not None:
+            return _counted(getattr(_backend_module, name), _call_counter)
+        return getattr(_backend_module, name)
+
+
+traci = _BackendProxy()
+
+
+def start(cmd, label=None):
+    """
+    Start a simulation with the selected backend.
+
+    :param cmd: SUMO command line, e.g. [sumo_binary, "-c", "myconfig.sumocfg"]
+    :param label: TraCI connection label; ignored by libsumo which has a single simulation
+    """
+    if uses_libsumo():
+        # libsumo always runs the command line version of SUMO
+        binary = os.path.basename(cmd[0])
+        if binary.startswith("sumo-gui"):
+            cmd = [cmd[0].replace("sumo-gui", "sumo")] + list(cmd[1:])
+        return traci.start(cmd)
+    if label is None:
+        return traci.start(cmd)
+    return traci.start(cmd, label=label)
+
+
+use_backend(os.environ.get(BACKEND_ENV, TRACI))
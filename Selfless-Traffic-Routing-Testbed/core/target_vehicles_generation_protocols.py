@@ -10,9 +10,14 @@
 import random
 import os
 import sys
-import xml.dom.minidom 
+import collections
+import itertools
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
 from core import Util
 from core import network_map_data_structures
+from core import shortest_path
+from core.reachability import ReachabilityIndex
 
 
 # CHECK VERSION INFORMATION AND SET UP VERSION REFERENCE VARIABLES:
@@ -36,7 +41,7 @@ else:
     sys.exit("No environment variable SUMO_HOME!")
 
 from sumolib import checkBinary
-import traci
+from core.sumo_backend import traci
 import sumolib
 
 
@@ -60,20 +65,132 @@ class target_vehicles_generator:
     __ERROR_MESSAGE__ = "error message"
     
 
-    def __init__(self, net_file):
+    def __init__(self, net_file=None):
         """
             :param @net_file<str>: The name of the network file (in the form of XML)
+
+            The edge dictionaries are read from the on-disk network cache. The sumolib
+            network (@net) and its passenger edges (@edge_list) are only parsed the first
+            time they are accessed.
         """
+        self.net_file = net_file
         self.length_dict = None
         self.out_dict = None
         self.index_dict = None
-        self.edge_list = None
-        self.net = network_map_data_structures.getNetInfo(net_file)
-        [self.length_dict, self.out_dict, self.index_dict, self.edge_list] = network_map_data_structures.getEdgesInfo(self.net)
+        self.edge_id_list = None
+        self.__net__ = None
+        self.__edge_list__ = None
+        self.__edges_by_id__ = None
+        self.__reachability_index__ = None
+        if net_file is not None:
+            [self.length_dict, self.out_dict, self.index_dict, self.edge_id_list] = network_map_data_structures.getCachedEdgesInfo(net_file)
 
         self.__current_target_xml_file__ = ""
 
 
+    @property
+    def net(self):
+        """
+            The sumolib.Net of @net_file, parsed on first access.
+        """
+        if self.__net__ is None and self.net_file is not None:
+            self.__net__ = network_map_data_structures.getNetInfo(self.net_file)
+        return self.__net__
+
+    @net.setter
+    def net(self, net):
+        self.__net__ = net
+        self.__edge_list__ = None
+        self.__edges_by_id__ = None
+
+
+    @property
+    def edge_list(self):
+        """
+            The passenger edges of @net as sumolib.net.edge.Edge objects.
+        """
+        if self.__edge_list__ is None and self.edge_id_list is not None:
+            self.__edge_list__ = [self.net.getEdge(edge_id) for edge_id in self.edge_id_list]
+        return self.__edge_list__
+
+    @edge_list.setter
+    def edge_list(self, edge_list):
+        self.__edge_list__ = edge_list
+        self.__edges_by_id__ = None
+        self.__reachability_index__ = None
+
+
+    @property
+    def reachability_index(self):
+        """
+            The ReachabilityIndex (strongly connected components) of the passenger edges,
+            built on first access. It answers whether a path exists in O(1).
+        """
+        if self.__reachability_index__ is None:
+            edge_ids = self.edge_id_list
+            if edge_ids is None:
+                edge_ids = [edge.getID() for edge in self.edge_list]
+            self.__reachability_index__ = ReachabilityIndex(self.out_dict, edge_ids)
+        return self.__reachability_index__
+
+
+    def __edges__(self, edge_ids):
+        """
+            Returns the sumolib.net.edge.Edge objects of @edge_ids.
+        """
+        if self.__edges_by_id__ is None:
+            self.__edges_by_id__ = {edge.getID(): edge for edge in self.edge_list}
+        return [self.__edges_by_id__[edge_id] for edge_id in edge_ids]
+
+
+    def __connected_pair_sampler__(self, rng=random):
+        """
+            param @rng <random.Random>: the random number generator to draw with.
+
+            Returns a function drawing a (start_edge_id, destination_id) pair of distinct
+            edges such that a path leads from the start edge to the destination, uniformly
+            among all such pairs, so no candidate is ever rejected. Returns None if the map
+            has no such pair.
+        """
+        index = self.reachability_index
+        edge_ids = index.edge_ids
+        # every start edge is weighted by the number of other edges it can reach
+        cumulative_weights = list(itertools.accumulate(index.num_reachable_destinations(edge_id) - 1
+                                                       for edge_id in edge_ids))
+        if not cumulative_weights or cumulative_weights[-1] <= 0:
+            return None
+        destinations_of = {}
+        def sample():
+            start_edge = rng.choices(edge_ids, cum_weights=cumulative_weights)[0]
+            component = index.component_of[start_edge]
+            if component not in destinations_of:
+                destinations_of[component] = index.reachable_destinations(start_edge)
+            destination = start_edge
+            while destination == start_edge:
+                destination = rng.choice(destinations_of[component])
+            return start_edge, destination
+        return sample
+
+
+    def __sample_connected_starts__(self, num_start_points, rng=random):
+        """
+            param @num_start_points <int>: the number of start-points desired.
+            param @rng <random.Random>: the random number generator to draw with.
+
+            Returns a (start_points, destination) pair where @num_start_points start-points
+            are drawn with replacement among the edges connected to @destination, the
+            destination being weighted by the number of such edges, or None if the map
+            has no edge at all.
+        """
+        index = self.reachability_index
+        if len(self.edge_list) == 0:
+            return None
+        weights = [index.num_reachable_sources(edge.getID()) for edge in self.edge_list]
+        destination = rng.choices(self.edge_list, weights=weights)[0]
+        start_points = self.__edges__(rng.choices(index.reachable_sources(destination.getID()), k=num_start_points))
+        return start_points, destination
+
+
     def generate_target_vehicles(self, num_vehicles, target_xml_file, pattern=None):
         """
             param @num_vehicles <int>: the number of target-vehicles desired.
@@ -110,18 +227,22 @@ class target_vehicles_generator:
             if type(pattern[0]) is sumolib.net.edge.Edge:
                 if type(pattern[1]) is sumolib.net.edge.Edge:
                     # -- CASE 1. --
-                    vehicles_info = None
-                    while vehicles_info is None:
-                        vehicles_info = self.generate_with_one_start_one_dest(num_vehicles, pattern[0], pattern[1])
+                    vehicles_info = self.generate_with_one_start_one_dest(num_vehicles, pattern[0], pattern[1])
+                    if vehicles_info is None:
+                        __error_message__ = "No path from " + pattern[0].getID() + " to " + pattern[1].getID() + "!"
                 else:
                     __error_message__ = "Invalid pattern for generating random vehicles: The 1st element of " + str(pattern) + " is not an instance of sumolib.net.edge.Edge!"
             elif type(pattern[0]) is list:
                 if type(pattern[1]) is sumolib.net.edge.Edge:
                     # -- CASE 2. --
                     vehicles_info = self.generate_with_ranged_starts_one_dest(num_vehicles, pattern[0], pattern[1])
+                    if vehicles_info is None:
+                        __error_message__ = "No path from any start point of the pattern to " + pattern[1].getID() + "!"
                 elif type(pattern[1]) is list:
                     # -- CASE 3. --
                     vehicles_info = self.generate_with_ranged_starts_ranged_dests(num_vehicles, pattern[0], pattern[1])
+                    if vehicles_info is None:
+                        __error_message__ = "No path from any start point of the pattern to any of its destinations!"
                 else:
                     __error_message__ = "Invalid pattern for generating random vehicles: The 1st element of " + str(pattern) + " is not an instance of sumolib.net.edge.Edge or a list of such instances!"
             else:
@@ -170,7 +291,7 @@ class target_vehicles_generator:
         # TODO: Generate vehicle ID's:
         current_ID = target_vehicles_generator.target_vehicles_output_dict[self.__current_target_xml_file__]
         end_ID = current_ID + num_vehicles
-        if not validate_path(self.net, start_point, destination):
+        if not validate_path(self.net, start_point, destination, self.reachability_index):
             
             ### UNCOMMENT TO DEBUG ###
             print("No path from", start_point.getID(), "to", destination.getID())
@@ -213,18 +334,25 @@ class target_vehicles_generator:
         else: # CURRENT_PY_VERSION == PY_VERSION2
             assigned_start_point_lst = __random_choices_with_rp__(start_point_lst, num_vehicles)
         
+        # Only the start-points connected to the destination can replace an invalid one:
+        valid_start_point_lst = [start_point for start_point in start_point_lst
+                                 if validate_path(self.net, start_point, destination, self.reachability_index)]
+        if len(valid_start_point_lst) == 0:
+            print("No path from any start point to", destination.getID())
+            return None
+
         # TODO: Generate vehicle ID's:
         current_ID = target_vehicles_generator.target_vehicles_output_dict[self.__current_target_xml_file__]
         i = 0
         while i < num_vehicles:
             valid_pair = True
-            if not validate_path(self.net, assigned_start_point_lst[i], destination):
+            if not validate_path(self.net, assigned_start_point_lst[i], destination, self.reachability_index):
                 valid_pair = False
                 
                 ### UNCOMMENT TO DEBUG ###
                 print("No path from", assigned_start_point_lst[i].getID(), "to", destination.getID())
                 
-                assigned_start_point_lst[i] = random.choice(start_point_lst)
+                assigned_start_point_lst[i] = random.choice(valid_start_point_lst)
                 continue
             
             vehicles_info.append( (current_ID + i, (assigned_start_point_lst[i], destination), valid_pair) )
@@ -268,19 +396,31 @@ class target_vehicles_generator:
             assigned_start_point_lst = __random_choices_with_rp__(start_point_lst, num_vehicles)
             assigned_destination_lst = __random_choices_with_rp__(destination_lst, num_vehicles)
         
+        # Invalid pairs are replaced by a pair drawn among the connected ones only:
+        index = self.reachability_index
+        valid_destinations = {}
+        for start_point in start_point_lst:
+            if start_point.getID() not in valid_destinations:
+                valid_destinations[start_point.getID()] = [destination for destination in destination_lst
+                                                           if index.is_reachable(start_point.getID(), destination.getID())]
+        valid_start_point_lst = [start_point for start_point in start_point_lst if valid_destinations[start_point.getID()]]
+        if len(valid_start_point_lst) == 0:
+            print("No path from any start point to any destination")
+            return None
+
         # TODO: Generate vehicle ID's:
         current_ID = target_vehicles_generator.target_vehicles_output_dict[self.__current_target_xml_file__]
         i = 0
         while i < num_vehicles:
             valid_pair = True
-            if not validate_path(self.net, assigned_start_point_lst[i], assigned_destination_lst[i]):
+            if not validate_path(self.net, assigned_start_point_lst[i], assigned_destination_lst[i], index):
                 valid_pair = False
                 
                 ### UNCOMMENT TO DEBUG ###
                 print("No path from", assigned_start_point_lst[i].getID(), "to", assigned_destination_lst[i].getID())
                 
-                assigned_start_point_lst[i] = random.choice(start_point_lst)
-                assigned_destination_lst[i] = random.choice(destination_lst)
+                assigned_start_point_lst[i] = random.choice(valid_start_point_lst)
+                assigned_destination_lst[i] = random.choice(valid_destinations[assigned_start_point_lst[i].getID()])
                 continue
             
             vehicles_info.append( (current_ID + i, (assigned_start_point_lst[i], assigned_destination_lst[i]), valid_pair) )
@@ -315,15 +455,14 @@ class target_vehicles_generator:
         # TODO: Generate vehicle ID's:
         current_ID = target_vehicles_generator.target_vehicles_output_dict[self.__current_target_xml_file__]
         i = 0
+        sample_pair = self.__connected_pair_sampler__()
+        if sample_pair is None:
+            print("No path between any two edges of the map")
+            return vehicles_info
         while i < num_vehicles:
-            pair = random.sample(self.edge_list, 2)
-            if validate_path(self.net, pair[0], pair[1]):
-                vehicles_info.append( (current_ID + i, pair, True) )
-                i += 1
-            ### UNCOMMENT TO DEBUG ###
-            #else:
-                #print("No path from", pair[0].getID(), "to", pair[1].getID())
-                
+            vehicles_info.append( (current_ID + i, self.__edges__(sample_pair()), True) )
+            i += 1
+
         return vehicles_info
     
     
@@ -359,7 +498,39 @@ class target_vehicles_generator:
         
         target_vehicles_generator.target_vehicles_output_dict[target_xml_file] = 0
 
-    def generate_vehicles(self, num_target_vehicles, num_random_vehicles, pattern, target_xml_file, net_xml_file):
+    def generate_random_trips(self, num_vehicles, end_time=50.0, seed=None):
+        """
+            param @num_vehicles <int>: the number of uncontrolled vehicles desired.
+            param @end_time <float>: the departures are spread evenly over [0, @end_time).
+            param @seed <int>: seed of the random number generator; None for a random seed.
+
+            Function to generate the background (uncontrolled) traffic on the already
+            loaded network, in place of SUMO's randomTrips.py. Random pairs of distinct
+            passenger edges are drawn among the connected ones with @reachability_index and
+            routed with the shortest-path engine, so exactly @num_vehicles routable trips are
+            returned, as a list of (depart <float>, vehicle_id <str>, route <list of edge IDs>)
+            tuples sorted by depart. Returns None if no two edges of the map are connected.
+        """
+        rng = random.Random(seed)
+        if num_vehicles <= 0:
+            return []
+        sample_pair = self.__connected_pair_sampler__(rng)
+        if sample_pair is None:
+            print("ERROR: No path between any two edges of the map.")
+            return None
+        period = end_time / float(num_vehicles)
+
+        trips = []
+        for i in range(num_vehicles):
+            start_edge, destination = sample_pair()
+            distances, predecessors = shortest_path.dijkstra(self.out_dict, self.length_dict, start_edge,
+                                                             destination, self.index_dict)
+            route = shortest_path.reconstruct_edges(predecessors, start_edge, destination)
+            trips.append( (round(i * period, 2), str(i), route) )
+        return trips
+
+
+    def generate_vehicles(self, num_target_vehicles, num_random_vehicles, pattern, target_xml_file, net_xml_file, seed=None):
         """
             param @num_target_vehicles <int>: The number of target vehicles.
             param @num_random_vehicles <int>: The number of uncontrolled vehicles.
@@ -369,6 +540,10 @@ class target_vehicles_generator:
                 #2. ranged start point, one destination for all target vehicles
                 #3. ranged start points, ranged destination for all target vehicles
             -- CASES ENDS --
+            param @net_xml_file <str>: The network file; the uncontrolled traffic is generated
+                                       on the network already loaded by this generator.
+            param @seed <int>: The seed of the uncontrolled traffic; by default it is drawn
+                               from the random module, so random.seed() makes runs repeatable.
 
             Returns the list of target vehicles if succeeds.
             Returns None if the generation fails with error infromation output to the console.
@@ -376,57 +551,42 @@ class target_vehicles_generator:
             There is no guaratnee on the contents in target_xml_file if the generation fails, i.e., returns None
         """
         #set the start time as 0 (by default) and the end time as 50
-        #calculate the density of vehicles accordingly
         latest_release_time = 50.0 #a constant number for the latest release time of all vehicles
-        num_random_vehicles *= 2 # this is done to compensate the loss when generating using scripts. Need to solve this later.
-        density =  latest_release_time / float(num_random_vehicles)
-        density = int(density * 100)/100.0
-        #copy the file randomTrips.py to the current directory
-        command_str = "cp $SUMO_HOME/tools/randomTrips.py ./"
-        if os.system(command_str) != 0:
-            print("ERROR: Failed to copy randomTrips.py to current directory.")
-            return None
-        #invoke randomTrips.py
-        command_str = "./randomTrips.py -n "+net_xml_file+" -e 50 -p "+str(density) +" -r "+target_xml_file
-        if os.system(command_str) != 0:
-            print("ERROR: Failed to invoke randomTrips.py.")
-            return None
-        #delete randomTrips.py
-        command_str = "rm ./randomTrips.py"
-        if os.system(command_str) != 0:
-            print("ERROR: Failed to remove randomTrips.py.")
+        #generate exactly num_random_vehicles routable uncontrolled trips
+        if seed is None:
+            seed = random.getrandbits(32)
+        trips = self.generate_random_trips(num_random_vehicles, latest_release_time, seed)
+        if trips is None:
             return None
+        write_route_file(target_xml_file, trips)
         #insert the generated vehicles into the xml file
         #use id to find the vehicles and modify their information directly
         result_dict = None
+        #the candidates are drawn among connected edges only, so they are valid by construction
         if pattern==1:
-            param_start = random.choice(self.edge_list)
-            param_dest = random.choice(self.edge_list)
-            while not validate_path(self.net, param_start, param_dest):
-                param_start = random.choice(self.edge_list)
-                param_dest = random.choice(self.edge_list)
-                ### UNCOMMENT TO DEBUG ###
-                #print("DEBUG: pattern 1 regenerating.")
+            sample_pair = self.__connected_pair_sampler__()
+            if sample_pair is None:
+                print("ERROR: No path between any two edges of the map.")
+                return None
+            param_start, param_dest = self.__edges__(sample_pair())
             result_dict = self.generate_target_vehicles(num_target_vehicles, target_xml_file, (param_start, param_dest) )
         elif pattern==2:
-            param_start = __random_choices_with_rp__(self.edge_list, num_target_vehicles*2)
-            param_dest = random.choice(self.edge_list)
-            #all pairs must be valid
-            while not validate_path_start_points(self.net, param_start, param_dest):
-                param_start = __random_choices_with_rp__(self.edge_list, num_target_vehicles*2)
-                param_dest = random.choice(self.edge_list)
-                ### UNCOMMENT TO DEBUG ###
-                #print("DEBUG: pattern 2 regenerating.")
+            #all start points can reach the destination
+            candidates = self.__sample_connected_starts__(num_target_vehicles*2)
+            if candidates is None:
+                print("ERROR: The map has no edge to generate vehicles on.")
+                return None
+            param_start, param_dest = candidates
             result_dict = self.generate_target_vehicles(num_target_vehicles, target_xml_file, (param_start, param_dest) )
         elif pattern==3:
-            param_start = __random_choices_with_rp__(self.edge_list, num_target_vehicles*2)
-            param_dest = __random_choices_with_rp__(self.edge_list, num_target_vehicles*2)
-            #at least one group of start points and one destination is valid towards each other
-            while not validate_path_starts_ends(self.net, param_start, param_dest):
-                param_start = __random_choices_with_rp__(self.edge_list, num_target_vehicles*2)
-                param_dest = __random_choices_with_rp__(self.edge_list, num_target_vehicles*2)
-                ### UNCOMMENT TO DEBUG ###
-                #print("DEBUG: pattern 3 regenerating.")
+            #all start points can reach one hub destination, hidden among random destinations
+            candidates = self.__sample_connected_starts__(num_target_vehicles*2)
+            if candidates is None:
+                print("ERROR: The map has no edge to generate vehicles on.")
+                return None
+            param_start, hub_dest = candidates
+            param_dest = __random_choices_with_rp__(self.edge_list, num_target_vehicles*2 - 1)
+            param_dest.insert(random.randint(0, len(param_dest)), hub_dest)
             result_dict = self.generate_target_vehicles(num_target_vehicles, target_xml_file, (param_start, param_dest) )
         else:
             print("ERROR: Unknown pattern type.")
@@ -441,97 +601,187 @@ class target_vehicles_generator:
         release_time = 0
         release_period = latest_release_time/float(num_target_vehicles)
 
-        #read the xml file
-        doc = xml.dom.minidom.parse(target_xml_file)
-        root = doc.documentElement
-        vs = root.getElementsByTagName("vehicle")
-        index = 0
-        print(len(vs))
-        id_now = int(vs.item(len(vs) - 1).getAttribute('id')) + 1
+        #the controlled vehicles get the ids following the last vehicle of the generated file
+        last_id = last_vehicle_id(target_xml_file)
+        id_now = int(last_id) + 1 if last_id is not None else 0
+        controlled_vehicles = []
         #deadline set arbitrarily between a certain range
         for r in result_lst:
-            #find the vehicle slot based on the depart time (departure time must be sorted in xml)
-            for i in range(index, len(vs)):
-                if float(vs.item(i).getAttribute('depart')) <= release_time:
-                    index = i
-                else:
-                    break
-            
-            #insert the vehicle into the xml file
-            #print(index)
-            temp_v = doc.createElement('vehicle')
-            temp_v.setAttribute('depart', str(release_time))
-            temp_v.setAttribute('id', str(id_now))
-            temp_r = doc.createElement('route')
-            temp_r.setAttribute('edges', r[1][0].getID()) #set the start edge as the route
-            temp_v.appendChild(temp_r)
-            if index == len(vs) - 1:
-                root.appendChild(temp_v)
-            else:
-                root.insertBefore(temp_v, vs[index+1])
-                #root.appendChild(temp_v)
+            #the start edge is used as the route of the vehicle
+            controlled_vehicles.append( (release_time, str(id_now), r[1][0].getID()) )
             #append the vehicle to the final vehicle list
             ddl_now = random.randint(500,1000)#randomly set ddl in a range for now
             v_now = Util.Vehicle(str(id_now), r[1][1].getID(), release_time, ddl_now)
             vehicle_list.append(v_now)
             release_time += release_period
             id_now += 1
-            vs = root.getElementsByTagName("vehicle")
-        #write the vehicle information into the xml file
-        with open(target_xml_file, 'w') as f:
-            f.write(doc.toprettyxml())
-            f.flush()
-            f.close
+        #interleave the controlled vehicles with the generated ones by depart time, in one streaming pass
+        merge_vehicles_into_route_file(target_xml_file, controlled_vehicles)
         return vehicle_list
 
 
-    
-def validate_path(net, start_point, destination):
+
+def write_route_file(route_file, trips):
+    """
+        param @route_file <str>: name of the route file to write.
+        param @trips <list>: (depart <float>, vehicle_id <str>, route <list of edge IDs>) tuples,
+                             sorted by depart.
+
+        Function to write @trips as a SUMO route file, in the same layout as the output
+        of randomTrips.py. The file is written vehicle by vehicle.
+    """
+    with open(route_file, 'w') as out:
+        out.write('<?xml version="1.0" ?>\n')
+        out.write('<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                  'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">\n')
+        for depart, vehicle_id, route in trips:
+            out.write('    <vehicle id={} depart="{:.2f}">\n        <route edges={}/>\n    </vehicle>\n'.format(
+                quoteattr(vehicle_id), depart, quoteattr(" ".join(route))))
+        out.write('</routes>\n')
+
+
+def last_vehicle_id(route_file):
+    """
+        param @route_file <str>: name of a SUMO route file.
+
+        Returns the id of the last <vehicle> element of @route_file, or None if there is
+        none. The file is streamed, so memory use does not grow with its size.
+    """
+    vehicle_id = None
+    for event, elem in ElementTree.iterparse(route_file, events=("end",)):
+        if elem.tag == "vehicle":
+            vehicle_id = elem.get("id")
+        elem.clear()
+    return vehicle_id
+
+
+def merge_vehicles_into_route_file(route_file, controlled_vehicles):
+    """
+        param @route_file <str>: name of a route file sorted by depart time; it is
+                                 rewritten in place.
+        param @controlled_vehicles <list>: (depart <float>, vehicle_id <str>, start_edge_id <str>)
+                                           tuples, sorted by depart.
+
+        Function to insert the controlled vehicles into @route_file so that the file stays
+        sorted by depart time: each controlled vehicle is placed after every vehicle that
+        departs no later than it. The file is read with an iterative parser and the result
+        is written element by element into a temporary file that replaces @route_file at
+        the end, so the whole merge is one linear pass with constant memory.
+    """
+    pending = collections.deque(controlled_vehicles)
+    namespaces = []
+    temp_file = route_file + ".tmp"
+    with open(temp_file, 'w') as out:
+        depth = 0
+        root = None
+        for event, elem in ElementTree.iterparse(route_file, events=("start", "end", "start-ns")):
+            if event == "start-ns":
+                namespaces.append(elem)
+                continue
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = elem
+                    out.write('<?xml version="1.0" ?>\n')
+                    out.write("<" + elem.tag + __format_attributes__(elem.attrib, namespaces) + ">\n")
+                continue
+
+            depth -= 1
+            if depth == 0:
+                #end of the root element: the remaining vehicles depart after every generated one
+                while pending:
+                    out.write(__controlled_vehicle_xml__(*pending.popleft()))
+                out.write("</" + elem.tag + ">\n")
+            elif depth == 1:
+                if elem.tag == "vehicle":
+                    depart = float(elem.get("depart"))
+                    while pending and pending[0][0] < depart:
+                        out.write(__controlled_vehicle_xml__(*pending.popleft()))
+                elem.tail = None
+                out.write("    " + ElementTree.tostring(elem, encoding="unicode") + "\n")
+                #drop the written element from the tree to keep memory constant
+                root.clear()
+    os.replace(temp_file, route_file)
+
+
+def __format_attributes__(attributes, namespaces):
+    """
+        Returns the attributes of an element, with the namespace declarations collected by
+        iterparse, as a string ready to be placed in a start tag.
+    """
+    uri_prefix = {uri: prefix for prefix, uri in namespaces}
+    result = ""
+    for prefix, uri in namespaces:
+        result += " xmlns" + (":" + prefix if prefix else "") + "=" + quoteattr(uri)
+    for key, value in attributes.items():
+        if key.startswith("{"):
+            uri, local_name = key[1:].split("}", 1)
+            key = uri_prefix.get(uri, "") + ":" + local_name
+        result += " " + key + "=" + quoteattr(value)
+    return result
+
+
+def __controlled_vehicle_xml__(depart, vehicle_id, start_edge_id):
+    """
+        Returns the <vehicle> element of a controlled vehicle whose route is its start edge.
+    """
+    return '    <vehicle depart={} id={}>\n        <route edges={}/>\n    </vehicle>\n'.format(
+        quoteattr(str(depart)), quoteattr(vehicle_id), quoteattr(start_edge_id))
+
+
+def validate_path(net, start_point, destination, reachability_index=None):
     """
         param @net <sumolib.net.Net>: parameter that stores the information of a map.
         param @start_point <sumolib.net.edge.Edge>: a start-point on the map from @net.
         param @destination <sumolib.net.edge.Edge>: a destination on the map from @net.
+        param @reachability_index <ReachabilityIndex>: precomputed reachability of the map;
+                                                       if None, a shortest path is searched.
         
         Function to validate the existence of a path from @start_point to @destination,
-        using the shortest path algorithm offered by @net; returns True if such a path
-        exists, and False otherwise.
+        using @reachability_index, or the shortest path algorithm offered by @net; returns
+        True if such a path exists, and False otherwise.
         
     """
+    if reachability_index is not None:
+        return reachability_index.is_reachable(start_point.getID(), destination.getID())
     shortestPath = net.getShortestPath(start_point, destination)
     return shortestPath[0] != None
     
-def validate_path_start_points(net, start_points, destination):
+def validate_path_start_points(net, start_points, destination, reachability_index=None):
     """
         param @net <sumolib.net.Net>: parameter that stores the information of a map.
         param @start_point <list of sumolib.net.edge.Edge>: a list of start-points on the map from @net.
         param @destination <sumolib.net.edge.Edge>: a destination on the map from @net.
+        param @reachability_index <ReachabilityIndex>: precomputed reachability of the map;
+                                                       if None, shortest paths are searched.
         
         Function to validate the existence of a path from @start_point to @destination,
-        using the shortest path algorithm offered by @net; returns True if such a path
-        exists, and False otherwise.
+        using @reachability_index, or the shortest path algorithm offered by @net; returns
+        True if such a path exists, and False otherwise.
     """
     num = 0
     for s in start_points:
-        shortest_path = net.getShortestPath(s, destination)
-        if shortest_path[0]==None:
+        if not validate_path(net, s, destination, reachability_index):
             return False
         num += 1
         if num >= len(start_points)/2:
             return True
     return True
 
-def validate_path_starts_ends(net, start_points, destinations):
+def validate_path_starts_ends(net, start_points, destinations, reachability_index=None):
     """
         param @net <sumolib.net.Net>: parameter that stores the information of a map.
         param @start_point <list of sumolib.net.edge.Edge>: a list of start-points on the map from @net.
         param @destination <list of sumolib.net.edge.Edge>: a destination on the map from @net.
+        param @reachability_index <ReachabilityIndex>: precomputed reachability of the map;
+                                                       if None, shortest paths are searched.
         
         Function to validate the existence of a path from @start_point to @destination,
-        using the shortest path algorithm offered by @net; returns True if such a path
-        exists, and False otherwise.
+        using @reachability_index, or the shortest path algorithm offered by @net; returns
+        True if such a path exists, and False otherwise.
     """
     for d in destinations:
-        if validate_path_start_points(net, start_points, d):
+        if validate_path_start_points(net, start_points, d, reachability_index):
             return True
     return False
     
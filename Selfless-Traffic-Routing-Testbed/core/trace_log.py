@@ -0,0 +1,224 @@
+"""
+    This file contains the record/replay log of the inputs a routing policy receives.
+
+    TraceRecorder is passed to StrSumo and appends, for every simulation step:
+        - the edges whose vehicle count or mean speed changed, with their new values
+          (see ConnectionInfo.update_edge_vehicle_counts),
+        - the batch passed to make_decisions: vehicle, current edge, speed and start time,
+        - the controlled vehicles that arrived during the step.
+    replay() feeds such a log to any RouteController with no SUMO process: the
+    ConnectionInfo and the Vehicle objects go through the same states as in the live
+    run, so the policy takes the same decisions, at the speed of the policy alone.
+
+    File layout (little endian):
+        magic  b"STRTRACE", uint32 header size, JSON header {"version", "net_file",
+               "edge_ids" (in edge_index_dict order), "vehicles" [[id, destination, deadline]]}
+        then one record per step: uint32 step, uint32 changed edges, uint32 batch size,
+        uint32 arrivals, followed by the arrays
+            int32 edge index, int32 vehicle count, float64 mean speed   (changed edges)
+            int32 vehicle index, int32 edge index, float64 speed, float64 start time   (batch)
+            int32 vehicle index   (arrivals)
+    Records are only appended, so the log of an interrupted run stays readable up to
+    its last complete step.
+"""
+
+import json
+import struct
+import time
+
+import numpy as np
+
+from core.Util import Vehicle
+
+TRACE_MAGIC = b"STRTRACE"
+TRACE_FORMAT_VERSION = 1
+_HEADER_SIZE = struct.Struct("<I")
+_RECORD = struct.Struct("<IIII")
+
+
+class TraceRecorder:
+    """
+    :param filename: log file to write, overwritten if it exists
+    :param connection_info: object containing network information, observed through an edge state listener
+    :param controlled_vehicles: {vehicle_id: Vehicle} of the run
+    """
+    def __init__(self, filename, connection_info, controlled_vehicles):
+        self.filename = filename
+        self.connection_info = connection_info
+        self.controlled_vehicles = controlled_vehicles
+        self.vehicle_index = {vehicle_id: index for index, vehicle_id in enumerate(controlled_vehicles)}
+        self.file = None
+        self.changed_edges = set()
+
+    def start(self):
+        """
+        Called by StrSumo.run before the first step: write the header and start observing the edges.
+        """
+        header = {
+            "version": TRACE_FORMAT_VERSION,
+            "net_file": self.connection_info.net_filename,
+            "edge_ids": self.connection_info.network_graph.edge_ids,
+            "vehicles": [[vehicle_id, vehicle.destination, vehicle.deadline]
+                         for vehicle_id, vehicle in self.controlled_vehicles.items()],
+        }
+        encoded_header = json.dumps(header).encode("utf8")
+        self.file = open(self.filename, 'wb')
+        self.file.write(TRACE_MAGIC + _HEADER_SIZE.pack(len(encoded_header)) + encoded_header)
+        # a state left by an earlier run goes into the first record, replays start from a fresh ConnectionInfo
+        self.changed_edges = set(self.connection_info.edge_vehicle_count) | \
+            set(self.connection_info.edge_mean_speed_dict)
+        self.connection_info.add_edge_state_listener(self.__on_edge_state_change__)
+
+    def record_step(self, step, vehicles_to_direct, arrived_vehicle_ids):
+        """
+        :param step: simulation step
+        :param vehicles_to_direct: list of Vehicles passed to make_decisions during the step
+        :param arrived_vehicle_ids: ids of the controlled vehicles that arrived during the step
+        """
+        edge_index_dict = self.connection_info.edge_index_dict
+        edge_vehicle_count = self.connection_info.edge_vehicle_count
+        edge_mean_speed_dict = self.connection_info.edge_mean_speed_dict
+        changed_edges = list(self.changed_edges)
+        self.changed_edges = set()
+
+        parts = [
+            _RECORD.pack(step, len(changed_edges), len(vehicles_to_direct), len(arrived_vehicle_ids)),
+            np.array([edge_index_dict[edge] for edge in changed_edges], dtype=np.int32).tobytes(),
+            np.array([edge_vehicle_count.get(edge, 0) for edge in changed_edges], dtype=np.int32).tobytes(),
+            np.array([edge_mean_speed_dict.get(edge, np.nan) for edge in changed_edges], dtype=np.float64).tobytes(),
+            np.array([self.vehicle_index[vehicle.vehicle_id] for vehicle in vehicles_to_direct],
+                     dtype=np.int32).tobytes(),
+            np.array([edge_index_dict[vehicle.current_edge] for vehicle in vehicles_to_direct],
+                     dtype=np.int32).tobytes(),
+            np.array([vehicle.current_speed for vehicle in vehicles_to_direct], dtype=np.float64).tobytes(),
+            np.array([vehicle.start_time for vehicle in vehicles_to_direct], dtype=np.float64).tobytes(),
+            np.array([self.vehicle_index[vehicle_id] for vehicle_id in arrived_vehicle_ids],
+                     dtype=np.int32).tobytes(),
+        ]
+        self.file.write(b"".join(parts))
+
+    def close(self):
+        """
+        Called by StrSumo.run once the simulation is over.
+        """
+        self.connection_info.remove_edge_state_listener(self.__on_edge_state_change__)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __on_edge_state_change__(self, edges):
+        self.changed_edges.update(edges)
+
+
+class TraceStep:
+    """
+    One step of a log, see read_trace(). Edges and vehicles are given as indices into
+    the edge_ids and vehicles lists of the header.
+    """
+    def __init__(self, step, edge_indices, counts, mean_speeds, vehicle_indices, vehicle_edges, vehicle_speeds,
+                 start_times, arrived):
+        self.step = step
+        self.edge_indices = edge_indices
+        self.counts = counts
+        self.mean_speeds = mean_speeds
+        self.vehicle_indices = vehicle_indices
+        self.vehicle_edges = vehicle_edges
+        self.vehicle_speeds = vehicle_speeds
+        self.start_times = start_times
+        self.arrived = arrived
+
+
+def read_trace(filename):
+    """
+    :param filename: log written by TraceRecorder
+    :return: (header dict, list of TraceStep)
+    :raises ValueError: if the file is not a trace log of the current format
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError("{} is not a trace log".format(filename))
+    offset = len(TRACE_MAGIC)
+    header_size, = _HEADER_SIZE.unpack_from(data, offset)
+    offset += _HEADER_SIZE.size
+    header = json.loads(data[offset:offset + header_size].decode("utf8"))
+    offset += header_size
+    if header.get("version") != TRACE_FORMAT_VERSION:
+        raise ValueError("{} has trace format {}, expected {}".format(filename, header.get("version"),
+                                                                     TRACE_FORMAT_VERSION))
+
+    def take(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    steps = []
+    while offset + _RECORD.size <= len(data):
+        step, num_edges, num_vehicles, num_arrived = _RECORD.unpack_from(data, offset)
+        record_size = _RECORD.size + num_edges * 16 + num_vehicles * 24 + num_arrived * 4
+        if offset + record_size > len(data):
+            # the run stopped while writing this record
+            break
+        offset += _RECORD.size
+        steps.append(TraceStep(step, take(np.int32, num_edges), take(np.int32, num_edges),
+                               take(np.float64, num_edges), take(np.int32, num_vehicles),
+                               take(np.int32, num_vehicles), take(np.float64, num_vehicles),
+                               take(np.float64, num_vehicles), take(np.int32, num_arrived)))
+    return header, steps
+
+
+def replay(filename, route_controller, connection_info, on_decisions=None):
+    """
+    Feed a log to route_controller.make_decisions, the way StrSumo.run would.
+
+    :param filename: log written by TraceRecorder
+    :param route_controller: RouteController to run; it should be fresh, like at the start of a live run
+    :param connection_info: ConnectionInfo of the map of the log, fresh as well (its edge state is replayed)
+    :param on_decisions: optional function (step, {vehicle_id: local target edge}) called after every step
+    :return: {"steps", "decisions", "decision_s": time spent in make_decisions, "wall_s"}
+    :raises ValueError: if connection_info does not hold the edges of the log
+    """
+    header, steps = read_trace(filename)
+    edge_ids = header["edge_ids"]
+    if edge_ids != connection_info.network_graph.edge_ids:
+        raise ValueError("{} was recorded on another map than {}".format(filename, connection_info.net_filename))
+    vehicles = [Vehicle(vehicle_id, destination, 0.0, deadline) for vehicle_id, destination, deadline
+                in header["vehicles"]]
+
+    decisions = 0
+    decision_time = 0.0
+    start = time.perf_counter()
+    for trace_step in steps:
+        edges = [edge_ids[index] for index in trace_step.edge_indices.tolist()]
+        connection_info.update_edge_vehicle_counts(
+            dict(zip(edges, trace_step.counts.tolist())),
+            {edge: speed for edge, speed in zip(edges, trace_step.mean_speeds.tolist()) if speed == speed})
+
+        vehicles_to_direct = []
+        for vehicle_index, edge_index, speed, start_time in zip(trace_step.vehicle_indices.tolist(),
+                                                                trace_step.vehicle_edges.tolist(),
+                                                                trace_step.vehicle_speeds.tolist(),
+                                                                trace_step.start_times.tolist()):
+            vehicle = vehicles[vehicle_index]
+            vehicle.current_edge = edge_ids[edge_index]
+            vehicle.current_speed = speed
+            vehicle.start_time = start_time
+            vehicles_to_direct.append(vehicle)
+
+        decision_start = time.perf_counter()
+        vehicle_decisions_by_id = route_controller.make_decisions(vehicles_to_direct, connection_info)
+        decision_time += time.perf_counter() - decision_start
+        decisions += len(vehicles_to_direct)
+
+        vehicle_by_id = {vehicle.vehicle_id: vehicle for vehicle in vehicles_to_direct}
+        for vehicle_id, local_target_edge in vehicle_decisions_by_id.items():
+            if vehicle_id in vehicle_by_id:
+                vehicle_by_id[vehicle_id].local_destination = local_target_edge
+        if on_decisions is not None:
+            on_decisions(trace_step.step, vehicle_decisions_by_id)
+        for vehicle_index in trace_step.arrived.tolist():
+            route_controller.forget_route_plan(vehicles[vehicle_index].vehicle_id)
+
+    return {"steps": len(steps), "decisions": decisions, "decision_s": decision_time,
+            "wall_s": time.perf_counter() - start}
@@ -0,0 +1,219 @@
+'''
+Runs a grid of experiments in parallel, one SUMO instance per worker process.
+
+Every cell of the grid is one (policy, map, seed, number of controlled vehicles)
+combination. Each cell gets its own directory under the output directory, holding
+its route file and the tripinfo/FCD outputs of SUMO, so workers never overwrite
+each other's files. The (total_time, end_number, deadlines_missed) tuples returned
+by StrSumo.run are collected into a single CSV results table, and the per-vehicle
+trip records of each cell are written to trips.csv in its directory.
+
+Example:
+    python3 experiment_runner.py --policies dijkstra,nathan \
+        --maps configurations/simple_grid1.net.xml,configurations/simple_grid2.net.xml \
+        --seeds 1,2,3 --vehicles 30,70 --workers 4 --backend libsumo
+'''
+import csv
+import itertools
+import multiprocessing
+import optparse
+import os
+import random
+import sys
+import time
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("No environment variable SUMO_HOME!")
+
+from sumolib import checkBinary
+from core import sumo_backend
+from core.sumo_backend import traci
+from core.STR_SUMO import StrSumo
+from core.step_profiler import StepProfiler, PHASES
+from core.trace_log import TraceRecorder
+from core.Util import ConnectionInfo
+from core.target_vehicles_generation_protocols import target_vehicles_generator
+from controller.RouteController import RandomPolicy, NathanPolicy
+from controller.DijkstraController import DijkstraPolicy
+from controller.AStarController import AStarPolicy
+from controller.ALTController import ALTPolicy
+from controller.CHController import CHPolicy
+
+POLICIES = {
+    "dijkstra": DijkstraPolicy,
+    "astar": AStarPolicy,
+    "alt": ALTPolicy,
+    "ch": CHPolicy,
+    "nathan": NathanPolicy,
+    "random": RandomPolicy,
+}
+
+RESULT_FIELDS = ["policy", "map", "seed", "controlled_vehicles", "uncontrolled_vehicles",
+                 "total_time", "end_number", "deadlines_missed", "average_timespan", "wall_time", "output_dir"]
+# added to the results table by --profile
+PROFILE_FIELDS = ["steps", "decisions", "traci_calls"] + [phase + "_s" for phase in PHASES] + \
+                 [phase + "_p95_ms" for phase in PHASES]
+
+
+def cell_name(policy, net_file, seed, num_controlled_vehicles):
+    '''
+    :return <str>: a label that identifies the cell, also used as directory and TraCI connection name
+    '''
+    map_name = os.path.basename(net_file).replace(".net.xml", "")
+    return "{}-{}-seed{}-veh{}".format(policy, map_name, seed, num_controlled_vehicles)
+
+
+def run_cell(cell):
+    '''
+    :param @cell <dict>: one experiment, see build_cells()
+    :return <dict>: one row of the results table
+
+    Runs in a worker process: generates the scenario of the cell, starts its own SUMO
+    instance and runs the policy on it.
+    '''
+    sumo_backend.use_backend(cell["backend"])
+    os.makedirs(cell["output_dir"], exist_ok=True)
+
+    # the same seed produces the same scenario for every policy
+    random.seed(cell["seed"])
+    connection_info = ConnectionInfo(cell["map"])
+    route_file = os.path.join(cell["output_dir"], "routes.rou.xml")
+    generator = target_vehicles_generator(cell["map"])
+    vehicle_list = generator.generate_vehicles(cell["controlled_vehicles"], cell["uncontrolled_vehicles"],
+                                               cell["pattern"], route_file, cell["map"], seed=cell["seed"])
+    row = {field: cell.get(field, "") for field in RESULT_FIELDS}
+    if vehicle_list is None:
+        print("Cell {}: vehicle generation failed.".format(cell["name"]))
+        return row
+    vehicles = {str(vehicle.vehicle_id): vehicle for vehicle in vehicle_list}
+
+    scheduler = POLICIES[cell["policy"]](connection_info)
+    profiler = StepProfiler() if cell.get("profile") else None
+    recorder = None
+    if cell.get("record"):
+        recorder = TraceRecorder(os.path.join(cell["output_dir"], "trace.bin"), connection_info, vehicles)
+    simulation = StrSumo(scheduler, connection_info, vehicles, profiler, recorder,
+                         pipeline_lag=cell["pipeline_lag"])
+    sumo_backend.start([checkBinary('sumo'), "-n", cell["map"], "-r", route_file,
+                        "--seed", str(cell["seed"]), "--no-step-log", "true",
+                        "--tripinfo-output", os.path.join(cell["output_dir"], "tripinfo.xml"),
+                        "--fcd-output", os.path.join(cell["output_dir"], "fcd.xml")],
+                       label=cell["name"])
+
+    start = time.time()
+    try:
+        total_time, end_number, deadlines_missed, trip_records = simulation.run(return_records=True)
+    finally:
+        traci.close()
+    trip_records.save(os.path.join(cell["output_dir"], "trips.csv"))
+    row["total_time"] = total_time
+    row["end_number"] = end_number
+    row["deadlines_missed"] = deadlines_missed
+    row["average_timespan"] = total_time / end_number if end_number else ""
+    row["wall_time"] = round(time.time() - start, 3)
+    if profiler is not None:
+        profiler.save(os.path.join(cell["output_dir"], "profile.csv"))
+        summary = profiler.summary()
+        row["steps"] = summary["steps"]
+        row["decisions"] = summary["batch_size"]["total"]
+        row["traci_calls"] = sum(phase["traci_calls"] for phase in summary["phases"].values())
+        for phase in PHASES:
+            row[phase + "_s"] = round(summary["phases"][phase]["total_s"], 6)
+            row[phase + "_p95_ms"] = round(summary["phases"][phase]["p95_ms"], 6)
+    return row
+
+
+def build_cells(policies, maps, seeds, vehicle_counts, num_uncontrolled_vehicles, pattern, output_dir, backend,
+                profile=False, record=False, pipeline_lag=0):
+    '''
+    :return <list>: one dict per (policy, map, seed, vehicle count) combination
+    '''
+    cells = []
+    for policy, net_file, seed, num_vehicles in itertools.product(policies, maps, seeds, vehicle_counts):
+        name = cell_name(policy, net_file, seed, num_vehicles)
+        cells.append({
+            "name": name,
+            "policy": policy,
+            "map": os.path.abspath(net_file),
+            "seed": seed,
+            "controlled_vehicles": num_vehicles,
+            "uncontrolled_vehicles": num_uncontrolled_vehicles,
+            "pattern": pattern,
+            "backend": backend,
+            "profile": profile,
+            "record": record,
+            "pipeline_lag": pipeline_lag,
+            "output_dir": os.path.abspath(os.path.join(output_dir, name)),
+        })
+    return cells
+
+
+def run_experiments(cells, num_workers, results_file):
+    '''
+    :param @cells <list>: the cells returned by build_cells()
+    :param @num_workers <int>: number of SUMO instances running at the same time
+    :param @results_file <str>: CSV file the results table is written to
+    :return <list>: the rows of the results table, in the order of @cells
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+    rows = {}
+    with multiprocessing.Pool(num_workers, maxtasksperchild=1) as pool:
+        for row in pool.imap_unordered(run_cell, cells):
+            rows[row["output_dir"]] = row
+            print("{policy} on {map} seed {seed} with {controlled_vehicles} vehicles: "
+                  "total time {total_time}, {end_number} vehicles, {deadlines_missed} deadlines missed".format(**row))
+
+    ordered_rows = [rows[cell["output_dir"]] for cell in cells if cell["output_dir"] in rows]
+    with open(results_file, 'w', newline='') as f:
+        profiled = any(cell.get("profile") for cell in cells)
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS + (PROFILE_FIELDS if profiled else []))
+        writer.writeheader()
+        writer.writerows(ordered_rows)
+    return ordered_rows
+
+
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--policies", default="dijkstra,nathan",
+                          help="comma separated policies out of " + ",".join(POLICIES))
+    opt_parser.add_option("--maps", default="configurations/simple_grid1.net.xml",
+                          help="comma separated .net.xml files")
+    opt_parser.add_option("--seeds", default="1", help="comma separated random seeds")
+    opt_parser.add_option("--vehicles", default="70", help="comma separated numbers of controlled vehicles")
+    opt_parser.add_option("--uncontrolled", type="int", default=40, help="number of uncontrolled vehicles")
+    opt_parser.add_option("--pattern", type="int", default=2, help="vehicle generation pattern (1, 2 or 3)")
+    opt_parser.add_option("--workers", type="int", default=multiprocessing.cpu_count(),
+                          help="number of simulations running in parallel")
+    opt_parser.add_option("--output-dir", dest="output_dir", default="./experiments",
+                          help="directory receiving one sub-directory per cell and results.csv")
+    opt_parser.add_option("--backend", choices=sumo_backend.BACKENDS, default=sumo_backend.backend_name(),
+                          help="'traci' or 'libsumo'")
+    opt_parser.add_option("--profile", action="store_true", default=False,
+                          help="time the phases of every step (see core/step_profiler.py); adds the totals and "
+                               "p95 of every phase to results.csv and writes profile.csv in each cell directory")
+    opt_parser.add_option("--record", action="store_true", default=False,
+                          help="log the inputs of the route controller into trace.bin in each cell directory, "
+                               "to be replayed without SUMO by replay.py")
+    opt_parser.add_option("--pipeline-lag", dest="pipeline_lag", type="int", default=0,
+                          help="compute the routing decisions on a worker thread while SUMO advances and apply them "
+                               "at most this many steps late (see StrSumo); 0 decides before every step")
+    options, args = opt_parser.parse_args()
+    return options
+
+
+if __name__ == "__main__":
+    options = get_options()
+    policies = options.policies.split(",")
+    for policy in policies:
+        if policy not in POLICIES:
+            sys.exit("Unknown policy '{}', expected one of {}".format(policy, ",".join(POLICIES)))
+    cells = build_cells(policies, options.maps.split(","), [int(seed) for seed in options.seeds.split(",")],
+                        [int(count) for count in options.vehicles.split(",")], options.uncontrolled,
+                        options.pattern, options.output_dir, options.backend, options.profile,
+                        options.record, options.pipeline_lag)
+    results_file = os.path.join(options.output_dir, "results.csv")
+    run_experiments(cells, options.workers, results_file)
+    print("Results of {} experiments written to {}".format(len(cells), results_file))
@@ -9,6 +9,9 @@ from xml.dom.minidom import parse, parseString
 from core.Util import *
 from controller.RouteController import *
 from controller.DijkstraController import DijkstraPolicy
+from controller.AStarController import AStarPolicy
+from controller.ALTController import ALTPolicy
+from controller.CHController import CHPolicy
 from core.target_vehicles_generation_protocols import *
 
 if 'SUMO_HOME' in os.environ:
@@ -18,7 +21,19 @@ else:
     sys.exit("No environment variable SUMO_HOME!")
 
 from sumolib import checkBinary
-import traci
+from core.sumo_backend import traci
+from core import sumo_backend
+from core.step_profiler import StepProfiler
+from core.result_sink import configure_diagnostics
+from core.trace_log import TraceRecorder
+import optparse
+
+# set by --profile: run every simulation with a StepProfiler
+profile = False
+# set by --record: log the inputs of the route controller of every simulation (see core/trace_log.py)
+record = False
+# set by --pipeline-lag: compute the decisions on a worker thread, applied at most this many steps late
+pipeline_lag = 0
 
 
 # use vehicle generation protocols to generate vehicle list
@@ -54,6 +69,21 @@ def test_dijkstra_policy(vehicles):
     scheduler = DijkstraPolicy(init_connection_info)
     run_simulation(scheduler, vehicles)
 
+def test_astar_policy(vehicles):
+    print("Testing A* Route Controller")
+    scheduler = AStarPolicy(init_connection_info)
+    run_simulation(scheduler, vehicles)
+
+def test_alt_policy(vehicles):
+    print("Testing ALT (landmarks) Route Controller")
+    scheduler = ALTPolicy(init_connection_info)
+    run_simulation(scheduler, vehicles)
+
+def test_ch_policy(vehicles):
+    print("Testing Contraction Hierarchy Route Controller")
+    scheduler = CHPolicy(init_connection_info)
+    run_simulation(scheduler, vehicles)
+
 def test_random_policy(vehicles):
     print("Testing RANDOM's Algorithm Route Controller")
     scheduler = RandomPolicy(init_connection_info)
@@ -66,21 +96,68 @@ def test_nathan_policy(vehicles):
 
 def run_simulation(scheduler, vehicles):
 
-    simulation = StrSumo(scheduler, init_connection_info, vehicles)
+    profiler = StepProfiler() if profile else None
+    recorder = None
+    if record:
+        trace_file = "./configurations/trace-{}.bin".format(type(scheduler).__name__)
+        recorder = TraceRecorder(trace_file, init_connection_info, vehicles)
+    simulation = StrSumo(scheduler, init_connection_info, vehicles, profiler, recorder, pipeline_lag=pipeline_lag)
 
-    traci.start([sumo_binary, "-c", "./configurations/myconfig.sumocfg", \
-                 "--tripinfo-output", "./configurations/trips.trips.xml", \
-                 "--fcd-output", "./configurations/testTrace.xml"])
+    sumo_backend.start([sumo_binary, "-c", "./configurations/myconfig.sumocfg", \
+                        "--tripinfo-output", "./configurations/trips.trips.xml", \
+                        "--fcd-output", "./configurations/testTrace.xml"])
 
-    total_time, end_number, deadlines_missed = simulation.run()
+    total_time, end_number, deadlines_missed, trip_records = simulation.run(return_records=True)
     print("Average timespan: {}, total vehicle number: {}".format(str(total_time/end_number),\
         str(end_number)))
     print(str(deadlines_missed) + ' deadlines missed.')
     traci.close()
+    trips_file = "./configurations/results-{}.csv".format(type(scheduler).__name__)
+    trip_records.save(trips_file)
+    print("Per-vehicle results written to " + trips_file)
+    if profiler is not None:
+        print(profiler.format_summary())
+        profile_file = "./configurations/profile-{}.csv".format(type(scheduler).__name__)
+        profiler.save(profile_file)
+        print("Per-step profile written to " + profile_file)
+    if recorder is not None:
+        print("Controller inputs recorded in {}, replay them with replay.py".format(recorder.filename))
+
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--nogui", action="store_true", default=False,
+                          help="run the command line version of SUMO")
+    opt_parser.add_option("--backend", choices=sumo_backend.BACKENDS, default=None,
+                          help="drive SUMO through 'traci' (socket) or 'libsumo' (in-process, implies --nogui); "
+                               "defaults to $" + sumo_backend.BACKEND_ENV + " or 'traci'")
+    opt_parser.add_option("--profile", action="store_true", default=False,
+                          help="time the phases of every simulation step and count the TraCI calls, "
+                               "see core/step_profiler.py")
+    opt_parser.add_option("--record", action="store_true", default=False,
+                          help="log the inputs of the route controller at every step into "
+                               "configurations/trace-<policy>.bin, to be replayed without SUMO by replay.py")
+    opt_parser.add_option("--pipeline-lag", dest="pipeline_lag", type="int", default=0,
+                          help="compute the routing decisions on a worker thread while SUMO advances and apply them "
+                               "at most this many steps late; 0 (default) decides before every step")
+    opt_parser.add_option("--log-level", dest="log_level", choices=["debug", "info", "warning", "error"],
+                          default="warning",
+                          help="diagnostics printed during the run: 'info' adds a line per arrived vehicle, "
+                               "'debug' every routing decision (see core/result_sink.py)")
+    options, args = opt_parser.parse_args()
+    return options
 
 if __name__ == "__main__":
+    options = get_options()
+    if options.backend is not None:
+        sumo_backend.use_backend(options.backend)
+
     sumo_binary = checkBinary('sumo-gui')
-    #sumo_binary = checkBinary('sumo')#use this line if you do not want the UI of SUMO
+    if options.nogui or sumo_backend.uses_libsumo():
+        sumo_binary = checkBinary('sumo')#no UI of SUMO
+    profile = options.profile
+    record = options.record
+    pipeline_lag = options.pipeline_lag
+    configure_diagnostics(options.log_level)
 
     # parse config file for map file name
     dom = parse("./configurations/myconfig.sumocfg")
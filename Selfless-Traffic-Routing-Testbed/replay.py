@@ -0,0 +1,74 @@
+'''
+Replays a log of route controller inputs (recorded with `--record`, see core/trace_log.py)
+through a routing policy, with no SUMO process.
+
+The policy receives, step by step, the very edge counts and vehicle batches of the
+recorded run, so it can be timed (or profiled with e.g. cProfile) on a real traffic
+trace in a fraction of the time of a live simulation. The traffic is the recorded one:
+the decisions of the replayed policy do not act on it, so a policy other than the
+recorded one is measured on the traffic produced by the recorded one.
+
+Example:
+    python3 main.py --nogui --record
+    python3 replay.py --trace configurations/trace-DijkstraPolicy.bin --policies dijkstra,astar --repeat 3
+'''
+import optparse
+import os
+import sys
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("No environment variable SUMO_HOME!")
+
+from core.Util import ConnectionInfo
+from core.trace_log import read_trace, replay
+from experiment_runner import POLICIES
+
+
+def replay_policy(trace_file, policy, net_file, repeat):
+    '''
+    :param @trace_file <str>: log written by TraceRecorder
+    :param @policy <str>: key of experiment_runner.POLICIES
+    :param @net_file <str>: map the log was recorded on
+    :param @repeat <int>: number of replays, each with a fresh policy and ConnectionInfo
+    :return <list>: the statistics returned by trace_log.replay() for every replay
+    '''
+    results = []
+    for _ in range(repeat):
+        connection_info = ConnectionInfo(net_file)
+        scheduler = POLICIES[policy](connection_info)
+        results.append(replay(trace_file, scheduler, connection_info))
+    return results
+
+
+def get_options():
+    opt_parser = optparse.OptionParser()
+    opt_parser.add_option("--trace", help="log written with --record")
+    opt_parser.add_option("--policies", default="dijkstra",
+                          help="comma separated policies out of " + ",".join(POLICIES))
+    opt_parser.add_option("--map", default=None, help="map of the log; defaults to the one stored in the log")
+    opt_parser.add_option("--repeat", type="int", default=1, help="number of replays per policy")
+    options, args = opt_parser.parse_args()
+    return options
+
+
+if __name__ == "__main__":
+    options = get_options()
+    if not options.trace:
+        sys.exit("--trace is required")
+    policies = options.policies.split(",")
+    for policy in policies:
+        if policy not in POLICIES:
+            sys.exit("Unknown policy '{}', expected one of {}".format(policy, ",".join(POLICIES)))
+    net_file = options.map
+    if net_file is None:
+        net_file = read_trace(options.trace)[0]["net_file"]
+
+    for policy in policies:
+        for result in replay_policy(options.trace, policy, net_file, options.repeat):
+            decisions_per_s = result["decisions"] / result["decision_s"] if result["decision_s"] > 0 else 0.0
+            print("{}: {} steps, {} decisions, make_decisions {:.3f} s ({:.1f} decisions/s), replay {:.3f} s"
+                  .format(policy, result["steps"], result["decisions"], result["decision_s"], decisions_per_s,
+                          result["wall_s"]))
@@ -18,7 +18,8 @@ else:
     sys.exit("No environment variable SUMO_HOME!")
 
 from sumolib import checkBinary
-import traci
+from core.sumo_backend import traci
+from core import sumo_backend
 
 sumo_binary = checkBinary('sumo-gui')
 # sumo_binary = checkBinary('sumo')
@@ -61,8 +62,8 @@ def test_dijkstra_policy():
 def run_simulation(scheduler):
     simulation = StrSumo(scheduler, init_connection_info, route_file)
 
-    traci.start([sumo_binary, "-c", "./configurations/myconfig.sumocfg",
-                 "--tripinfo-output", "./configurations/trips.trips.xml", "--fcd-output", "./configurations/testTrace.xml"])
+    sumo_backend.start([sumo_binary, "-c", "./configurations/myconfig.sumocfg",
+                        "--tripinfo-output", "./configurations/trips.trips.xml", "--fcd-output", "./configurations/testTrace.xml"])
 
     total_time, end_number, deadlines_missed = simulation.run()
     print(str(total_time) + ' for ' + str(end_number) + ' vehicles.')
@@ -0,0 +1,140 @@
+'''
+This test file needs the following files:
+shortest_path.py, Util.py, test.net.xml and corresponding SUMO libraries.
+It checks that the heap based engine returns valid shortest paths: following the
+decision list from the start edge must end on the destination, and no other path
+found by an exhaustive relaxation may be shorter. A* must return the very same
+decision lists as the Dijkstra engine, with the straight-line and the landmark heuristics, and the
+contraction hierarchy must return routes of the same length. Shortest path trees repaired
+after weight changes must be identical to trees rebuilt from scratch.
+'''
+import random
+from core.Util import ConnectionInfo
+from core.shortest_path import shortest_path_directions, astar_directions, StraightLineHeuristic, INFINITY, \
+    ShortestPathTreeCache, reverse_dijkstra
+from core.landmarks import LandmarkIndex
+from core.contraction_hierarchy import ContractionHierarchy
+
+
+def print_test_passed():
+    print("---> TEST PASSED")
+
+def print_test_failed():
+    print("---> TEST FAILED")
+
+
+def route_length(connection_info, start_edge, decision_list):
+    # follow the decisions, return the edge reached and the length driven
+    current_edge = start_edge
+    length = connection_info.edge_length_dict[start_edge]
+    for direction in decision_list:
+        current_edge = connection_info.outgoing_edges_dict[current_edge][direction]
+        length += connection_info.edge_length_dict[current_edge]
+    return current_edge, length
+
+
+def bellman_ford_distance(connection_info, start_edge, destination):
+    # exhaustive relaxation, slow but obviously correct
+    distance = {edge: INFINITY for edge in connection_info.edge_index_dict}
+    distance[start_edge] = connection_info.edge_length_dict[start_edge]
+    changed = True
+    while changed:
+        changed = False
+        for edge, outgoing in connection_info.outgoing_edges_dict.items():
+            if distance[edge] >= INFINITY:
+                continue
+            for out_edge in outgoing.values():
+                new_distance = distance[edge] + connection_info.edge_length_dict[out_edge]
+                if new_distance < distance[out_edge] - 1e-9:
+                    distance[out_edge] = new_distance
+                    changed = True
+    return distance[destination]
+
+
+connection_info = ConnectionInfo("./configurations/test.net.xml")
+random.seed(0)
+
+print("************** shortest_path_directions ******************\n")
+passed = True
+for _ in range(20):
+    start_edge = random.choice(connection_info.edge_list)
+    destination = random.choice(connection_info.edge_list)
+    decision_list = shortest_path_directions(connection_info, start_edge, destination)
+
+    # follow the decisions and measure the route
+    current_edge, length = route_length(connection_info, start_edge, decision_list)
+
+    expected = bellman_ford_distance(connection_info, start_edge, destination)
+    if expected >= INFINITY:
+        passed = passed and decision_list == []
+    elif start_edge != destination:
+        passed = passed and current_edge == destination and abs(length - expected) < 1e-6
+
+if passed:
+    print_test_passed()
+else:
+    print_test_failed()
+print("\n")
+
+
+print("************** astar_directions ******************\n")
+heuristic = StraightLineHeuristic(connection_info)
+landmark_index = LandmarkIndex.build(connection_info, 4)
+passed = True
+for _ in range(200):
+    start_edge = random.choice(connection_info.edge_list)
+    destination = random.choice(connection_info.edge_list)
+    expected = shortest_path_directions(connection_info, start_edge, destination)
+    passed = passed and astar_directions(connection_info, start_edge, destination, heuristic) == expected
+    passed = passed and landmark_index.directions(start_edge, destination) == expected
+
+if passed:
+    print_test_passed()
+else:
+    print_test_failed()
+print("\n")
+
+
+print("************** ContractionHierarchy.directions ******************\n")
+hierarchy = ContractionHierarchy.build(connection_info)
+passed = True
+for _ in range(200):
+    start_edge = random.choice(connection_info.edge_list)
+    destination = random.choice(connection_info.edge_list)
+    expected = shortest_path_directions(connection_info, start_edge, destination)
+    decision_list = hierarchy.directions(start_edge, destination)
+    if expected == []:
+        passed = passed and decision_list == []
+        continue
+    current_edge, length = route_length(connection_info, start_edge, decision_list)
+    passed = passed and current_edge == destination and \
+        abs(length - route_length(connection_info, start_edge, expected)[1]) < 1e-6
+
+if passed:
+    print_test_passed()
+else:
+    print_test_failed()
+print("\n")
+
+
+print("************** ShortestPathTreeCache repair ******************\n")
+tree_cache = ShortestPathTreeCache(connection_info)
+destinations = random.sample(connection_info.edge_list, 10)
+edge_weights = dict(connection_info.edge_length_dict)
+passed = True
+for _ in range(50):
+    changes = {edge: edge_weights[edge] * random.choice([0.5, 2.0, 5.0])
+               for edge in random.sample(list(edge_weights), 3)}
+    edge_weights.update(changes)
+    tree_cache.update_edge_weights(changes)
+    for destination in destinations:
+        tree = tree_cache.get_tree(destination)
+        distances, next_hops = reverse_dijkstra(tree_cache.incoming_edges_dict, edge_weights, destination,
+                                                connection_info.edge_index_dict)
+        passed = passed and tree.distances == distances and tree.next_hops == next_hops
+
+if passed:
+    print_test_passed()
+else:
+    print_test_failed()
+print("\n")
@@ -0,0 +1,71 @@
+'''
+This test file needs the following files:
+result_sink.py and NumPy.
+It checks that TripRecords keeps every appended record when its columns grow, that a
+chunked TripRecords writes all records to its CSV file, and that the RateLimitFilter
+drops the messages of a kind beyond its limit and reports how many were dropped.
+'''
+import csv
+import logging
+import os
+import tempfile
+from core.result_sink import TripRecords, RateLimitFilter, TRIP_COLUMNS
+
+
+def print_test_passed():
+    print("---> TEST PASSED")
+
+def print_test_failed():
+    print("---> TEST FAILED")
+
+
+def append_trips(trip_records, number):
+    for i in range(number):
+        trip_records.append(str(i), float(i), float(2 * i + 10), 20.0, i % 3 != 0)
+
+
+print("************** TripRecords growth ******************\n")
+trip_records = TripRecords(capacity=2)
+append_trips(trip_records, 9)
+passed = len(trip_records) == 9 and \
+    trip_records.column("vehicle_id").tolist() == [str(i) for i in range(9)] and \
+    trip_records.column("timespan").tolist() == [float(i + 10) for i in range(9)] and \
+    trip_records.column("deadline_missed").tolist() == [2 * i + 10 > 20 for i in range(9)]
+if passed:
+    print_test_passed()
+else:
+    print_test_failed()
+print("\n")
+
+
+print("************** TripRecords chunked flush ******************\n")
+with tempfile.TemporaryDirectory() as directory:
+    trips_file = os.path.join(directory, "trips.csv")
+    trip_records = TripRecords(capacity=4, filename=trips_file, chunk_size=4)
+    append_trips(trip_records, 10)
+    trip_records.flush()
+    with open(trips_file) as f:
+        rows = list(csv.reader(f))
+passed = rows[0] == [name for name, _ in TRIP_COLUMNS] and [row[0] for row in rows[1:]] == \
+    [str(i) for i in range(10)] and len(trip_records) == 0 and trip_records.flushed == 10
+if passed:
+    print_test_passed()
+else:
+    print_test_failed()
+print("\n")
+
+
+print("************** RateLimitFilter ******************\n")
+rate_limit_filter = RateLimitFilter(max_per_interval=3, interval=3600.0)
+records = [logging.LogRecord("str_sumo", logging.WARNING, __file__, 0, "warning %s", (i,), None) for i in range(10)]
+shown = [rate_limit_filter.filter(record) for record in records]
+other = logging.LogRecord("str_sumo", logging.WARNING, __file__, 0, "other warning", (), None)
+rate_limit_filter.interval = 0.0
+late = logging.LogRecord("str_sumo", logging.WARNING, __file__, 0, "warning %s", (10,), None)
+passed = shown == [True] * 3 + [False] * 7 and rate_limit_filter.filter(other) and \
+    rate_limit_filter.filter(late) and late.getMessage() == "warning 10 [7 similar messages suppressed]"
+if passed:
+    print_test_passed()
+else:
+    print_test_failed()
+print("\n")